@@ -1,30 +1,20 @@
 #!/usr/bin/env python3
 
-import re
 import sys
 
-k = int(sys.argv[1])
+sys.path.append(sys.path[0] + "/..")
+from utils.train_metrics import LogState, RollingStats
 
-loss_sum = 0
-samples = 0
+k = int(sys.argv[1])
 
-last_k = []
+# Same numbers as always, with O(1) work per line; see utils/train_metrics.py for tracking many logs at once
+stats = RollingStats(window=k)
+log_state = LogState("stdin", 0)
 
 for line in sys.stdin:
+    for epoch, metric, loss in log_state.parse_line(line):
+        if metric == 'E':
+            stats.add(loss)
 
-    parts = line.split()
-
-    if parts and parts[0] == 'E:':
-        if 'inf' in parts[1]:
-            continue
-
-        loss = float(parts[1])
-        loss_sum += loss
-        samples += 1
-
-        last_k.append(loss)
-        if len(last_k) > k:
-            del last_k[0]
-
-print('avg E over {} samples: {}'.format(samples, loss_sum / samples))
-print('last {} E loss: {}'.format(len(last_k), sum(last_k) / len(last_k)))
+print('avg E over {} samples: {}'.format(stats.count, stats.mean()))
+print('last {} E loss: {}'.format(len(stats.window), stats.window_mean()))
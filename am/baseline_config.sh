@@ -20,6 +20,9 @@ export GOLD_DIR=/data/sls/scratch/haotang/ami/sls-data/${DATASET_NAME}
 # Always use IHM pdfids! (See Hao email from 1/17/18)
 export NPRED=3984
 
+# Acoustic model training backend: "hao" (frame-tdnn-learn-gpu, needs a GPU node) or "pytorch" (am/train_tdnn.py, CPU)
+export AM_BACKEND=hao
+
 # export ARCH_NAME="frame-tdnn-450x7-step0.05"
 export ARCH_NAME="frame-tdnn-450x7-step0.05-decay"
 
@@ -22,8 +22,10 @@ export GAN_FC=( 512 512 )
 export GAN_ACTIVATION=Sigmoid
 export GAN_FC_DELIM=$(printf "_%s" "${GAN_FC[@]}")
 
-export CNN_NAME=ENC_C_256_256_K_3_3_P_3_3_F_/LATENT_256/DEC_F__C_256_256_K_3_3_P_3_3/ACT_ReLU_BN_false_WEIGHT_INIT_xavier_uniform/OPT_Adam_LR_0.0001_EPOCHS_25_BATCH_256_DEBUG_false
-export AUGMENTED_DATA_BASE_DIR=${AUGMENTED_DATA}/cnn/$DATASET_NAME/$CNN_NAME
+# Multidecoder run whose augmented data to train on; utils/pipeline.py sets both from cnn/job_config.sh
+# (its EXPT_NAME and AUGMENTED_DATA_DIR), so the defaults only apply when running these scripts by hand
+export CNN_NAME=${CNN_NAME:-ENC_C_256_256_K_3_3_P_3_3_F_/LATENT_256/DEC_F__C_256_256_K_3_3_P_3_3/ACT_ReLU_BN_false_WEIGHT_INIT_xavier_uniform/OPT_Adam_LR_0.0001_EPOCHS_25_BATCH_256_DEBUG_false}
+export AUGMENTED_DATA_BASE_DIR=${AUGMENTED_DATA_BASE_DIR:-${AUGMENTED_DATA}/cnn/$DATASET_NAME/$CNN_NAME}
 
 export PREDICT_DOMAIN=sdm1
 export GOLD_DIR=/data/sls/scratch/haotang/ami/sls-data/${DATASET_NAME}
@@ -31,6 +33,13 @@ export GOLD_DIR=/data/sls/scratch/haotang/ami/sls-data/${DATASET_NAME}
 # Always use IHM pdfids! (See Hao email from 1/17/18)
 export NPRED=3984
 
+# Acoustic model training backend: "hao" (frame-tdnn-learn-gpu, needs a GPU node) or "pytorch" (am/train_tdnn.py, CPU)
+export AM_BACKEND=hao
+
+# Combined training: translate IHM training data into SDM1 on the fly with the trained multidecoder
+# (cnn/md_translate.py) instead of reading augment_md.py's train-src_ihm-tar_sdm1 ARK; needs AM_BACKEND=pytorch
+export AUGMENT_ON_THE_FLY=false
+
 # export ARCH_NAME="frame-tdnn-450x7-step0.05"
 export ARCH_NAME="frame-tdnn-450x7-step0.05-decay"
 
@@ -69,13 +69,25 @@ fi
 echo "Predicting log probabilities for split ${split}..."
 # Always use IHM pdfids, even for SDM1 (data are parallel -- see Hao email from 1/17/18)
 # Only use these environment variables if on 630 or 520 machines -- 510s don't work with them!
-OPENBLAS_CORETYPE=Sandybridge OMP_NUM_THREADS=4 /data/sls/scratch/haotang/ami/dist/nn-20171210-4c6c341-openblas/nnbin/frame-tdnn-predict \
-    --frame-scp $frame_split_file \
-    --param $model_dir/param-$MODEL_EPOCH \
-    --label $DATASET/ihm-pdfids.txt \
-    --print-logprob \
-    | tail -n+2 \
-    | python3 $UTILS/batch2ark.py \
+predict_logprobs() {
+    if [ "$AM_BACKEND" == "pytorch" ]; then
+        OMP_NUM_THREADS=4 python3 $MENG_ROOT/am/predict_tdnn.py \
+            --frame-scp $frame_split_file \
+            --param $model_dir/param-$MODEL_EPOCH \
+            --label $DATASET/ihm-pdfids.txt \
+            --print-logprob \
+            --format binary
+    else
+        OPENBLAS_CORETYPE=Sandybridge OMP_NUM_THREADS=4 /data/sls/scratch/haotang/ami/dist/nn-20171210-4c6c341-openblas/nnbin/frame-tdnn-predict \
+            --frame-scp $frame_split_file \
+            --param $model_dir/param-$MODEL_EPOCH \
+            --label $DATASET/ihm-pdfids.txt \
+            --print-logprob \
+            | tail -n+2 \
+            | python3 $UTILS/hao2binark.py
+    fi
+}
+predict_logprobs \
     | latgen-faster-mapped \
     --max-active=7000 \
     --beam=15 \
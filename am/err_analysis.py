@@ -3,48 +3,41 @@
 import sys
 
 import os
-import numpy as np
 sys.path.append("./")
+sys.path.append("./am")
+from frame_eval import evaluate_shards, load_gold, parse_eval_args, print_fer
 from utils.hao_data import write_kaldi_hao_ark, write_kaldi_hao_scp
 
-area = 'head'
-
-with open(sys.argv[1], 'r') as pred:
-    # Skip first line added to output by Hao script, so that we only read predictions
-    pred.readline()
-
-    with open(sys.argv[2], 'r') as gold:
-        output_dir = sys.argv[3]
-
-        print("Writing ARK...")
-        with open(os.path.join(output_dir, "errors.ark"), 'w') as ark_fd:
-            current_utt_id = None
-            for ell1, ell2 in zip(pred, gold):
-                if area == 'head':
-                    current_utt_id = ell1.rstrip('\n')
-                    area = 'body'
-
-                elif area == 'body' and ell1 == '.\n':
-                    current_utt_id = None
-                    area = 'head'
-
-                elif area == 'body':
-                    pred_ids = ell1.split()
-                    gold_ids = ell2.split()
-
-                    # 0 indicates incorrect, 1 indicates correct
-                    errors_array = np.zeros((1, len(pred_ids)))
-
-                    row = 0
-                    for p, q in zip(pred_ids, gold_ids):
-                        if p == q:
-                            errors_array[0, row] = 1
-                        row += 1
-
-                    write_kaldi_hao_ark(ark_fd, current_utt_id, errors_array)
-        print("Done writing ARK")
-        
-        print("Writing SCP...")
-        with open(os.path.join(output_dir, "errors.scp"), 'w') as scp_fd:
-            write_kaldi_hao_scp(scp_fd, os.path.join(output_dir, "errors.ark"))
-        print("Done writing SCP")
+# Usage: err_analysis.py <predictions> [<predictions> ...] <gold alignments> <output dir> [--workers N] [--text-ark]
+# Writes per-frame correctness (1 = correct, 0 = incorrect) to errors.npy/errors.idx in the output dir;
+# load with utils.hao_labels.load_label_store(os.path.join(output_dir, "errors"))
+# --text-ark additionally writes the old Hao-format errors.ark/errors.scp
+text_ark = "--text-ark" in sys.argv
+args, num_workers = parse_eval_args([arg for arg in sys.argv[1:] if arg != "--text-ark"])
+if len(args) < 3:
+    print("Usage: err_analysis.py <predictions> [<predictions> ...] <gold alignments> <output dir> [--workers N] [--text-ark]")
+    sys.exit(1)
+
+pred_paths = args[:-2]
+gold = load_gold(args[-2])
+output_dir = args[-1]
+
+# Skip first line added to output by Hao script, so that we only read predictions
+result = evaluate_shards(pred_paths, gold, num_workers=num_workers, skip_lines=1)
+print_fer(result)
+
+print("Writing error masks...")
+result.mask_store().save(os.path.join(output_dir, "errors"))
+print("Done writing error masks")
+
+if text_ark:
+    print("Writing ARK...")
+    with open(os.path.join(output_dir, "errors.ark"), 'w') as ark_fd:
+        for utt_id, mask in zip(result.utt_ids, result.masks):
+            write_kaldi_hao_ark(ark_fd, utt_id, mask.reshape((1, -1)))
+    print("Done writing ARK")
+
+    print("Writing SCP...")
+    with open(os.path.join(output_dir, "errors.scp"), 'w') as scp_fd:
+        write_kaldi_hao_scp(scp_fd, os.path.join(output_dir, "errors.ark"))
+    print("Done writing SCP")
@@ -2,36 +2,19 @@
 
 import sys
 
-pred = open(sys.argv[1])
-gold = open(sys.argv[2])
+sys.path.append("./am")
+from frame_eval import evaluate_shards, load_gold, parse_eval_args, print_fer
 
-total_error = 0
-nutt = 0
+# Usage: eval-frames.py <predictions> [<predictions> ...] <gold alignments> [--workers N]
+# Several prediction files (e.g. one per split30 shard) are evaluated in parallel and pooled
+args, num_workers = parse_eval_args(sys.argv[1:])
+if len(args) < 2:
+    print("Usage: eval-frames.py <predictions> [<predictions> ...] <gold alignments> [--workers N]")
+    sys.exit(1)
 
-area = 'head'
+pred_paths = args[:-1]
+gold = load_gold(args[-1])
 
 # Skip first line added to output by Hao script, so that we only read predictions
-pred.readline()
-
-for ell1, ell2 in zip(pred, gold):
-    if area == 'head':
-        area = 'body'
-
-    elif area == 'body' and ell1 == '.\n':
-        area = 'head'
-
-    elif area == 'body':
-        pred_ids = ell1.split()
-        gold_ids = ell2.split()
-
-        error = 0
-
-        for p, q in zip(pred_ids, gold_ids):
-            if p != q:
-                error += 1
-
-        total_error += error / len(pred_ids)
-
-        nutt += 1
-
-print("utt: %d error rate: %f (%.1f%%)" % (nutt, total_error / nutt, total_error / nutt * 100.0))
+result = evaluate_shards(pred_paths, gold, num_workers=num_workers, skip_lines=1)
+print_fer(result)
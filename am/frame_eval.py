@@ -0,0 +1,159 @@
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.append("./")
+from utils.hao_labels import HaoLabelStore, load_label_store
+
+# Frame error rate evaluation shared by eval-frames.py and err_analysis.py
+# Predictions (frame-tdnn-predict output) and gold alignments (*.bali) are both Hao-format text:
+# utterance ID line, space-separated integer pdf-ids, "." line
+
+# Yields (utt_id, int32 label array) for each utterance in a Hao-format label file
+# skip_lines drops leading lines (frame-tdnn-predict prints one extra line before the predictions)
+def read_label_utts(label_path, skip_lines=0):
+    with open(label_path, 'r') as label_fd:
+        for i in range(skip_lines):
+            label_fd.readline()
+
+        utt_id = None
+        body = []
+        for line in label_fd:
+            if utt_id is None:
+                utt_id = line.rstrip('\n')
+            elif line == ".\n" or line == ".":
+                yield utt_id, np.fromstring(" ".join(body), dtype=np.int32, sep=' ')
+                utt_id = None
+                body = []
+            else:
+                body.append(line)
+
+# Gold alignments as a label store of integer pdf-ids; uses a prebuilt <prefix>.npy/.idx store if one exists
+# (see utils/hao_labels.py). A store built with a pdf-id file holds output indices, which are mapped back to
+# pdf-ids here, since predictions are compared as pdf-ids.
+def load_gold(gold_path):
+    if os.path.exists(gold_path + ".npy") and os.path.exists(gold_path + ".idx"):
+        store = load_label_store(gold_path)
+        if store.pdfids is None:
+            return store
+        pdfid_ints = np.asarray([int(pdfid) for pdfid in store.pdfids], dtype=np.int32)
+        return HaoLabelStore(pdfid_ints[store.labels], store.utt_ids, store.offsets, store.lengths)
+
+    utt_ids = []
+    label_arrays = []
+    for utt_id, labels in read_label_utts(gold_path):
+        utt_ids.append(utt_id)
+        label_arrays.append(labels)
+    lengths = np.asarray([len(labels) for labels in label_arrays], dtype=np.int32)
+    offsets = np.zeros(len(lengths), dtype=np.int64)
+    if len(lengths) > 1:
+        offsets[1:] = np.cumsum(lengths[:-1])
+    labels = np.concatenate(label_arrays) if len(label_arrays) > 0 else np.empty(0, dtype=np.int32)
+    return HaoLabelStore(labels, utt_ids, offsets, lengths)
+
+# Per-utterance results for one prediction file
+class FrameEvalResult(object):
+    def __init__(self, utt_ids, num_frames, num_errors, masks):
+        self.utt_ids = utt_ids
+        self.num_frames = num_frames    # Number of predicted frames per utterance
+        self.num_errors = num_errors
+        self.masks = masks              # Per-frame correctness (1 = correct) per utterance
+
+    def __len__(self):
+        return len(self.utt_ids)
+
+    # Mean of per-utterance error rates (what eval-frames.py has always reported)
+    def utt_fer(self):
+        return np.mean(self.num_errors / np.maximum(self.num_frames, 1))
+
+    # Total errors over total frames
+    def corpus_fer(self):
+        return self.num_errors.sum() / max(self.num_frames.sum(), 1)
+
+    # Correctness masks packed like a label store: uint8 array + "utt_id offset length" index
+    def mask_store(self):
+        lengths = np.asarray([len(mask) for mask in self.masks], dtype=np.int32)
+        offsets = np.zeros(len(lengths), dtype=np.int64)
+        if len(lengths) > 1:
+            offsets[1:] = np.cumsum(lengths[:-1])
+        masks = np.concatenate(self.masks) if len(self.masks) > 0 else np.empty(0, dtype=np.uint8)
+        return HaoLabelStore(masks, self.utt_ids, offsets, lengths)
+
+def merge_results(results):
+    utt_ids = []
+    masks = []
+    for result in results:
+        utt_ids.extend(result.utt_ids)
+        masks.extend(result.masks)
+    return FrameEvalResult(utt_ids,
+                           np.concatenate([result.num_frames for result in results]),
+                           np.concatenate([result.num_errors for result in results]),
+                           masks)
+
+def evaluate(pred_path, gold, skip_lines=1):
+    return evaluate_utts(read_label_utts(pred_path, skip_lines=skip_lines), gold)
+
+# pred_utts: iterable of (utt_id, integer pdf-id array), e.g. straight from an in-process predictor
+def evaluate_utts(pred_utts, gold):
+    utt_ids = []
+    num_frames = []
+    num_errors = []
+    masks = []
+    for utt_id, pred_labels in pred_utts:
+        if utt_id not in gold:
+            raise RuntimeError("No gold labels for utterance %s" % utt_id)
+        gold_labels = gold.labels_for_uttid(utt_id)
+
+        # Compare over the shorter of the two, as zip() always did
+        num_compared = min(len(pred_labels), len(gold_labels))
+        mask = (pred_labels[:num_compared] == gold_labels[:num_compared]).astype(np.uint8)
+
+        utt_ids.append(utt_id)
+        num_frames.append(len(pred_labels))
+        num_errors.append(num_compared - int(mask.sum()))
+        masks.append(mask)
+    return FrameEvalResult(utt_ids,
+                           np.asarray(num_frames, dtype=np.int64),
+                           np.asarray(num_errors, dtype=np.int64),
+                           masks)
+
+# Set before forking the pool so each worker shares the parent's (read-only) gold labels
+shard_gold = None
+
+def evaluate_shard(args):
+    pred_path, skip_lines = args
+    return evaluate(pred_path, shard_gold, skip_lines=skip_lines)
+
+# Evaluate several prediction files (e.g. one per split30 shard) in a process pool
+def evaluate_shards(pred_paths, gold, num_workers=1, skip_lines=1):
+    global shard_gold
+    if num_workers <= 1 or len(pred_paths) <= 1:
+        return merge_results([evaluate(pred_path, gold, skip_lines=skip_lines) for pred_path in pred_paths])
+
+    shard_gold = gold
+    with Pool(min(num_workers, len(pred_paths))) as pool:
+        results = pool.map(evaluate_shard, [(pred_path, skip_lines) for pred_path in pred_paths])
+    shard_gold = None
+    return merge_results(results)
+
+def print_fer(result, out=sys.stdout):
+    print("utt: %d error rate: %f (%.1f%%)" % (len(result), result.utt_fer(), result.utt_fer() * 100.0), file=out)
+    print("frames: %d corpus error rate: %f (%.1f%%)" % (result.num_frames.sum(),
+                                                         result.corpus_fer(),
+                                                         result.corpus_fer() * 100.0), file=out)
+
+# Parse "<pred> [<pred> ...] <gold> [--workers N]"-style command lines shared by both front-ends
+def parse_eval_args(argv):
+    num_workers = 1
+    args = []
+    i = 0
+    while i < len(argv):
+        if argv[i] == "--workers":
+            num_workers = int(argv[i + 1])
+            i += 2
+        else:
+            args.append(argv[i])
+            i += 1
+    return args, num_workers
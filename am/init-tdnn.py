@@ -1,47 +1,76 @@
 #!/usr/bin/env python3
 
 import os
-import random
 import sys
-import json
-import math
+
+import numpy as np
 
 sys.path.append("./am")
-from nninit import gen_mat, gen_vec
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from nninit import dump_mat, dump_vec, uniform_mat
+
+# Usage: init-tdnn.py <random|zero> [--seed N] [--npz <path>]
+# Architecture comes from the environment (defaults are the 450x7 TDNN used so far):
+#   NPRED            softmax size (required)
+#   TDNN_INPUT_DIM   input feature dimension (default 80)
+#   TDNN_HIDDEN_DIMS "_"-delimited width per layer, or a single width for all layers (default 450)
+#   TDNN_CONTEXTS    ","-separated per-layer contexts with "_"-delimited offsets (default -1_0_1 x3, -3_0_3 x4)
+#   TDNN_SEED        seed when --seed is not given (default 1)
+# --npz additionally saves every tensor (and the contexts) to a NumPy archive
 
-layer = 7
+if len(sys.argv) < 2 or sys.argv[1] not in ["random", "zero"]:
+    print("Usage: init-tdnn.py <random|zero> [--seed N] [--npz <path>]", flush=True)
+    sys.exit(1)
+
+init_mode = sys.argv[1]
+seed = int(os.environ.get("TDNN_SEED", "1"))
+npz_path = None
+i = 2
+while i < len(sys.argv):
+    if sys.argv[i] == "--seed":
+        seed = int(sys.argv[i + 1])
+    elif sys.argv[i] == "--npz":
+        npz_path = sys.argv[i + 1]
+    else:
+        print("Unknown argument %s" % sys.argv[i], flush=True)
+        sys.exit(1)
+    i += 2
+
+contexts = [[int(offset) for offset in context.split("_")]
+            for context in os.environ.get("TDNN_CONTEXTS", "-1_0_1,-1_0_1,-1_0_1,-3_0_3,-3_0_3,-3_0_3,-3_0_3").split(",")]
+layer = len(contexts)
 # ninput = 140
-ninput = 80
-nhidden = 450
+ninput = int(os.environ.get("TDNN_INPUT_DIM", "80"))
+hidden_dims = [int(dim) for dim in os.environ.get("TDNN_HIDDEN_DIMS", "450").split("_") if len(dim) > 0]
+if len(hidden_dims) == 1:
+    hidden_dims = hidden_dims * layer
+if len(hidden_dims) != layer:
+    print("Got %d hidden widths for %d layers" % (len(hidden_dims), layer), flush=True)
+    sys.exit(1)
 npred = int(os.environ["NPRED"])
 
-print('-1 0 1')
-print('-1 0 1')
-print('-1 0 1')
-print('-3 0 3')
-print('-3 0 3')
-print('-3 0 3')
-print('-3 0 3')
-print('#')
-    
-zero = lambda d: 0.0
-
-if sys.argv[1] == 'random':
-    gen = lambda d: random.uniform(-math.sqrt(6 / d), math.sqrt(6 / d))
-    ggen = lambda z: lambda d: random.uniform(-math.sqrt(6 / z), math.sqrt(6 / z))
-else:
-    gen = zero
-    ggen = lambda z: zero
+rng = np.random.RandomState(seed) if init_mode == "random" else None
+out = sys.stdout
+
+for context in contexts:
+    out.write(' '.join([str(offset) for offset in context]) + '\n')
+out.write('#\n')
 
+tensors = dict()
 for i in range(layer):
-    if i == 0:
-        gen_mat(ninput, 3 * nhidden, gen)
-        gen_vec(nhidden, zero)
-    else:
-        gen_mat(nhidden, 3 * nhidden, gen)
-        gen_vec(nhidden, zero)
+    nin = ninput if i == 0 else hidden_dims[i - 1]
+    nout = len(contexts[i]) * hidden_dims[i]
+    tensors["layer%d_mat" % i] = uniform_mat(rng, nin, nout, nin + nout)
+    dump_mat(tensors["layer%d_mat" % i], out)
+    tensors["layer%d_vec" % i] = np.zeros(hidden_dims[i], dtype=np.float32)
+    dump_vec(tensors["layer%d_vec" % i], out)
 
 # softmax
-gen_mat(nhidden, npred, ggen(nhidden))
-gen_vec(npred, zero)
+tensors["softmax_mat"] = uniform_mat(rng, hidden_dims[-1], npred, hidden_dims[-1])
+dump_mat(tensors["softmax_mat"], out)
+tensors["softmax_vec"] = np.zeros(npred, dtype=np.float32)
+dump_vec(tensors["softmax_vec"], out)
+out.flush()
 
+if npz_path is not None:
+    np.savez(npz_path, contexts=np.asarray([",".join(map(str, context)) for context in contexts]), **tensors)
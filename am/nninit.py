@@ -1,54 +1,63 @@
 import sys
 
-def dump_vec(vec):
-    sys.stdout.write('(')
-    sys.stdout.write('[{}], '.format(len(vec)))
-    sys.stdout.write('[{}]'.format(', '.join(['{:.6}'.format(e) for e in vec])))
-    sys.stdout.write(')\n')
-
-def dump_mat(mat):
-    sys.stdout.write('(')
-    sys.stdout.write('[{}, {}], '.format(len(mat), len(mat[0])))
-    sys.stdout.write('[')
-    for i, v in enumerate(mat):
-        sys.stdout.write(', '.join(['{:.6}'.format(e) for e in v]))
-
-        if i != len(mat) - 1:
-            sys.stdout.write(', ')
-    sys.stdout.write(']')
-    sys.stdout.write(')\n')
-
-def gen_mat(m, n, gen):
-    w = []
-    for i in range(m):
-        v = []
-        for j in range(n):
-            v.append(gen(n + m))
-        w.append(v)
-    dump_mat(w)
-
-def gen_vec(n, gen):
-    v = []
-    for j in range(n):
-        v.append(gen(n))
-    dump_vec(v)
-
-def dump_tensor(sizes, vec):
-    sys.stdout.write('(')
-    sys.stdout.write('[{}]'.format(', '.join([str(s) for s in sizes])))
-    sys.stdout.write(', ')
-    sys.stdout.write('[{}]'.format(', '.join(['{:.6}'.format(e) for e in vec])))
-    sys.stdout.write(')\n')
-
-def gen_tensor(sizes, gen):
-    d = 0 if len(sizes) == 0 else 1
-
-    for s in sizes:
-        d *= s
-
-    result = []
-    for i in range(d):
-        result.append(gen(d / sizes[0]))
-
-    dump_tensor(sizes, result)
-
+import numpy as np
+
+# Writers for the frame-tdnn param text format: one "([sizes], [values])" line per tensor
+# Values are written with '%.6g' in chunks of rows, so a whole matrix never becomes one Python string;
+# all-zero tensors (the biases) are written as "0.0", exactly as '{:.6}' always wrote them
+
+chunk_values = 1 << 16     # Values formatted per write
+
+def format_values(values):
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if not values.any():
+        return ', '.join(['0.0'] * len(values))
+    return ', '.join(map('%.6g'.__mod__, values.tolist()))
+
+def dump_values(values, out):
+    values = np.asarray(values).ravel()
+    for start in range(0, len(values), chunk_values):
+        if start > 0:
+            out.write(', ')
+        out.write(format_values(values[start:start + chunk_values]))
+
+def dump_vec(vec, out=sys.stdout):
+    out.write('(')
+    out.write('[{}], '.format(len(vec)))
+    out.write('[')
+    dump_values(vec, out)
+    out.write('])\n')
+
+def dump_mat(mat, out=sys.stdout):
+    mat = np.asarray(mat)
+    out.write('(')
+    out.write('[{}, {}], '.format(mat.shape[0], mat.shape[1]))
+    out.write('[')
+    dump_values(mat, out)
+    out.write('])\n')
+
+def dump_tensor(sizes, vec, out=sys.stdout):
+    out.write('(')
+    out.write('[{}]'.format(', '.join([str(s) for s in sizes])))
+    out.write(', ')
+    out.write('[')
+    dump_values(vec, out)
+    out.write('])\n')
+
+# Uniform in [-sqrt(6 / fan), sqrt(6 / fan)] (Glorot), one NumPy call per tensor
+# rng is a np.random.RandomState; rng=None gives zeros
+def uniform_mat(rng, m, n, fan):
+    if rng is None:
+        return np.zeros((m, n), dtype=np.float32)
+    bound = np.sqrt(6.0 / fan)
+    return rng.uniform(-bound, bound, size=(m, n)).astype(np.float32)
+
+def gen_mat(m, n, rng, out=sys.stdout):
+    mat = uniform_mat(rng, m, n, n + m)
+    dump_mat(mat, out)
+    return mat
+
+def gen_vec(n, out=sys.stdout):
+    vec = np.zeros(n, dtype=np.float32)
+    dump_vec(vec, out)
+    return vec
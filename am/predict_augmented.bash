@@ -68,17 +68,25 @@ echo "Logging results to $predict_log"
 
 echo "Predicting using TDNN..."
 # Always use IHM pdfids, even for SDM1 (data are parallel -- see Hao email from 1/17/18)
-OPENBLAS_CORETYPE=Sandybridge OMP_NUM_THREADS=4 /data/sls/scratch/haotang/ami/dist/nn-20171210-4c6c341-openblas/nnbin/frame-tdnn-predict \
-    --frame-scp $DATASET/${pre_domain}-dev-norm.blogmel.scp \
-    --param $model_dir/param-$MODEL_EPOCH \
-    --label $DATASET/ihm-pdfids.txt \
-    > $predict_log
+if [ "$AM_BACKEND" == "pytorch" ]; then
+    OMP_NUM_THREADS=4 python3 $MENG_ROOT/am/predict_tdnn.py \
+        --frame-scp $DATASET/${pre_domain}-dev-norm.blogmel.scp \
+        --param $model_dir/param-$MODEL_EPOCH \
+        --label $DATASET/ihm-pdfids.txt \
+        > $predict_log
+else
+    OPENBLAS_CORETYPE=Sandybridge OMP_NUM_THREADS=4 /data/sls/scratch/haotang/ami/dist/nn-20171210-4c6c341-openblas/nnbin/frame-tdnn-predict \
+        --frame-scp $DATASET/${pre_domain}-dev-norm.blogmel.scp \
+        --param $model_dir/param-$MODEL_EPOCH \
+        --label $DATASET/ihm-pdfids.txt \
+        > $predict_log
+fi
 echo "Done predicting using TDNN."
 
 # Get FER for run
 python $MENG_ROOT/am/eval-frames.py $predict_log $GOLD_DIR/ihm-dev-tri3.bali
 
-# Evaluate errors
-python $MENG_ROOT/am/err_analysis.py $predict_log $GOLD_DIR/ihm-dev-tri3.bali $log_dir/predict_${pre_domain}
+# Evaluate errors (--text-ark also writes errors.ark/errors.scp, which notebooks/Error Analysis.ipynb reads)
+python $MENG_ROOT/am/err_analysis.py $predict_log $GOLD_DIR/ihm-dev-tri3.bali $log_dir/predict_${pre_domain} --text-ark
 
 echo "DONE AUGMENTED ACOUSTIC MODEL PREDICTION JOB"
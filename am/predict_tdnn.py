@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+import numpy as np
+
+import torch
+from torch.utils.data import DataLoader
+
+sys.path.append("./")
+sys.path.append("./am")
+sys.path.append(sys.path[0] + "/..")
+from utils.hao_data import HaoEvalDataset, write_kaldi_binary_mat
+from utils.hao_labels import read_pdfids
+from nninit import format_values
+from tdnn import load_tdnn, length_batches, collate_utts
+from frame_eval import load_gold, evaluate_utts, print_fer
+
+# In-process replacement for frame-tdnn-predict: whole utterances, batched by length, through am/tdnn.py
+# Takes the same --frame-scp/--param/--label/--print-logprob options; extra options:
+#   --format text|binary   text is frame-tdnn-predict's layout (one header line, then utt ID, labels or
+#                          log-prob rows, "."); binary writes log-probs as a Kaldi binary ARK for latgen-faster-mapped
+#   --output <path>        default stdout
+#   --gold <bali>          print FER against gold alignments to stderr when done
+#   --batch-frames N       padded frames per forward pass (default 16384)
+#   --window N             utterances read ahead and bucketed together (default 256); output keeps SCP order
+#   --workers N            data loading processes (default 2)
+# Use OMP_NUM_THREADS (or --threads) to give one process every core instead of running split30 array jobs
+
+options = {
+    "--frame-scp": None,
+    "--param": None,
+    "--label": None,
+    "--format": "text",
+    "--output": None,
+    "--gold": None,
+    "--batch-frames": os.environ.get("TDNN_BATCH_FRAMES", "16384"),
+    "--window": "256",
+    "--workers": os.environ.get("TDNN_LOADER_WORKERS", "2"),
+    "--threads": os.environ.get("OMP_NUM_THREADS", None),
+}
+print_logprob = False
+i = 1
+while i < len(sys.argv):
+    if sys.argv[i] == "--print-logprob":
+        print_logprob = True
+        i += 1
+    elif sys.argv[i] in options:
+        options[sys.argv[i]] = sys.argv[i + 1]
+        i += 2
+    else:
+        print("Unknown option %s" % sys.argv[i], file=sys.stderr, flush=True)
+        sys.exit(1)
+
+for required in ["--frame-scp", "--param", "--label"]:
+    if options[required] is None:
+        print("Missing required option %s" % required, file=sys.stderr, flush=True)
+        sys.exit(1)
+binary = (options["--format"] == "binary")
+if binary and not print_logprob:
+    print("Binary output is only supported for log-probs (--print-logprob)", file=sys.stderr, flush=True)
+    sys.exit(1)
+if options["--threads"] is not None:
+    torch.set_num_threads(int(options["--threads"]))
+
+pdfids = read_pdfids(options["--label"])
+gold = None
+if options["--gold"] is not None:
+    gold = load_gold(options["--gold"])
+    pdfid_ints = np.asarray([int(pdfid) for pdfid in pdfids], dtype=np.int32)
+
+model = load_tdnn(options["--param"])
+model.eval()
+
+dataset = HaoEvalDataset(options["--frame-scp"])
+window = int(options["--window"])
+windows = [list(range(start, min(start + window, len(dataset)))) for start in range(0, len(dataset), window)]
+loader = DataLoader(dataset,
+                    batch_sampler=windows,
+                    num_workers=int(options["--workers"]),
+                    collate_fn=lambda items: items)
+
+if options["--output"] is not None:
+    out_fd = open(options["--output"], 'wb' if binary else 'w')
+else:
+    out_fd = sys.stdout.buffer if binary else sys.stdout
+if not binary:
+    # Header line, as printed by frame-tdnn-predict (consumers skip it with tail -n+2 / skip_lines=1)
+    out_fd.write("param: %s\n" % options["--param"])
+
+pred_utts = []
+with torch.no_grad():
+    for items in loader:
+        # Bucket the window by length; results are written back in SCP order
+        results = [None] * len(items)
+        lengths = [item[0].size()[0] for item in items]
+        for batch in length_batches(lengths, int(options["--batch-frames"])):
+            feats, batch_lengths, utt_ids = collate_utts([items[idx] for idx in batch])
+            log_probs = model(feats, batch_lengths).numpy()
+            for batch_idx, idx in enumerate(batch):
+                results[idx] = log_probs[batch_idx, :lengths[idx], :]
+
+        for item, utt_log_probs in zip(items, results):
+            utt_id = item[2]
+            if gold is not None:
+                pred_utts.append((utt_id, pdfid_ints[np.argmax(utt_log_probs, axis=1)]))
+
+            if binary:
+                write_kaldi_binary_mat(out_fd, utt_id, utt_log_probs)
+                continue
+
+            out_fd.write(utt_id + "\n")
+            if print_logprob:
+                for row in utt_log_probs:
+                    out_fd.write(format_values(row).replace(", ", " ") + "\n")
+            else:
+                labels = np.argmax(utt_log_probs, axis=1)
+                out_fd.write(" ".join(pdfids[label] for label in labels) + "\n")
+            out_fd.write(".\n")
+        out_fd.flush()
+
+if options["--output"] is not None:
+    out_fd.close()
+
+if gold is not None:
+    print_fer(evaluate_utts(pred_utts, gold), out=sys.stderr)
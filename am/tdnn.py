@@ -0,0 +1,128 @@
+import sys
+
+import numpy as np
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+sys.path.append("./")
+sys.path.append("./am")
+from nninit import dump_mat, dump_vec
+from utils.hao_data import length_batches, collate_padded_utts
+
+# PyTorch version of the frame TDNN used by frame-tdnn-learn/frame-tdnn-predict
+# Param files: one line of context offsets per hidden layer (e.g. "-1 0 1"), "#", then a (mat, vec) pair per
+# hidden layer and one for the softmax. Hidden layer i has mat (nin, len(context) * nhidden), where columns
+# [j * nhidden, (j + 1) * nhidden) apply to the input frame at offset context[j]; activations are ReLU.
+# Whole utterances are run at once, so each hidden layer is a dilated Conv1d; frames past either end of the
+# utterance repeat the first/last frame at every layer.
+
+
+
+# PARAM FILES
+
+
+
+def parse_tensor_line(line):
+    sizes_str, values_str = line.strip()[2:-2].split("], [", 1)
+    sizes = [int(size) for size in sizes_str.split(",")]
+    values = np.fromstring(values_str, dtype=np.float32, sep=',')
+    return values.reshape(sizes)
+
+# Returns (contexts, tensors) with tensors in file order: mat, vec for each hidden layer, then softmax mat, vec
+def read_param(param_path):
+    contexts = []
+    tensors = []
+    with open(param_path, 'r') as param_fd:
+        for line in param_fd:
+            if line.strip() == "#":
+                break
+            contexts.append([int(offset) for offset in line.split()])
+        for line in param_fd:
+            if len(line.strip()) > 0:
+                tensors.append(parse_tensor_line(line))
+
+    if len(tensors) != 2 * (len(contexts) + 1):
+        raise RuntimeError("Param file %s has %d tensors for %d layers" % (param_path, len(tensors), len(contexts)))
+    return contexts, tensors
+
+def write_param(param_path, contexts, tensors):
+    with open(param_path, 'w') as param_fd:
+        for context in contexts:
+            param_fd.write(' '.join([str(offset) for offset in context]) + '\n')
+        param_fd.write('#\n')
+        for tensor in tensors:
+            if tensor.ndim == 2:
+                dump_mat(tensor, param_fd)
+            else:
+                dump_vec(tensor, param_fd)
+
+
+
+# MODEL
+
+
+
+class FrameTDNN(nn.Module):
+    def __init__(self, contexts, tensors):
+        super(FrameTDNN, self).__init__()
+
+        self.contexts = contexts
+        self.mats = nn.ParameterList()
+        self.vecs = nn.ParameterList()
+        for i in range(len(tensors) // 2):
+            self.mats.append(nn.Parameter(torch.FloatTensor(np.array(tensors[2 * i], dtype=np.float32))))
+            self.vecs.append(nn.Parameter(torch.FloatTensor(np.array(tensors[2 * i + 1], dtype=np.float32))))
+
+        # Contexts must be evenly spaced to be expressed as a dilated convolution
+        self.dilations = []
+        for context in contexts:
+            spacings = set(np.diff(context)) if len(context) > 1 else set([1])
+            if len(spacings) != 1 or min(spacings) <= 0:
+                raise RuntimeError("Context %s is not evenly spaced" % context)
+            self.dilations.append(int(spacings.pop()))
+
+    # Parameters in param file order, as NumPy arrays
+    def param_tensors(self):
+        tensors = []
+        for mat, vec in zip(self.mats, self.vecs):
+            tensors.append(mat.data.cpu().numpy())
+            tensors.append(vec.data.cpu().numpy())
+        return tensors
+
+    # feats: (batch, time, freq) padded with anything past each utterance's length
+    # lengths: LongTensor of utterance lengths
+    # Returns frame log-probs (batch, time, NPRED); entries past each utterance's length are meaningless
+    def forward(self, feats, lengths):
+        batch_size, max_len, feat_dim = feats.size()
+        h = feats.transpose(1, 2)
+        lengths = lengths.to(feats.device)
+        for i, context in enumerate(self.contexts):
+            # Repeat edge frames of each utterance to cover the context at both ends
+            positions = torch.arange(context[0], max_len + context[-1], device=feats.device).long()
+            positions = torch.min(positions.unsqueeze(0).clamp(min=0), (lengths - 1).unsqueeze(1))
+            padded = h.gather(2, positions.unsqueeze(1).expand(batch_size, h.size()[1], positions.size()[1]))
+
+            nhidden = self.vecs[i].size()[0]
+            weight = self.mats[i].view(self.mats[i].size()[0], len(context), nhidden).permute(2, 0, 1)
+            h = F.relu(F.conv1d(padded, weight, self.vecs[i], dilation=self.dilations[i]))
+
+        logits = torch.matmul(h.transpose(1, 2), self.mats[-1]) + self.vecs[-1]
+        return F.log_softmax(logits, dim=2)
+
+def load_tdnn(param_path):
+    contexts, tensors = read_param(param_path)
+    return FrameTDNN(contexts, tensors)
+
+
+
+# BATCHING WHOLE UTTERANCES
+
+
+
+# length_batches() is shared with the other HaoEvalDataset users in utils/hao_data.py
+# Collates HaoEvalDataset items into (feats (batch, max_len, freq), lengths, utt_ids); padding is zeros
+def collate_utts(items):
+    feats, lengths, mask, utt_ids = collate_padded_utts(items)
+    return feats, lengths, utt_ids
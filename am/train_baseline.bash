@@ -50,20 +50,37 @@ for epoch in $(seq $START_EPOCH $END_EPOCH); do
     fi
 
     # Always use IHM pdfids, even for SDM1 (data are parallel -- see Hao email from 1/17/18)
-    OMP_NUM_THREADS=1 /data/sls/scratch/haotang/ami/dist/nn-20171213-4c6c341/nnbin/frame-tdnn-learn-gpu \
-        --frame-scp $DATASET/${train_domain}-train-norm.blogmel.scp \
-        --label-scp $DATASET/ihm-train-tri3.bali.scp \
-        --param $model_dir/param-$((epoch-1)) \
-        --opt-data $model_dir/opt-data-$((epoch-1)) \
-        --output-param $model_dir/param-$epoch \
-        --output-opt-data $model_dir/opt-data-$epoch \
-        --label $DATASET/ihm-pdfids.txt \
-        --seed $epoch \
-        --shuffle \
-        --opt const-step \
-        --step-size $step_size \
-        --clip 5 \
-        > $epoch_log
+    if [ "$AM_BACKEND" == "pytorch" ]; then
+        python3 $MENG_ROOT/am/train_tdnn.py \
+            --frame-scp $DATASET/${train_domain}-train-norm.blogmel.scp \
+            --label-scp $DATASET/ihm-train-tri3.bali.scp \
+            --param $model_dir/param-$((epoch-1)) \
+            --opt-data $model_dir/opt-data-$((epoch-1)) \
+            --output-param $model_dir/param-$epoch \
+            --output-opt-data $model_dir/opt-data-$epoch \
+            --label $DATASET/ihm-pdfids.txt \
+            --seed $epoch \
+            --shuffle \
+            --opt const-step \
+            --step-size $step_size \
+            --clip 5 \
+            > $epoch_log
+    else
+        OMP_NUM_THREADS=1 /data/sls/scratch/haotang/ami/dist/nn-20171213-4c6c341/nnbin/frame-tdnn-learn-gpu \
+            --frame-scp $DATASET/${train_domain}-train-norm.blogmel.scp \
+            --label-scp $DATASET/ihm-train-tri3.bali.scp \
+            --param $model_dir/param-$((epoch-1)) \
+            --opt-data $model_dir/opt-data-$((epoch-1)) \
+            --output-param $model_dir/param-$epoch \
+            --output-opt-data $model_dir/opt-data-$epoch \
+            --label $DATASET/ihm-pdfids.txt \
+            --seed $epoch \
+            --shuffle \
+            --opt const-step \
+            --step-size $step_size \
+            --clip 5 \
+            > $epoch_log
+    fi
 
     # Show average E at end to make sure training progresses correctly
     $MENG_ROOT/am/avg-e.py 100 < $epoch_log
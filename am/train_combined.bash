@@ -58,10 +58,26 @@ else
     mkdir -p $model_dir
 fi
 
+if [ "$AUGMENT_ON_THE_FLY" == true ] && [ "$AM_BACKEND" != "pytorch" ]; then
+    echo "AUGMENT_ON_THE_FLY=true needs AM_BACKEND=pytorch; exiting"
+    exit 1
+fi
+
 # Create combined SCP file for IHM baseline + SDM1 augmented
-cat $DATASET/ihm-train-norm.blogmel.scp $augmented_data_dir/train-src_ihm-tar_sdm1.scp > $augmented_data_dir/train-combined.blogmel.scp
-sed -e 's/^/src_ihm_tar_sdm1_/' $DATASET/ihm-train-tri3.bali.scp > $augmented_data_dir/src_ihm_tar_sdm1-train-tri3.bali.scp
-cat $DATASET/ihm-train-tri3.bali.scp $augmented_data_dir/src_ihm_tar_sdm1-train-tri3.bali.scp > $augmented_data_dir/combined-train-tri3.bali.scp
+# (on-the-fly augmentation translates the IHM SCP inside train_tdnn.py instead, so only the labels are combined)
+# These go in the model directory: the augmented data directory may be a read-only artifact cache entry
+if [ "$AUGMENT_ON_THE_FLY" == true ]; then
+    md_config=$MENG_ROOT/cnn/job_config.sh
+    translate_args="--translate-scp $DATASET/ihm-train-norm.blogmel.scp --translate-source ihm --translate-target sdm1 --md-run-mode $run_mode --md-domain-adversarial $domain_adversarial --md-gan $gan"
+    frame_scp=$DATASET/ihm-train-norm.blogmel.scp
+else
+    md_config=/dev/null
+    translate_args=""
+    cat $DATASET/ihm-train-norm.blogmel.scp $augmented_data_dir/train-src_ihm-tar_sdm1.scp > $model_dir/train-combined.blogmel.scp
+    frame_scp=$model_dir/train-combined.blogmel.scp
+fi
+sed -e 's/^/src_ihm_tar_sdm1_/' $DATASET/ihm-train-tri3.bali.scp > $model_dir/src_ihm_tar_sdm1-train-tri3.bali.scp
+cat $DATASET/ihm-train-tri3.bali.scp $model_dir/src_ihm_tar_sdm1-train-tri3.bali.scp > $model_dir/combined-train-tri3.bali.scp
 
 for epoch in $(seq $START_EPOCH $END_EPOCH); do
     echo "========== EPOCH $epoch =========="
@@ -84,20 +100,40 @@ for epoch in $(seq $START_EPOCH $END_EPOCH); do
     fi
 
     # Always use IHM pdfids, even for SDM1 (data are parallel -- see Hao email from 1/17/18)
-    OMP_NUM_THREADS=1 /data/sls/scratch/haotang/ami/dist/nn-20171213-4c6c341/nnbin/frame-tdnn-learn-gpu \
-        --frame-scp $augmented_data_dir/train-combined.blogmel.scp \
-        --label-scp $augmented_data_dir/combined-train-tri3.bali.scp \
-        --param $model_dir/param-$((epoch-1)) \
-        --opt-data $model_dir/opt-data-$((epoch-1)) \
-        --output-param $model_dir/param-$epoch \
-        --output-opt-data $model_dir/opt-data-$epoch \
-        --label $DATASET/ihm-pdfids.txt \
-        --seed $epoch \
-        --shuffle \
-        --opt const-step \
-        --step-size $step_size \
-        --clip 5 \
-        > $epoch_log
+    if [ "$AM_BACKEND" == "pytorch" ]; then
+        # For on-the-fly augmentation, the multidecoder is built from (and found through) the CNN job config;
+        # the subshell keeps the AM settings intact
+        (. $md_config && python3 $MENG_ROOT/am/train_tdnn.py \
+            --frame-scp $frame_scp \
+            $translate_args \
+            --label-scp $model_dir/combined-train-tri3.bali.scp \
+            --param $model_dir/param-$((epoch-1)) \
+            --opt-data $model_dir/opt-data-$((epoch-1)) \
+            --output-param $model_dir/param-$epoch \
+            --output-opt-data $model_dir/opt-data-$epoch \
+            --label $DATASET/ihm-pdfids.txt \
+            --seed $epoch \
+            --shuffle \
+            --opt const-step \
+            --step-size $step_size \
+            --clip 5 \
+            > $epoch_log)
+    else
+        OMP_NUM_THREADS=1 /data/sls/scratch/haotang/ami/dist/nn-20171213-4c6c341/nnbin/frame-tdnn-learn-gpu \
+            --frame-scp $model_dir/train-combined.blogmel.scp \
+            --label-scp $model_dir/combined-train-tri3.bali.scp \
+            --param $model_dir/param-$((epoch-1)) \
+            --opt-data $model_dir/opt-data-$((epoch-1)) \
+            --output-param $model_dir/param-$epoch \
+            --output-opt-data $model_dir/opt-data-$epoch \
+            --label $DATASET/ihm-pdfids.txt \
+            --seed $epoch \
+            --shuffle \
+            --opt const-step \
+            --step-size $step_size \
+            --clip 5 \
+            > $epoch_log
+    fi
 
     # Show average E at end to make sure training progresses correctly
     $MENG_ROOT/am/avg-e.py 100 < $epoch_log
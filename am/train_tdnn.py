@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+import numpy as np
+
+import torch
+from torch.utils.data import ConcatDataset, DataLoader
+
+sys.path.append("./")
+sys.path.append("./am")
+sys.path.append(sys.path[0] + "/..")
+from utils.hao_data import HaoEvalDataset
+from utils.hao_labels import build_label_store, load_label_store, read_pdfids
+from tdnn import read_param, write_param, FrameTDNN, length_batches, collate_utts
+
+# CPU-friendly replacement for frame-tdnn-learn(-gpu); takes the same options and prints the same "E: <loss>" lines
+# (one per mini-batch of whole utterances, as the mean per-frame negative log-likelihood) for am/avg-e.py
+# Extra options: --batch-frames (padded frames per mini-batch, default 2048), --workers (data loading processes)
+# const-step keeps no optimizer state; opt-data is written in the param layout (all zeros) so the epoch loop finds it
+# --translate-scp adds the utterances of a source-class SCP translated on the fly by a trained multidecoder
+# (cnn/md_translate.py), in place of the augmented SCP augment_md.py would write; their IDs get the same
+# src_<source>_tar_<target>_ prefix, so the combined label SCP is unchanged. The multidecoder is built from the
+# cnn/job_config.sh environment, and --md-checkpoint defaults to its best checkpoint.
+
+options = {
+    "--frame-scp": None,
+    "--label-scp": None,
+    "--param": None,
+    "--opt-data": None,
+    "--output-param": None,
+    "--output-opt-data": None,
+    "--label": None,
+    "--seed": "1",
+    "--opt": "const-step",
+    "--step-size": "0.05",
+    "--clip": "0",
+    "--batch-frames": os.environ.get("TDNN_BATCH_FRAMES", "2048"),
+    "--workers": os.environ.get("TDNN_LOADER_WORKERS", "4"),
+    "--translate-scp": None,
+    "--translate-source": "ihm",
+    "--translate-target": "sdm1",
+    "--translate-noise": "0.0",
+    "--md-run-mode": "ae",
+    "--md-domain-adversarial": "false",
+    "--md-gan": "false",
+    "--md-checkpoint": None,
+}
+shuffle = False
+i = 1
+while i < len(sys.argv):
+    if sys.argv[i] == "--shuffle":
+        shuffle = True
+        i += 1
+    elif sys.argv[i] in options:
+        options[sys.argv[i]] = sys.argv[i + 1]
+        i += 2
+    else:
+        print("Unknown option %s" % sys.argv[i], flush=True)
+        sys.exit(1)
+
+for required in ["--frame-scp", "--label-scp", "--param", "--output-param", "--label"]:
+    if options[required] is None:
+        print("Missing required option %s" % required, flush=True)
+        sys.exit(1)
+if options["--opt"] != "const-step":
+    print("Only --opt const-step is supported", flush=True)
+    sys.exit(1)
+
+seed = int(options["--seed"])
+step_size = float(options["--step-size"])
+clip = float(options["--clip"])
+torch.manual_seed(seed)
+rng = np.random.RandomState(seed)
+if "OMP_NUM_THREADS" in os.environ:
+    torch.set_num_threads(int(os.environ["OMP_NUM_THREADS"]))
+
+# Labels as output indices; a prebuilt store (utils/hao_labels.py) is used if it was built with the same pdf-id file
+# and after the label SCP was last written (train_combined.bash rewrites its combined label SCP on every run)
+label_store = None
+label_store_prefix = options["--label-scp"]
+if os.path.exists(label_store_prefix + ".npy") and os.path.exists(label_store_prefix + ".idx"):
+    store_mtime = min(os.path.getmtime(label_store_prefix + ".npy"), os.path.getmtime(label_store_prefix + ".idx"))
+    if store_mtime < os.path.getmtime(options["--label-scp"]):
+        print("Label store %s.npy is older than its label SCP; rebuilding labels" % label_store_prefix, flush=True)
+    else:
+        label_store = load_label_store(label_store_prefix)
+        if label_store.pdfids != read_pdfids(options["--label"]):
+            print("Label store %s.npy was not built with pdf-id file %s; rebuilding labels" % (label_store_prefix,
+                                                                                            options["--label"]),
+                  flush=True)
+            label_store = None
+if label_store is None:
+    label_store = build_label_store(options["--label-scp"], pdfid_path=options["--label"])
+dataset = HaoEvalDataset(options["--frame-scp"])
+utt_ids = list(dataset.utt_ids)
+if options["--translate-scp"] is not None:
+    sys.path.append(os.path.join(sys.path[0], "..", "cnn"))
+    from md_translate import load_multidecoder, TranslatedHaoEvalDataset
+    md_model = load_multidecoder(options["--md-run-mode"],
+                                 domain_adversarial=options["--md-domain-adversarial"] == "true",
+                                 gan=options["--md-gan"] == "true",
+                                 ckpt_path=options["--md-checkpoint"])
+    translated_dataset = TranslatedHaoEvalDataset(HaoEvalDataset(options["--translate-scp"]),
+                                                  md_model,
+                                                  options["--translate-source"],
+                                                  options["--translate-target"],
+                                                  run_mode=options["--md-run-mode"],
+                                                  noise_ratio=float(options["--translate-noise"]),
+                                                  seed=seed)
+    utt_ids.extend(translated_dataset.utt_id(utt_idx) for utt_idx in range(len(translated_dataset)))
+    dataset = ConcatDataset([dataset, translated_dataset])
+lengths = [int(label_store.lengths[label_store.uttid_2_idx[utt_id]]) for utt_id in utt_ids]
+
+contexts, tensors = read_param(options["--param"])
+model = FrameTDNN(contexts, tensors)
+model.train()
+optimizer = torch.optim.SGD(model.parameters(), lr=step_size)
+
+batches = length_batches(lengths, int(options["--batch-frames"]), rng=rng if shuffle else None)
+loader = DataLoader(dataset,
+                    batch_sampler=batches,
+                    num_workers=int(options["--workers"]),
+                    collate_fn=collate_utts)
+
+for feats, batch_lengths, utt_ids in loader:
+    labels = torch.cat([torch.LongTensor(np.asarray(label_store.labels_for_uttid(utt_id), dtype=np.int64))
+                        for utt_id in utt_ids])
+    if labels.size()[0] != int(batch_lengths.sum()):
+        print("Frame/label count mismatch in batch containing %s" % utt_ids[0], flush=True)
+        sys.exit(1)
+
+    log_probs = model(feats, batch_lengths)
+    # Keep only real (unpadded) frames, in utterance order to line up with labels
+    mask = torch.arange(log_probs.size()[1]).unsqueeze(0) < batch_lengths.unsqueeze(1)
+    loss = -log_probs[mask].gather(1, labels.unsqueeze(1)).mean()
+
+    optimizer.zero_grad()
+    loss.backward()
+    if clip > 0:
+        torch.nn.utils.clip_grad_norm_(model.parameters(), clip)
+    optimizer.step()
+
+    print("E: %f" % loss.item(), flush=True)
+
+write_param(options["--output-param"], contexts, model.param_tensors())
+if options["--output-opt-data"] is not None:
+    write_param(options["--output-opt-data"], contexts, [np.zeros_like(tensor) for tensor in model.param_tensors()])
@@ -0,0 +1,357 @@
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+sys.path.append("./")
+sys.path.append(sys.path[0] + "/..")
+sys.path.append(os.path.join(sys.path[0], "..", "cnn"))
+from bench.synth_corpus import generate_corpus
+from cnn_md import CNNMultidecoder
+from md_translate import build_multidecoder, translate_utterances
+from utils.hao_data import HaoDataset, read_next_utt, read_scp_lines, write_kaldi_hao_ark, write_kaldi_hao_scp
+from utils.hao_data import length_batches
+
+# Times the data and model paths end to end on a synthetic corpus (see bench/synth_corpus.py):
+# ARK parsing, HaoDataset construction, per-batch loading, multidecoder forward/backward at several batch sizes,
+# per-utterance and length-bucketed augmentation and ARK/SCP writing. Every benchmark reports a throughput
+# (per second, higher is better); results go to JSON, and --baseline compares them against an earlier run to
+# catch regressions.
+# Each benchmark is run --repeats times and the fastest run is kept, which is the least noisy statistic on
+# shared machines.
+
+# Model shape from cnn/job_config.sh, used when the training environment isn't loaded
+DEFAULT_MODEL_KWARGS = {
+    "splicing": [5, 5],
+    "enc_channel_sizes": [256, 256],
+    "enc_kernel_sizes": [3, 3],
+    "enc_downsample_sizes": [3, 3],
+    "enc_fc_sizes": [],
+    "latent_dim": 256,
+    "dec_fc_sizes": [],
+    "dec_channel_sizes": [256, 256],
+    "dec_kernel_sizes": [3, 3],
+    "dec_upsample_sizes": [3, 3],
+    "activation": "ReLU",
+    "use_batch_norm": False,
+    "strided": False,
+    "decoder_classes": ["ihm", "sdm1"],
+    "weight_init": "xavier_uniform",
+}
+
+def build_bench_model(feat_dim):
+    if "ENC_CHANNELS_DELIM" in os.environ:
+        return build_multidecoder("ae")
+    return CNNMultidecoder(freq_dim=feat_dim, **DEFAULT_MODEL_KWARGS)
+
+# Returns (best seconds, value returned by the fastest call)
+def best_of(fn, repeats):
+    best_t = float('inf')
+    best_value = None
+    for i in range(repeats):
+        start_t = time.perf_counter()
+        value = fn()
+        elapsed = time.perf_counter() - start_t
+        if elapsed < best_t:
+            best_t = elapsed
+            best_value = value
+    return best_t, best_value
+
+def throughput(seconds, **counts):
+    result = {"seconds": seconds}
+    for name, count in counts.items():
+        result[name] = count
+        result[name + "_per_sec"] = count / seconds if seconds > 0 else 0.0
+    return result
+
+
+
+# BENCHMARKS
+
+
+
+def bench_read_next_utt(scp_path, repeats):
+    scp_lines = read_scp_lines(scp_path)
+
+    def run():
+        hao_ark_fd = None
+        num_frames = 0
+        for scp_line in scp_lines:
+            utt_id, feat_mat, hao_ark_fd = read_next_utt(scp_line, hao_ark_fd=hao_ark_fd)
+            num_frames += feat_mat.shape[0]
+        if hao_ark_fd is not None:
+            hao_ark_fd.close()
+        return num_frames
+
+    seconds, num_frames = best_of(run, repeats)
+    return throughput(seconds, frames=num_frames, utterances=len(scp_lines))
+
+def bench_dataset_construction(scp_path, repeats):
+    seconds, dataset = best_of(lambda: HaoDataset(scp_path, left_context=5, right_context=5, shuffle_utts=True, seed=0), repeats)
+    return throughput(seconds, frames=len(dataset), utterances=len(dataset.scp_lines))
+
+# Spliced frame batches as train_md.py draws them (utterance and frame shuffling on, no loader workers)
+def bench_batch_loading(scp_path, batch_size, num_batches, repeats):
+    dataset = HaoDataset(scp_path, left_context=5, right_context=5, shuffle_utts=True, shuffle_feats=True, seed=0)
+    num_batches = min(num_batches, len(dataset) // batch_size)
+
+    def run():
+        dataset.set_epoch(1)
+        loader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
+        num_frames = 0
+        for batch_idx, (feats, targets) in enumerate(loader):
+            num_frames += feats.size()[0]
+            if batch_idx + 1 >= num_batches:
+                break
+        return num_frames
+
+    seconds, num_frames = best_of(run, repeats)
+    return throughput(seconds, frames=num_frames, batches=num_batches)
+
+# One autoencoding step (forward, summed MSE, backward), as in phase 1 of train_md.py
+def bench_forward_backward(model, batch_size, num_steps, repeats):
+    decoder_class = model.decoder_classes[0]
+    feats = torch.randn(batch_size, model.time_dim, model.freq_dim)
+    model.train()
+
+    def run():
+        for step in range(num_steps):
+            model.zero_grad()
+            recon_batch = model.forward_decoder(feats, decoder_class)
+            loss = nn.MSELoss(reduction='sum')(recon_batch.view(-1, model.time_dim, model.freq_dim), feats)
+            loss.backward()
+        return num_steps
+
+    seconds, steps = best_of(run, repeats)
+    return throughput(seconds, frames=batch_size * num_steps, batches=num_steps)
+
+def bench_augmentation(model, utts, repeats):
+    target_class = model.decoder_classes[-1]
+    model.eval()
+
+    def run():
+        for utt in utts:
+            translate_utterances(model, [utt], target_class)
+        return len(utts)
+
+    seconds, num_utts = best_of(run, repeats)
+    return throughput(seconds, frames=sum(len(utt) for utt in utts), utterances=num_utts)
+
+# Length-bucketed batches of utterances, as augment_md.py translates them
+def bench_batched_augmentation(model, utts, batch_frames, repeats):
+    target_class = model.decoder_classes[-1]
+    model.eval()
+    batches = length_batches([len(utt) for utt in utts], batch_frames)
+
+    def run():
+        for batch in batches:
+            translate_utterances(model, [utts[idx] for idx in batch], target_class, max_batch_frames=batch_frames)
+        return len(batches)
+
+    seconds, num_batches = best_of(run, repeats)
+    return throughput(seconds, frames=sum(len(utt) for utt in utts), utterances=len(utts), batches=num_batches)
+
+def bench_write(utts, out_dir, repeats):
+    ark_path = os.path.join(out_dir, "write_bench.ark")
+    scp_path = os.path.join(out_dir, "write_bench.scp")
+
+    def run():
+        with open(ark_path, 'w') as ark_fd:
+            for utt_idx, utt in enumerate(utts):
+                write_kaldi_hao_ark(ark_fd, "bench_utt_%d" % utt_idx, utt)
+        with open(scp_path, 'w') as scp_fd:
+            write_kaldi_hao_scp(scp_fd, ark_path)
+        return len(utts)
+
+    seconds, num_utts = best_of(run, repeats)
+    return throughput(seconds, frames=sum(len(utt) for utt in utts), utterances=num_utts)
+
+
+
+# REPORTING
+
+
+
+def environment_info():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "cpu_count": os.cpu_count(),
+        "machine": platform.machine(),
+        "node": platform.node(),
+    }
+
+# Every "*_per_sec" metric is compared; slower than baseline by more than tolerance counts as a regression
+# Returns (rows of (benchmark, metric, baseline, current, ratio, status), number of regressions)
+def compare_results(current, baseline, tolerance):
+    rows = []
+    regressions = 0
+    for name, result in current["results"].items():
+        for metric, value in sorted(result.items()):
+            if not metric.endswith("_per_sec"):
+                continue
+            baseline_value = baseline["results"].get(name, {}).get(metric)
+            if baseline_value is None or baseline_value <= 0:
+                rows.append((name, metric, None, value, None, "new"))
+                continue
+            ratio = value / baseline_value
+            if ratio < 1.0 - tolerance:
+                status = "REGRESSION"
+                regressions += 1
+            elif ratio > 1.0 + tolerance:
+                status = "faster"
+            else:
+                status = "ok"
+            rows.append((name, metric, baseline_value, value, ratio, status))
+    return rows, regressions
+
+def print_results(results):
+    print("\nBENCHMARK RESULTS", flush=True)
+    for name, result in results.items():
+        rates = ", ".join("%s %.1f" % (metric, value) for metric, value in sorted(result.items()) if metric.endswith("_per_sec"))
+        print("  %-32s %9.3fs  %s" % (name, result["seconds"], rates), flush=True)
+
+def print_comparison(rows, tolerance):
+    print("\nCOMPARISON AGAINST BASELINE (tolerance %.0f%%)" % (tolerance * 100.0), flush=True)
+    for name, metric, baseline_value, value, ratio, status in rows:
+        if ratio is None:
+            print("  %-32s %-22s %14s %14.1f %8s  %s" % (name, metric, "-", value, "-", status), flush=True)
+        else:
+            print("  %-32s %-22s %14.1f %14.1f %7.2fx  %s" % (name, metric, baseline_value, value, ratio, status), flush=True)
+
+
+
+# Parse command line args
+USAGE = ("Usage: python bench/run_bench.py [--output results.json] [--baseline baseline.json] [--tolerance 0.15] "
+         "[--utts N] [--frames MEAN] [--feat-dim D] [--shards S] [--batch-sizes 128_512_2048] [--batches N] "
+         "[--steps N] [--aug-utts N] [--repeats N] [--threads N] [--work-dir DIR]")
+options = {
+    "--output": "bench_results.json",
+    "--baseline": None,
+    "--tolerance": "0.15",
+    "--utts": "200",
+    "--frames": "300",
+    "--feat-dim": os.environ.get("FEAT_DIM", "80"),
+    "--shards": "2",
+    "--batch-sizes": "128_512_2048",
+    "--batches": "50",
+    "--steps": "5",
+    "--aug-utts": "10",
+    "--repeats": "3",
+    "--threads": None,
+    "--work-dir": None,
+}
+i = 1
+while i < len(sys.argv):
+    if sys.argv[i] not in options or i + 1 >= len(sys.argv):
+        print(USAGE, flush=True)
+        sys.exit(1)
+    options[sys.argv[i]] = sys.argv[i + 1]
+    i += 2
+
+if options["--threads"] is not None:
+    torch.set_num_threads(int(options["--threads"]))
+torch.manual_seed(0)
+
+feat_dim = int(options["--feat-dim"])
+repeats = int(options["--repeats"])
+batch_sizes = [int(batch_size) for batch_size in options["--batch-sizes"].split("_") if len(batch_size) > 0]
+
+# Synthetic corpus is deleted afterwards unless it lives in a directory we were given
+work_dir = options["--work-dir"]
+remove_work_dir = work_dir is None
+if work_dir is None:
+    work_dir = tempfile.mkdtemp(prefix="hao_bench_")
+
+config = {
+    "utts": int(options["--utts"]),
+    "mean_frames": int(options["--frames"]),
+    "feat_dim": feat_dim,
+    "shards": int(options["--shards"]),
+    "batch_sizes": batch_sizes,
+    "batches": int(options["--batches"]),
+    "steps": int(options["--steps"]),
+    "aug_utts": int(options["--aug-utts"]),
+    "repeats": repeats,
+}
+results = dict()
+try:
+    print("Generating synthetic corpus in %s..." % work_dir, flush=True)
+    generate_start_t = time.perf_counter()
+    scp_path = generate_corpus(work_dir,
+                               num_utts=config["utts"],
+                               mean_frames=config["mean_frames"],
+                               feat_dim=feat_dim,
+                               num_shards=config["shards"])
+    print("Generated corpus in %.3f seconds" % (time.perf_counter() - generate_start_t), flush=True)
+
+    print("Benchmarking read_next_utt...", flush=True)
+    results["read_next_utt"] = bench_read_next_utt(scp_path, repeats)
+
+    print("Benchmarking HaoDataset construction...", flush=True)
+    results["hao_dataset_construction"] = bench_dataset_construction(scp_path, repeats)
+
+    for batch_size in batch_sizes:
+        print("Benchmarking batch loading (batch size %d)..." % batch_size, flush=True)
+        results["batch_loading_b%d" % batch_size] = bench_batch_loading(scp_path, batch_size, config["batches"], repeats)
+
+    model = build_bench_model(feat_dim)
+    for batch_size in batch_sizes:
+        print("Benchmarking forward_decoder forward/backward (batch size %d)..." % batch_size, flush=True)
+        results["forward_backward_b%d" % batch_size] = bench_forward_backward(model, batch_size, config["steps"], repeats)
+
+    utts = []
+    hao_ark_fd = None
+    for scp_line in read_scp_lines(scp_path)[:config["aug_utts"]]:
+        utt_id, feat_mat, hao_ark_fd = read_next_utt(scp_line, hao_ark_fd=hao_ark_fd)
+        utts.append(feat_mat)
+    if hao_ark_fd is not None:
+        hao_ark_fd.close()
+
+    print("Benchmarking per-utterance augmentation...", flush=True)
+    with torch.no_grad():
+        results["augmentation"] = bench_augmentation(model, utts, repeats)
+
+    print("Benchmarking length-bucketed augmentation...", flush=True)
+    with torch.no_grad():
+        results["augmentation_batched"] = bench_batched_augmentation(model, utts, 4096, repeats)
+
+    print("Benchmarking write_kaldi_hao_ark/write_kaldi_hao_scp...", flush=True)
+    results["write_ark_scp"] = bench_write(utts, work_dir, repeats)
+finally:
+    if remove_work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+report = {
+    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    "config": config,
+    "environment": environment_info(),
+    "results": results,
+}
+print_results(results)
+with open(options["--output"], 'w') as output_fd:
+    json.dump(report, output_fd, indent=2)
+print("\nWrote %s" % options["--output"], flush=True)
+
+if options["--baseline"] is not None:
+    with open(options["--baseline"], 'r') as baseline_fd:
+        baseline = json.load(baseline_fd)
+    if baseline.get("config") != config:
+        print("Warning: baseline was run with a different configuration: %s" % json.dumps(baseline.get("config")), flush=True)
+
+    tolerance = float(options["--tolerance"])
+    rows, regressions = compare_results(report, baseline, tolerance)
+    print_comparison(rows, tolerance)
+    if regressions > 0:
+        print("%d metric(s) regressed" % regressions, flush=True)
+        sys.exit(1)
@@ -0,0 +1,76 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append("./")
+sys.path.append(sys.path[0] + "/..")
+from utils.hao_data import write_kaldi_hao_ark, write_kaldi_hao_scp
+
+# Synthetic Hao-format corpora (text ARK shards plus one SCP) for benchmarking without the AMI data
+# Utterance lengths are drawn around mean_frames like real segments (a few hundred frames, long tail);
+# features are standard normal, i.e. what normalized log-Mel features look like to the loaders.
+# The same (num_utts, mean_frames, feat_dim, num_shards, seed) always gives the same corpus.
+
+# AMI-style IDs, so speaker/meeting parsing in utils/scp_view.py works on synthetic data too
+def synth_utt_id(utt_idx, num_speakers=16):
+    return "AMI_BENCH%03d_H00_SPK%03d_%07d_%07d" % (utt_idx % 10,
+                                                   utt_idx % num_speakers,
+                                                   utt_idx * 1000,
+                                                   utt_idx * 1000 + 999)
+
+def synth_lengths(num_utts, mean_frames, rng):
+    # Lognormal with sigma 0.5, scaled so the mean comes out at mean_frames
+    lengths = rng.lognormal(mean=np.log(mean_frames) - 0.125, sigma=0.5, size=num_utts)
+    return np.maximum(lengths.astype(np.int64), 1)
+
+# Writes <out_dir>/<name>.<shard>.ark (utterances dealt round-robin into shards) and <out_dir>/<name>.scp
+# Returns the SCP path
+def generate_corpus(out_dir, name="bench", num_utts=200, mean_frames=300, feat_dim=80, num_shards=1, seed=0):
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    lengths = synth_lengths(num_utts, mean_frames, rng)
+
+    ark_paths = [os.path.join(out_dir, "%s.%d.ark" % (name, shard)) for shard in range(num_shards)]
+    ark_fds = [open(ark_path, 'w') for ark_path in ark_paths]
+    try:
+        for utt_idx in range(num_utts):
+            feats = rng.standard_normal((lengths[utt_idx], feat_dim)).astype(np.float32)
+            write_kaldi_hao_ark(ark_fds[utt_idx % num_shards], synth_utt_id(utt_idx), feats)
+    finally:
+        for ark_fd in ark_fds:
+            ark_fd.close()
+
+    scp_path = os.path.join(out_dir, "%s.scp" % name)
+    with open(scp_path, 'w') as scp_fd:
+        for ark_path in ark_paths:
+            write_kaldi_hao_scp(scp_fd, ark_path)
+    return scp_path
+
+
+
+# Usage: python bench/synth_corpus.py <output dir> [--name NAME] [--utts N] [--frames MEAN] [--feat-dim D] [--shards S] [--seed SEED]
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python bench/synth_corpus.py <output dir> [--name NAME] [--utts N] [--frames MEAN] [--feat-dim D] [--shards S] [--seed SEED]", flush=True)
+        sys.exit(1)
+
+    out_dir = sys.argv[1]
+    options = {"--name": "bench", "--utts": "200", "--frames": "300", "--feat-dim": os.environ.get("FEAT_DIM", "80"),
+               "--shards": "1", "--seed": "0"}
+    i = 2
+    while i < len(sys.argv):
+        if sys.argv[i] not in options or i + 1 >= len(sys.argv):
+            print("Unknown or incomplete option %s" % sys.argv[i], flush=True)
+            sys.exit(1)
+        options[sys.argv[i]] = sys.argv[i + 1]
+        i += 2
+
+    scp_path = generate_corpus(out_dir,
+                               name=options["--name"],
+                               num_utts=int(options["--utts"]),
+                               mean_frames=int(options["--frames"]),
+                               feat_dim=int(options["--feat-dim"]),
+                               num_shards=int(options["--shards"]),
+                               seed=int(options["--seed"]))
+    print("Wrote %s" % scp_path, flush=True)
@@ -0,0 +1,133 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+# Background checkpoint writer for train_md.py
+# save() copies every tensor in the state object to host memory right away (so training can keep updating the
+# model), then serializes on a single background thread. Files are written to a temporary name and renamed into
+# place, so a crash mid-write never leaves a truncated checkpoint. Writes run one at a time; if a newer snapshot of
+# the same path is queued before an older one starts, the older one is dropped. A failed write is raised from the
+# next save()/save_from() (or wait()/close()), so training doesn't carry on for epochs without checkpoints.
+
+
+
+# Detached CPU copy of a (possibly nested) state object: state dicts, optimizer state dicts, plain values
+def cpu_snapshot(obj):
+    if torch.is_tensor(obj):
+        return obj.detach().cpu().clone()
+    elif isinstance(obj, dict):
+        return type(obj)((key, cpu_snapshot(value)) for key, value in obj.items())
+    elif isinstance(obj, list):
+        return [cpu_snapshot(value) for value in obj]
+    elif isinstance(obj, tuple):
+        return tuple(cpu_snapshot(value) for value in obj)
+    return obj
+
+def write_atomic(state_obj, path):
+    tmp_path = "%s.tmp.%d" % (path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as ckpt_fd:
+            torch.save(state_obj, ckpt_fd)
+            ckpt_fd.flush()
+            os.fsync(ckpt_fd.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Don't leave a partial file (e.g. from a full disk) behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class AsyncCheckpointWriter(object):
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        self.pending = dict()       # Path -> future of its latest queued write
+        self.rotations = dict()     # Rotation group -> deque of paths written so far
+        self.errors = []
+
+    # copies: extra paths (e.g. best_*) that get the same contents
+    # rotate_group/keep_last: keep only the newest keep_last paths written under this group name
+    def save(self, state_obj, path, copies=(), rotate_group=None, keep_last=0):
+        self.raise_errors()
+        snapshot = cpu_snapshot(state_obj)
+        return self.submit(set([path] + list(copies)), self.write, snapshot, path, list(copies), rotate_group, keep_last)
+
+    # Like save(), but the state object is a checkpoint already on disk (e.g. a snapshot that was just validated),
+    # read back on the writer thread with updates applied on top; remove_src deletes src_path once it's used
+    def save_from(self, src_path, path, updates=None, copies=(), rotate_group=None, keep_last=0, remove_src=False):
+        self.raise_errors()
+        future = self.submit(set([path] + list(copies)),
+                             self.write_from, src_path, updates, remove_src, path, list(copies), rotate_group, keep_last)
+        if remove_src:
+            # A newer write to the same paths may cancel this one before it runs
+            def remove_if_cancelled(future):
+                if future.cancelled() and os.path.exists(src_path):
+                    os.remove(src_path)
+            future.add_done_callback(remove_if_cancelled)
+        return future
+
+    def submit(self, targets, fn, *args):
+        with self.lock:
+            for target in targets:
+                previous = self.pending.get(target)
+                # Only drop a queued write if this one rewrites every file it would have written
+                if previous is not None and previous.targets <= targets:
+                    previous.cancel()   # No-op if it already started
+            future = self.executor.submit(fn, *args)
+            future.targets = targets
+            for target in targets:
+                self.pending[target] = future
+        return future
+
+    def write(self, snapshot, path, copies, rotate_group, keep_last):
+        try:
+            write_atomic(snapshot, path)
+            for copy_path in copies:
+                write_atomic(snapshot, copy_path)
+
+            if rotate_group is not None and keep_last > 0:
+                rotation = self.rotations.setdefault(rotate_group, deque())
+                if path not in rotation:
+                    rotation.append(path)
+                while len(rotation) > keep_last:
+                    old_path = rotation.popleft()
+                    if os.path.exists(old_path):
+                        os.remove(old_path)
+        except Exception as e:
+            self.errors.append(e)
+            raise
+
+    def write_from(self, src_path, updates, remove_src, path, copies, rotate_group, keep_last):
+        try:
+            state_obj = torch.load(src_path, map_location=lambda storage,loc: storage)
+        except Exception as e:
+            self.errors.append(e)
+            raise
+        if updates is not None:
+            state_obj.update(updates)
+        self.write(state_obj, path, copies, rotate_group, keep_last)
+        if remove_src:
+            os.remove(src_path)
+
+    # Raises the first error from an earlier background write, if any
+    def raise_errors(self):
+        if len(self.errors) > 0:
+            raise self.errors[0]
+
+    # Block until every queued write is on disk; raises the first write error, if any
+    def wait(self):
+        with self.lock:
+            futures = list(set(self.pending.values()))
+        for future in futures:
+            if not future.cancelled():
+                future.exception()
+        with self.lock:
+            self.pending = {path: future for path, future in self.pending.items() if not future.done()}
+        self.raise_errors()
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown(wait=True)
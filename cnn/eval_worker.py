@@ -0,0 +1,86 @@
+import multiprocessing
+import queue
+import threading
+import traceback
+
+# Validation in a sidecar process, so train_md.py keeps training while a snapshot is being evaluated
+# The trainer writes each validation round's checkpoint to disk (see AsyncCheckpointWriter) and submits its path;
+# the worker loads it into its own CPU copy of the model, runs the evaluation function and sends the results back.
+# The process is forked rather than spawned, so init_fn/evaluate_fn can be closures over the trainer's setup
+# (datasets, loss functions, model); init_fn runs once in the child to move that setup over to the CPU.
+# The trainer only ever waits for results when more than max_pending snapshots are still unevaluated.
+
+def worker_loop(init_fn, evaluate_fn, requests, results):
+    init_fn()
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+
+        try:
+            result = evaluate_fn(request)
+            result["error"] = None
+        except Exception:
+            result = {"error": traceback.format_exc()}
+        result["request"] = request
+        results.put(result)
+
+class EvalWorker(object):
+    def __init__(self, init_fn, evaluate_fn, max_pending=2):
+        context = multiprocessing.get_context("fork")
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.max_pending = max_pending
+
+        # Snapshots reserved (queued for writing, or submitted) whose results haven't been collected yet
+        self.lock = threading.Lock()
+        self.pending = 0
+
+        self.process = context.Process(target=worker_loop, args=(init_fn, evaluate_fn, self.requests, self.results))
+        self.process.daemon = True
+        self.process.start()
+
+    # Count a snapshot as pending as soon as it's queued for writing; submit() follows once it's on disk
+    def reserve(self):
+        with self.lock:
+            self.pending += 1
+
+    # request: picklable dict describing the snapshot (path, epoch, iteration...); safe to call from any thread,
+    # e.g. a checkpoint write's done callback
+    def submit(self, request):
+        self.requests.put(request)
+
+    # Collect finished results; with block=True, wait for at least one (if any are pending)
+    def poll(self, block=False):
+        collected = []
+        while self.pending > 0:
+            try:
+                result = self.results.get(block=block and len(collected) == 0, timeout=1.0)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError("Evaluation worker exited with code %s" % str(self.process.exitcode))
+                if block and len(collected) == 0:
+                    continue
+                break
+            with self.lock:
+                self.pending -= 1
+            collected.append(result)
+        return collected
+
+    # Collect results, waiting while more than max_pending are still outstanding (back-pressure on the trainer)
+    def poll_bounded(self):
+        collected = self.poll()
+        while self.pending > self.max_pending:
+            collected.extend(self.poll(block=True))
+        return collected
+
+    # Wait for every pending result
+    def drain(self):
+        collected = []
+        while self.pending > 0:
+            collected.extend(self.poll(block=True))
+        return collected
+
+    def close(self):
+        self.requests.put(None)
+        self.process.join()
@@ -6,10 +6,53 @@ export LEARNING_RATE=0.0001
 export EPOCHS=25
 export BATCH_SIZE=128
 
+# Gradient accumulation: optimizer steps use ACCUM_STEPS micro-batches of BATCH_SIZE frames each
+# LR_SCALING=linear scales LEARNING_RATE with the effective batch size; warmup is in optimizer steps
+export ACCUM_STEPS=1
+export LR_SCALING=none
+export LR_WARMUP_STEPS=0
+
+# Training frame order: "utterance" reads utterances in random order and shuffles frames within each one;
+# "block" reads shuffled blocks of TRAIN_BLOCK_UTTS utterances sequentially from disk and mixes their frames
+# through a shuffle buffer of TRAIN_SHUFFLE_BUFFER frames. Each loader worker preallocates the buffer as
+# TRAIN_SHUFFLE_BUFFER x (LEFT_CONTEXT + RIGHT_CONTEXT + 1) x FEAT_DIM float32s: ~3.5KB per frame, ~230MB as set here
+export TRAIN_SAMPLER=utterance
+export TRAIN_BLOCK_UTTS=64
+export TRAIN_SHUFFLE_BUFFER=65536
+
 # Full AMI dataset is too large to check dev data once per epoch
 # Use (potentially smaller) validation dataset and check once per this many batches
 export VAL_BATCH_COUNT=10000
 
+# Validation rounds: "full" runs the whole val set; "bounded" estimates the val loss from a stratified
+# VAL_SAMPLE_FRACTION of it, one utterance per class at a time (VAL_MIN_BATCHES utterances at least), and stops once the
+# confidence interval decides improved/not improved (the final report after training always uses the full val set)
+export VAL_MODE=full
+export VAL_SAMPLE_FRACTION=0.2
+export VAL_MIN_BATCHES=20
+export VAL_CONFIDENCE_Z=1.96
+export VAL_REL_TOLERANCE=0.002
+
+# Validate snapshots in a sidecar process while training continues (early stopping lags by a round or two)
+export EVAL_WORKER=false
+export EVAL_MAX_PENDING=2
+export EVAL_THREADS=4
+
+# Keep this many most recent validation-round checkpoints besides best_* (0 = best only)
+export CHECKPOINT_KEEP_LAST=0
+
+# In-RAM cache of decoded utterances for train_md.py/augment_md.py, in MB (0 = off; see utils/utt_cache.py)
+# With UTT_CACHE_SHARED set to a name, the cache is one shared-memory segment that loader workers and other runs
+# on this machine reuse; free it with `python utils/utt_cache.py clear <name>`
+export UTT_CACHE_MB=0
+export UTT_CACHE_SHARED=
+
+# Continue a preempted run from its resume_* checkpoint (saved every validation round) instead of starting over
+export RESUME_TRAINING=true
+
+# Data-parallel training processes on this node (gloo backend; see cnn/md_distributed.py)
+export TRAIN_PROCS=1
+
 export ENC_CHANNELS=( 256 256 )
 export ENC_KERNELS=( 3 3 )        # Assume square kernels (AxA)
 export ENC_DOWNSAMPLES=( 3 3 )          # Pool only in frequency; no overlap. Use 0 to indicate no pooling
@@ -41,6 +84,8 @@ export DECODER_CLASSES_DELIM=$(printf "_%s" "${DECODER_CLASSES[@]}")
 export DEBUG_MODEL=false
 # export DATASET_NAME=ami-0.1
 export DATASET_NAME=ami-full
+# Fraction of utterances to use (deterministic subset of the full SCPs); use e.g. 0.1 for quick experiments
+export DATASET_FRACTION=1.0
 if [ "$DEBUG_MODEL" = true ] ; then
     export CURRENT_FEATS=$TEST_FEATS
 else
@@ -48,6 +93,14 @@ else
 fi
 export PROFILE_RUN=false
 
+# Per-phase timing breakdowns for train_md.py/augment_md.py (every TIMING_INTERVAL seconds, plus a final summary)
+# Set TIMING_JSON to also write the final summary as JSON
+export TIMING=false
+export TIMING_INTERVAL=300
+
+# JSON-lines throughput/loss/memory stream from train_md.py/augment_md.py (see utils/metrics_stream.py); empty = off
+export METRICS_STREAM=
+
 export USE_BACKTRANSLATION=true
 export STRIDED=false
 
@@ -72,6 +125,10 @@ mkdir -p $LOG_DIR
 # For data augmentation
 export AUGMENTED_DATA_DIR=${AUGMENTED_DATA}/cnn/$DATASET_NAME/$EXPT_NAME
 mkdir -p $AUGMENTED_DATA_DIR
+# augment_md.py translates utterances of similar length together, at most this many padded frames per batch,
+# sorting lengths within windows of AUGMENT_WINDOW utterances (the output ARKs keep the SCP order)
+export AUGMENT_BATCH_FRAMES=4096
+export AUGMENT_WINDOW=1024
 
 # Denoising autoencoder parameters; uses input "destruction" as described in
 # "Extracting and Composing Robust Features with Denoising Autoencoders", Vincent et. al.
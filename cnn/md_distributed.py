@@ -0,0 +1,149 @@
+import os
+import pickle
+
+import numpy as np
+import torch
+import torch.distributed as dist
+
+from utils.scp_view import ScpView, scp_view
+
+# Data-parallel multidecoder training over torch.distributed (gloo backend, CPU tensors)
+# Every rank builds the same model, reads a disjoint shard of each class's SCP and averages gradients
+# with the other ranks right before every optimizer step, so all ranks stay in lockstep.
+# Rendezvous is env:// -- MASTER_ADDR, MASTER_PORT, WORLD_SIZE and RANK, as set by cnn/scripts/launch_md.py
+# (or by srun: SLURM_NTASKS/SLURM_PROCID are used when WORLD_SIZE/RANK are missing).
+
+
+
+# SETUP
+
+
+
+# Returns (rank, world_size); (0, 1) means single-process training and no process group
+def init_distributed():
+    world_size = int(os.environ.get("WORLD_SIZE", os.environ.get("SLURM_NTASKS", "1")))
+    rank = int(os.environ.get("RANK", os.environ.get("SLURM_PROCID", "0")))
+    if world_size <= 1:
+        return 0, 1
+
+    dist.init_process_group("gloo", init_method="env://", rank=rank, world_size=world_size)
+    return rank, world_size
+
+# Every world_size-th utterance, starting at rank; scp_source is an SCP path or a ScpView
+def shard_scp_source(scp_source, rank, world_size):
+    if world_size <= 1:
+        return scp_source
+    view = scp_source if isinstance(scp_source, ScpView) else scp_view(scp_source)
+    return ScpView(view.entries[rank::world_size])
+
+# gloo works on CPU tensors; anything on the GPU takes a round trip through host memory
+def broadcast_tensors(tensors):
+    for tensor in tensors:
+        host_tensor = tensor.data.cpu()
+        dist.broadcast(host_tensor, 0)
+        tensor.data.copy_(host_tensor)
+
+# Start every rank from rank 0's weights (and batch norm statistics)
+def broadcast_model(model):
+    broadcast_tensors(list(model.parameters()) + list(model.buffers()))
+
+# Ranks update batch norm running statistics on their own shards; use rank 0's for validation and checkpoints
+def broadcast_buffers(model):
+    broadcast_tensors(list(model.buffers()))
+
+
+
+# COLLECTIVES
+
+
+
+# Average gradients of the given parameters across ranks, as one flattened all-reduce
+# Every rank has to reach this with the same parameters, in the same order
+def allreduce_gradients(params, world_size):
+    grads = [param.grad.data for param in params if param.grad is not None]
+    if len(grads) == 0:
+        return
+
+    flat = torch.cat([grad.contiguous().view(-1).cpu() for grad in grads])
+    dist.all_reduce(flat)
+    flat /= world_size
+
+    offset = 0
+    for grad in grads:
+        numel = grad.numel()
+        grad.copy_(flat[offset:offset + numel].view_as(grad))
+        offset += numel
+
+# Wraps an optimizer so that step() first averages its parameters' gradients over all ranks
+# Everything else (zero_grad, state_dict, param_groups...) goes straight to the wrapped optimizer
+class DistributedOptimizer(object):
+    def __init__(self, optimizer, world_size):
+        self.optimizer = optimizer
+        self.world_size = world_size
+
+    def __getattr__(self, name):
+        return getattr(self.optimizer, name)
+
+    def params(self):
+        return [param for group in self.optimizer.param_groups for param in group["params"]]
+
+    def step(self, *args, **kwargs):
+        allreduce_gradients(self.params(), self.world_size)
+        return self.optimizer.step(*args, **kwargs)
+
+def distribute_optimizer(optimizer, world_size):
+    if world_size <= 1:
+        return optimizer
+    return DistributedOptimizer(optimizer, world_size)
+
+# Sum a (possibly nested) dict of numbers over all ranks, in place; e.g. loss dicts and element counts
+def allreduce_dict_sum(values):
+    keys = []
+    def flatten(d, prefix):
+        for key in sorted(d):
+            if isinstance(d[key], dict):
+                flatten(d[key], prefix + (key,))
+            else:
+                keys.append(prefix + (key,))
+    flatten(values, ())
+
+    def lookup(path):
+        d = values
+        for key in path[:-1]:
+            d = d[key]
+        return d
+
+    totals = torch.DoubleTensor([float(lookup(path)[path[-1]]) for path in keys])
+    dist.all_reduce(totals)
+    for path, total in zip(keys, totals.tolist()):
+        d = lookup(path)
+        d[path[-1]] = type(d[path[-1]])(total)
+    return values
+
+# Elementwise sum of a numpy array over all ranks (returns a new float64 array)
+def allreduce_array(values):
+    tensor = torch.from_numpy(np.asarray(values, dtype=np.float64).copy())
+    dist.all_reduce(tensor)
+    return tensor.numpy()
+
+def allreduce_scalar(value, op=None):
+    tensor = torch.DoubleTensor([value])
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM if op is None else op)
+    return tensor[0].item()
+
+# Picklable object from every rank, indexed by rank (e.g. per-rank RNG states for rank 0's resume checkpoint)
+def all_gather_objects(obj, world_size):
+    payload = torch.from_numpy(np.frombuffer(pickle.dumps(obj), dtype=np.uint8).copy())
+    lengths = [torch.LongTensor([0]) for rank in range(world_size)]
+    dist.all_gather(lengths, torch.LongTensor([payload.numel()]))
+    max_length = max(int(length[0]) for length in lengths)
+
+    padded = torch.zeros(max_length, dtype=torch.uint8)
+    padded[:payload.numel()] = payload
+    gathered = [torch.zeros(max_length, dtype=torch.uint8) for rank in range(world_size)]
+    dist.all_gather(gathered, padded)
+    return [pickle.loads(tensor[:int(length[0])].numpy().tobytes()) for tensor, length in zip(gathered, lengths)]
+
+def barrier(world_size):
+    if world_size > 1:
+        dist.barrier()
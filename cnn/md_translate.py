@@ -0,0 +1,240 @@
+from collections import OrderedDict
+import os
+import sys
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.autograd import Variable
+from torch.utils.data import Dataset
+
+from cnn_md import CNNMultidecoder, CNNVariationalMultidecoder
+from cnn_md import CNNDomainAdversarialMultidecoder
+from cnn_md import CNNGANMultidecoder
+
+
+
+# LOADING A TRAINED MULTIDECODER
+
+
+
+# Parse a "_"-delimited list (as exported by cnn/job_config.sh) from the environment
+def env_list(name, cast=int):
+    values = []
+    for res_str in os.environ[name].split("_"):
+        if len(res_str) > 0:
+            values.append(cast(res_str))
+    return values
+
+# Construct (untrained) multidecoder using the parameters in the environment
+def build_multidecoder(run_mode, domain_adversarial=False, gan=False):
+    model_kwargs = {
+        "freq_dim": int(os.environ["FEAT_DIM"]),
+        "splicing": [int(os.environ["LEFT_CONTEXT"]), int(os.environ["RIGHT_CONTEXT"])],
+        "enc_channel_sizes": env_list("ENC_CHANNELS_DELIM"),
+        "enc_kernel_sizes": env_list("ENC_KERNELS_DELIM"),
+        "enc_downsample_sizes": env_list("ENC_DOWNSAMPLES_DELIM"),
+        "enc_fc_sizes": env_list("ENC_FC_DELIM"),
+        "latent_dim": int(os.environ["LATENT_DIM"]),
+        "dec_fc_sizes": env_list("DEC_FC_DELIM"),
+        "dec_channel_sizes": env_list("DEC_CHANNELS_DELIM"),
+        "dec_kernel_sizes": env_list("DEC_KERNELS_DELIM"),
+        "dec_upsample_sizes": env_list("DEC_UPSAMPLES_DELIM"),
+        "activation": os.environ["ACTIVATION_FUNC"],
+        "use_batch_norm": True if os.environ["USE_BATCH_NORM"] == "true" else False,
+        "strided": True if os.environ["STRIDED"] == "true" else False,
+        "decoder_classes": env_list("DECODER_CLASSES_DELIM", cast=str),
+        "weight_init": os.environ["WEIGHT_INIT"],
+    }
+
+    if run_mode == "ae":
+        if domain_adversarial:
+            return CNNDomainAdversarialMultidecoder(domain_adv_fc_sizes=env_list("DOMAIN_ADV_FC_DELIM"),
+                                                    domain_adv_activation=os.environ["DOMAIN_ADV_ACTIVATION"],
+                                                    **model_kwargs)
+        elif gan:
+            return CNNGANMultidecoder(gan_fc_sizes=env_list("GAN_FC_DELIM"),
+                                      gan_activation=os.environ["GAN_ACTIVATION"],
+                                      **model_kwargs)
+        else:
+            return CNNMultidecoder(**model_kwargs)
+    elif run_mode == "vae":
+        if domain_adversarial:
+            print("Adversarial VAEs not supported yet", flush=True)
+            sys.exit(1)
+        elif gan:
+            print("Generative adversarial VAEs not supported yet", flush=True)
+            sys.exit(1)
+        else:
+            return CNNVariationalMultidecoder(**model_kwargs)
+    else:
+        print("Unknown run mode %s" % run_mode, flush=True)
+        sys.exit(1)
+
+# Same naming scheme as train_md.py and augment_md.py
+def best_checkpoint_path(run_mode, domain_adversarial=False, gan=False):
+    model_dir = os.environ["MODEL_DIR"]
+    noise_ratio = float(os.environ["NOISE_RATIO"])
+    if domain_adversarial:
+        return os.path.join(model_dir, "best_cnn_domain_adversarial_fc_%s_act_%s_%s_ratio%s_md.pth.tar" % (os.environ["DOMAIN_ADV_FC_DELIM"],
+                                                                                                         os.environ["DOMAIN_ADV_ACTIVATION"],
+                                                                                                         run_mode,
+                                                                                                         str(noise_ratio)))
+    elif gan:
+        return os.path.join(model_dir, "best_cnn_gan_fc_%s_act_%s_%s_ratio%s_md.pth.tar" % (os.environ["GAN_FC_DELIM"],
+                                                                                          os.environ["GAN_ACTIVATION"],
+                                                                                          run_mode,
+                                                                                          str(noise_ratio)))
+    else:
+        return os.path.join(model_dir, "best_cnn_%s_ratio%s_md.pth.tar" % (run_mode, str(noise_ratio)))
+
+# Construct multidecoder and load best checkpoint into it, ready for evaluation
+def load_multidecoder(run_mode, domain_adversarial=False, gan=False, on_gpu=False, ckpt_path=None):
+    model = build_multidecoder(run_mode, domain_adversarial=domain_adversarial, gan=gan)
+    if ckpt_path is None:
+        ckpt_path = best_checkpoint_path(run_mode, domain_adversarial=domain_adversarial, gan=gan)
+
+    # Load checkpoint (potentially trained on GPU) into CPU memory (hence the map_location)
+    checkpoint = torch.load(ckpt_path, map_location=lambda storage,loc: storage)
+    model.load_state_dict(checkpoint["state_dict"])
+    if on_gpu:
+        model.cuda()
+
+    # Set to eval mode (i.e. disable batch norm)
+    model.eval()
+    return model
+
+
+
+# TRANSLATING WHOLE UTTERANCES
+
+
+
+# Splice every frame of a (T, freq_dim) utterance with its context, giving (T, time_dim, freq_dim)
+# Frames outside the utterance are zeros, as in augment_md.py
+def splice_utterance(feats, left_context, right_context):
+    padded = F.pad(feats.unsqueeze(0).unsqueeze(0), (0, 0, left_context, right_context)).squeeze(0).squeeze(0)
+    return padded.unfold(0, left_context + right_context + 1, 1).transpose(1, 2).contiguous()
+
+# Run utterances through the target decoder, keeping only the center frame of each spliced window
+# All frames of all utterances go through the model in chunks of at most max_batch_frames
+def translate_utterances(model, utts, target_class, run_mode="ae", on_gpu=False, max_batch_frames=4096):
+    if len(utts) == 0:
+        return []
+
+    left_context, right_context = model.splicing
+    spliced = torch.cat([splice_utterance(torch.FloatTensor(np.array(utt, dtype=np.float32)),
+                                          left_context,
+                                          right_context) for utt in utts], 0)
+
+    decoded_chunks = []
+    with torch.no_grad():
+        for start in range(0, spliced.size()[0], max_batch_frames):
+            frame_tensor = Variable(spliced[start:start + max_batch_frames])
+            if on_gpu:
+                frame_tensor = frame_tensor.cuda()
+
+            if run_mode == "ae":
+                recon_frames = model.forward_decoder(frame_tensor, target_class)
+            elif run_mode == "vae":
+                recon_frames, mu, logvar = model.forward_decoder(frame_tensor, target_class)
+            else:
+                print("Unknown augment mode %s" % run_mode, flush=True)
+                sys.exit(1)
+
+            recon_frames = recon_frames.view(-1, model.time_dim, model.freq_dim)
+            decoded_chunks.append(recon_frames[:, left_context, :].cpu().data.numpy())
+    if len(decoded_chunks) == 0:
+        return [np.empty((0, model.freq_dim), dtype=np.float32) for utt in utts]
+    decoded_feats = np.concatenate(decoded_chunks, 0)
+
+    # Split back into utterances
+    decoded_utts = []
+    current_idx = 0
+    for utt in utts:
+        num_frames = len(utt)
+        decoded_utts.append(decoded_feats[current_idx:current_idx + num_frames])
+        current_idx += num_frames
+    return decoded_utts
+
+
+
+# ON-THE-FLY AUGMENTATION
+
+
+
+# Utterance-level dataset of source features translated into the target class by a loaded multidecoder
+# Drop-in replacement for a HaoEvalDataset over the augmented SCP written by augment_md.py,
+# so combined training can start without materializing train-src_*-tar_*.ark first.
+# Recently translated utterances are kept in a bounded LRU cache; noise (if any) is drawn
+# fresh each epoch on top of the cached translation, and is reproducible given seed and epoch.
+# The model lives inside the dataset, so use num_workers=0 in the DataLoader when on GPU.
+class TranslatedHaoEvalDataset(Dataset):
+    def __init__(self, source_dataset, model, source_class, target_class, run_mode="ae", on_gpu=False,
+                 cache_size=1024, noise_ratio=0.0, seed=1):
+        super(TranslatedHaoEvalDataset, self).__init__()
+
+        self.source_dataset = source_dataset
+        self.model = model
+        self.source_class = source_class
+        self.target_class = target_class
+        self.run_mode = run_mode
+        self.on_gpu = on_gpu
+
+        # Keyed by source utterance ID; most recently used at the end
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # Randomly drop out (noise_ratio * 100)% of translated features, as in train_md.py
+        self.noise_ratio = noise_ratio
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return len(self.source_dataset)
+
+    # Call at the start of each epoch to draw new noise
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    # Same naming scheme as the SCPs written by augment_md.py
+    def aug_utt_id(self, utt_id):
+        return "src_%s_tar_%s_%s" % (self.source_class, self.target_class, utt_id)
+
+    def translate(self, utt_id, feats):
+        if utt_id in self.cache:
+            self.cache_hits += 1
+            self.cache.move_to_end(utt_id)
+            return self.cache[utt_id]
+
+        self.cache_misses += 1
+        decoded_feats = translate_utterances(self.model,
+                                             [feats],
+                                             self.target_class,
+                                             run_mode=self.run_mode,
+                                             on_gpu=self.on_gpu)[0]
+        if self.cache_size > 0:
+            self.cache[utt_id] = decoded_feats
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return decoded_feats
+
+    def __getitem__(self, idx):
+        feats, targets, utt_id = self.source_dataset[idx]
+        decoded_feats = self.translate(utt_id, feats.numpy())
+
+        if self.noise_ratio > 0.0:
+            rng = np.random.RandomState((self.seed, self.epoch, idx))
+            decoded_feats = decoded_feats * rng.binomial(1, 1.0 - self.noise_ratio, size=decoded_feats.shape)
+
+        feats_tensor = torch.FloatTensor(np.asarray(decoded_feats, dtype=np.float32))
+
+        # Target is identical to feature tensor
+        target_tensor = feats_tensor.clone()
+
+        return (feats_tensor, target_tensor, self.aug_utt_id(utt_id))
+
+    def utt_id(self, utt_idx):
+        return self.aug_utt_id(self.source_dataset.utt_id(utt_idx))
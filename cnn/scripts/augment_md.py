@@ -17,9 +17,14 @@ sys.path.append("./cnn")
 from cnn_md import CNNMultidecoder, CNNVariationalMultidecoder
 from cnn_md import CNNDomainAdversarialMultidecoder
 from cnn_md import CNNGANMultidecoder
+from md_translate import translate_utterances
 from utils.hao_data import HaoEvalDataset, write_kaldi_hao_ark, write_kaldi_hao_scp
+from utils.hao_data import length_batches
+from utils.utt_cache import cache_from_env, print_cache_stats
+from utils.metrics_stream import metrics_from_env
+from utils.timing import timer_from_env, finish_timing
 
-run_start_t = time.clock()
+run_start_t = time.perf_counter()
 
 # Parse command line args
 run_mode = "ae"
@@ -119,6 +124,17 @@ if gan:
 on_gpu = torch.cuda.is_available()
 log_interval = 100   # Log results once for this many batches during training
 
+# Utterances are translated in length-bucketed batches of at most AUGMENT_BATCH_FRAMES padded frames, sorted
+# within windows of AUGMENT_WINDOW utterances so the output ARKs keep the SCP order
+augment_batch_frames = int(os.environ.get("AUGMENT_BATCH_FRAMES", "4096"))
+augment_window = int(os.environ.get("AUGMENT_WINDOW", "1024"))
+
+# Per-phase timing (TIMING=true; see utils/timing.py)
+timer = timer_from_env(sync=torch.cuda.synchronize if on_gpu else None)
+
+# JSON-lines throughput/memory stream (METRICS_STREAM=<path>; see utils/metrics_stream.py)
+metrics = metrics_from_env("augment_md", on_gpu=on_gpu)
+
 # Set up input files and output directory
 training_scps = dict()
 for decoder_class in decoder_classes:
@@ -271,15 +287,20 @@ print("Loaded checkpoint; best model ready now.")
 print("Setting up data...", flush=True)
 loader_kwargs = {"num_workers": 1, "pin_memory": True} if on_gpu else {}
 
+# Each source utterance is read once per target class; see job_config.sh
+utt_cache = cache_from_env()
+
 print("Setting up training datasets...", flush=True)
 training_datasets = dict()
 training_loaders = dict()
 for decoder_class in decoder_classes:
-    current_dataset = HaoEvalDataset(training_scps[decoder_class])
+    current_dataset = HaoEvalDataset(training_scps[decoder_class], cache=utt_cache)
     training_datasets[decoder_class] = current_dataset
     training_loaders[decoder_class] = DataLoader(current_dataset,
-                                                 batch_size=1,
-                                                 shuffle=False,
+                                                 batch_sampler=length_batches(current_dataset.utt_lengths(),
+                                                                              augment_batch_frames,
+                                                                              window=augment_window),
+                                                 collate_fn=list,
                                                  **loader_kwargs)
     print("Using %d training features (%d batches) for class %s" % (len(current_dataset),
                                                                     len(training_loaders[decoder_class]),
@@ -290,11 +311,13 @@ print("Setting up dev datasets...", flush=True)
 dev_datasets = dict()
 dev_loaders = dict()
 for decoder_class in decoder_classes:
-    current_dataset = HaoEvalDataset(dev_scps[decoder_class])
+    current_dataset = HaoEvalDataset(dev_scps[decoder_class], cache=utt_cache)
     dev_datasets[decoder_class] = current_dataset
     dev_loaders[decoder_class] = DataLoader(current_dataset,
-                                            batch_size=1,
-                                            shuffle=False,
+                                            batch_sampler=length_batches(current_dataset.utt_lengths(),
+                                                                         augment_batch_frames,
+                                                                         window=augment_window),
+                                            collate_fn=list,
                                             **loader_kwargs)
     print("Using %d dev features (%d batches) for class %s" % (len(current_dataset),
                                                                len(dev_loaders[decoder_class]),
@@ -303,44 +326,47 @@ for decoder_class in decoder_classes:
 
 print("Done setting up data.", flush=True)
 
-def augment(source_class, target_class):
-    model.eval()
+# Translate one split of the source class into the target class, writing <split>-src_*-tar_*.ark/scp
+def augment_split(split, loader, source_class, target_class):
+    dataset = loader.dataset
+    ark_path = os.path.join(output_dir, "%s-src_%s-tar_%s.ark" % (split, source_class, target_class))
 
-    # Process training dataset
-    print("=> Processing training data...", flush=True)
     batches_processed = 0
-    total_batches = len(training_loaders[source_class])
-    with open(os.path.join(output_dir, "train-src_%s-tar_%s.ark" % (source_class, target_class)), 'w') as ark_fd:
-        for batch_idx, (feats, targets, utt_ids) in enumerate(training_loaders[source_class]):
-            utt_id = utt_ids[0]     # Batch size 1; only one utterance
+    total_batches = len(loader)
+    metrics.reset_window()
+
+    # Batches come sorted by length within each window; finished utterances wait here, by dataset index, until all
+    # earlier ones are written (the loader yields its batch sampler's index lists in order)
+    decoded_utts = dict()
+    next_utt_idx = 0
+    with open(ark_path, 'w') as ark_fd:
+        batches = zip(loader.batch_sampler, timer.timed_iter(metrics.timed_iter(loader), "data_fetch"))
+        for batch_idx, (utt_idxs, items) in enumerate(batches):
+            utt_mats = [item[0].numpy() for item in items]
 
             # Run batch through target decoder
-            feats_numpy = feats.numpy().reshape((-1, freq_dim))
-            num_frames = feats_numpy.shape[0]
-            decoded_feats = np.empty((num_frames, freq_dim))
-            for i in range(num_frames):
-                frame_spliced = np.zeros((time_dim, freq_dim))
-                frame_spliced[left_context - min(i, left_context):left_context, :] = feats_numpy[i - min(i, left_context):i, :]
-                frame_spliced[left_context, :] = feats_numpy[i, :]
-                frame_spliced[left_context + 1:left_context + 1 + min(num_frames - i - 1, right_context), :] = feats_numpy[i + 1:i + 1 + min(num_frames - i - 1, right_context), :]
-                frame_tensor = Variable(torch.FloatTensor(frame_spliced))
-                if on_gpu:
-                    frame_tensor = frame_tensor.cuda()
-
-                if run_mode == "ae":
-                    recon_frames = model.forward_decoder(frame_tensor, target_class)
-                elif run_mode == "vae":
-                    recon_frames, mu, logvar = model.forward_decoder(frame_tensor, target_class)
-                else:
-                    print("Unknown augment mode %s" % run_mode, flush=True)
-                    sys.exit(1)
-
-                recon_frames_numpy = recon_frames.cpu().data.numpy().reshape((-1, freq_dim))
-                decoded_feats[i, :] = recon_frames_numpy[left_context:left_context + 1, :]
+            timer.start("translate")
+            decoded_batch = translate_utterances(model,
+                                                 utt_mats,
+                                                 target_class,
+                                                 run_mode=run_mode,
+                                                 on_gpu=on_gpu,
+                                                 max_batch_frames=augment_batch_frames)
+            decoded_utts.update(zip(utt_idxs, zip([item[2] for item in items], decoded_batch)))
+            timer.stop("translate")
 
             # Write to output file
-            aug_utt_id = "src_%s_tar_%s_%s" % (source_class, target_class, utt_id)
-            write_kaldi_hao_ark(ark_fd, aug_utt_id, decoded_feats)
+            timer.start("write")
+            while next_utt_idx in decoded_utts:
+                utt_id, decoded_mat = decoded_utts.pop(next_utt_idx)
+                aug_utt_id = "src_%s_tar_%s_%s" % (source_class, target_class, utt_id)
+                write_kaldi_hao_ark(ark_fd, aug_utt_id, decoded_mat)
+                next_utt_idx += 1
+            timer.stop("write")
+            num_frames = sum(utt_mat.shape[0] for utt_mat in utt_mats)
+            timer.count("utterances", len(items))
+            timer.count("frames", num_frames)
+            metrics.add(source_class, frames=num_frames, utterances=len(items), batches=1)
 
             batches_processed += 1
             if batches_processed % log_interval == 0:
@@ -348,73 +374,61 @@ def augment(source_class, target_class):
                                                                   total_batches,
                                                                   100.0 * batches_processed / total_batches),
                       flush=True)
+                timer.maybe_report()
+                metrics.emit_throughput("augment_progress",
+                                        split=split,
+                                        source_class=source_class,
+                                        target_class=target_class,
+                                        batch=batches_processed,
+                                        batch_count=total_batches)
+    # Every utterance must have been written, in order
+    assert(next_utt_idx == len(dataset))
 
     # Create corresponding SCP file
     print("===> Writing SCP...", flush=True)
-    with open(os.path.join(output_dir, "train-src_%s-tar_%s.scp" % (source_class, target_class)), 'w') as scp_fd:
-        write_kaldi_hao_scp(scp_fd, os.path.join(output_dir, "train-src_%s-tar_%s.ark" % (source_class, target_class)))
+    with open(os.path.join(output_dir, "%s-src_%s-tar_%s.scp" % (split, source_class, target_class)), 'w') as scp_fd:
+        write_kaldi_hao_scp(scp_fd, ark_path)
+
+def augment(source_class, target_class):
+    model.eval()
+
+    # Process training dataset
+    print("=> Processing training data...", flush=True)
+    augment_split("train", training_loaders[source_class], source_class, target_class)
     print("=> Done with training data", flush=True)
 
     # Process dev dataset
     print("=> Processing dev data...", flush=True)
-    batches_processed = 0
-    total_batches = len(dev_loaders[source_class])
-    with open(os.path.join(output_dir, "dev-src_%s-tar_%s.ark" % (source_class, target_class)), 'w') as ark_fd:
-        for batch_idx, (feats, targets, utt_ids) in enumerate(dev_loaders[source_class]):
-            utt_id = utt_ids[0]     # Batch size 1; only one utterance
-
-            # Run batch through target decoder
-            feats_numpy = feats.numpy().reshape((-1, freq_dim))
-            num_frames = feats_numpy.shape[0]
-            decoded_feats = np.empty((num_frames, freq_dim))
-            for i in range(num_frames):
-                frame_spliced = np.zeros((time_dim, freq_dim))
-                frame_spliced[left_context - min(i, left_context):left_context, :] = feats_numpy[i - min(i, left_context):i, :]
-                frame_spliced[left_context, :] = feats_numpy[i, :]
-                frame_spliced[left_context + 1:left_context + 1 + min(num_frames - i - 1, right_context), :] = feats_numpy[i + 1:i + 1 + min(num_frames - i - 1, right_context), :]
-                frame_tensor = Variable(torch.FloatTensor(frame_spliced))
-                if on_gpu:
-                    frame_tensor = frame_tensor.cuda()
-
-                if run_mode == "ae":
-                    recon_frames = model.forward_decoder(frame_tensor, target_class)
-                elif run_mode == "vae":
-                    recon_frames, mu, logvar = model.forward_decoder(frame_tensor, target_class)
-                else:
-                    print("Unknown augment mode %s" % run_mode, flush=True)
-                    sys.exit(1)
-
-                recon_frames_numpy = recon_frames.cpu().data.numpy().reshape((-1, freq_dim))
-                decoded_feats[i, :] = recon_frames_numpy[left_context:left_context + 1, :]
-
-            # Write to output file
-            aug_utt_id = "src_%s_tar_%s_%s" % (source_class, target_class, utt_id)
-            write_kaldi_hao_ark(ark_fd, aug_utt_id, decoded_feats)
-
-            batches_processed += 1
-            if batches_processed % log_interval == 0:
-                print("===> Augmented %d/%d batches (%.1f%%)]" % (batches_processed,
-                                                                  total_batches,
-                                                                  100.0 * batches_processed / total_batches),
-                      flush=True)
-
-    # Create corresponding SCP file
-    print("===> Writing SCP...", flush=True)
-    with open(os.path.join(output_dir, "dev-src_%s-tar_%s.scp" % (source_class, target_class)), 'w') as scp_fd:
-        write_kaldi_hao_scp(scp_fd, os.path.join(output_dir, "dev-src_%s-tar_%s.ark" % (source_class, target_class)))
+    augment_split("dev", dev_loaders[source_class], source_class, target_class)
     print("=> Done with dev data", flush=True)
 
-setup_end_t = time.clock()
+setup_end_t = time.perf_counter()
 print("Completed setup in %.3f seconds" % (setup_end_t - run_start_t), flush=True)
+metrics.emit("run_start",
+             run_mode=run_mode,
+             domain_adversarial=domain_adversarial,
+             gan=gan,
+             decoder_classes=decoder_classes,
+             setup_seconds=setup_end_t - run_start_t)
 
 # Go through each combo of source and target class
 for source_class in decoder_classes:
     for target_class in decoder_classes:
-        process_start_t = time.clock()
+        process_start_t = time.perf_counter()
         print("PROCESSING SOURCE %s, TARGET %s" % (source_class, target_class), flush=True)
         augment(source_class, target_class)
-        process_end_t = time.clock()
+        process_end_t = time.perf_counter()
         print("PROCESSED SOURCE %s, TARGET %s IN %.3f SECONDS" % (source_class, target_class, process_end_t - process_start_t), flush=True)
+        metrics.emit("pair_end",
+                     source_class=source_class,
+                     target_class=target_class,
+                     seconds=process_end_t - process_start_t,
+                     utterances=len(training_datasets[source_class].scp_lines) + len(dev_datasets[source_class].scp_lines))
+
+finish_timing(timer)
+print_cache_stats(utt_cache)
 
-run_end_t = time.clock()
+run_end_t = time.perf_counter()
 print("Completed data augmentation run in %.3f seconds" % (run_end_t - run_start_t), flush=True)
+metrics.emit("run_end", seconds=run_end_t - run_start_t)
+metrics.close()
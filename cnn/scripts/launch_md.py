@@ -0,0 +1,127 @@
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+# Runs train_md.py as N local data-parallel ranks (see cnn/md_distributed.py)
+# Rank 0's output goes to stdout; rank k's goes to <rank log dir>/train_md.rank<k>.log
+# With --scaling 1_2_4, runs training once per process count and reports throughput and scaling efficiency
+# (keep these runs short, e.g. with DATASET_FRACTION=0.05 EPOCHS=1).
+# Across nodes, skip this script: start one train_md.py per rank (e.g. with srun) with MASTER_ADDR/MASTER_PORT set.
+
+THROUGHPUT_RE = re.compile(r"^Training throughput: ([0-9.]+) frames/s over ([0-9]+) rank")
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+# Echoes rank 0's output and collects its throughput lines (runs on its own thread, so the launcher
+# can watch every rank while rank 0 is still printing)
+def stream_rank0(stdout, throughputs):
+    for line in stdout:
+        print(line, end='', flush=True)
+        match = THROUGHPUT_RE.match(line)
+        if match is not None:
+            throughputs.append(float(match.group(1)))
+
+# Returns (exit code, throughputs printed by rank 0, one per epoch)
+def launch(num_procs, train_args, rank_log_dir, extra_env=None):
+    base_env = dict(os.environ)
+    if extra_env is not None:
+        base_env.update(extra_env)
+    base_env["WORLD_SIZE"] = str(num_procs)
+    base_env.setdefault("MASTER_ADDR", "127.0.0.1")
+    base_env["MASTER_PORT"] = str(free_port()) if "MASTER_PORT" not in os.environ else os.environ["MASTER_PORT"]
+
+    # Split the machine's cores between ranks, unless told otherwise
+    if "OMP_NUM_THREADS" not in base_env:
+        base_env["OMP_NUM_THREADS"] = str(max(1, (os.cpu_count() or 1) // num_procs))
+
+    procs = []
+    rank_logs = []
+    for rank in range(num_procs):
+        env = dict(base_env, RANK=str(rank))
+        argv = [sys.executable, "cnn/scripts/train_md.py"] + train_args
+        if rank == 0:
+            procs.append(subprocess.Popen(argv, env=env, stdout=subprocess.PIPE, universal_newlines=True))
+        else:
+            rank_log = open(os.path.join(rank_log_dir, "train_md.rank%d.log" % rank), 'w')
+            rank_logs.append(rank_log)
+            procs.append(subprocess.Popen(argv, env=env, stdout=rank_log, stderr=subprocess.STDOUT))
+
+    throughputs = []
+    stream_thread = threading.Thread(target=stream_rank0, args=(procs[0].stdout, throughputs), daemon=True)
+    stream_thread.start()
+
+    # If any rank dies, the others would block in a collective forever, so stop them all on the first failure
+    exit_code = 0
+    remaining = list(procs)
+    while len(remaining) > 0:
+        for proc in list(remaining):
+            if proc.poll() is not None:
+                remaining.remove(proc)
+                if proc.returncode != 0 and exit_code == 0:
+                    exit_code = proc.returncode
+                    for other in remaining:
+                        other.terminate()
+        time.sleep(0.1)
+    stream_thread.join()
+
+    for rank_log in rank_logs:
+        rank_log.close()
+    return exit_code, throughputs
+
+def print_scaling_report(results):
+    base_procs, base_throughput = results[0]
+    print("\nSCALING REPORT", flush=True)
+    print("%8s %14s %10s %12s" % ("procs", "frames/s", "speedup", "efficiency"), flush=True)
+    for num_procs, throughput in results:
+        speedup = throughput / base_throughput
+        efficiency = speedup * base_procs / num_procs
+        print("%8d %14.1f %10.2f %11.1f%%" % (num_procs, throughput, speedup, efficiency * 100.0), flush=True)
+
+
+
+# Parse command line args
+scaling = None
+if len(sys.argv) == 6 and sys.argv[1] == "--scaling":
+    scaling = [int(num_procs) for num_procs in sys.argv[2].split("_") if len(num_procs) > 0]
+    train_args = sys.argv[3:]
+elif len(sys.argv) == 5:
+    num_procs = int(sys.argv[1])
+    train_args = sys.argv[2:]
+else:
+    print("Usage: python cnn/scripts/launch_md.py <num procs | --scaling N1_N2_...> <run mode> <domain_adversarial true/false> <GAN true/false>", flush=True)
+    sys.exit(1)
+rank_log_dir = os.environ.get("LOG_DIR", ".")
+
+if scaling is None:
+    exit_code, throughputs = launch(num_procs, train_args, rank_log_dir)
+    sys.exit(exit_code)
+
+# Each scaling run trains from scratch in its own model directory
+results = []
+for num_procs in scaling:
+    print("\nSCALING RUN: %d process(es)" % num_procs, flush=True)
+    model_dir = os.path.join(os.environ["MODEL_DIR"], "scaling_%d" % num_procs)
+    os.makedirs(model_dir, exist_ok=True)
+    exit_code, throughputs = launch(num_procs,
+                                    train_args,
+                                    rank_log_dir,
+                                    extra_env={"MODEL_DIR": model_dir, "RESUME_TRAINING": "false"})
+    if exit_code != 0 or len(throughputs) == 0:
+        print("Scaling run with %d process(es) failed (exit code %d)" % (num_procs, exit_code), flush=True)
+        sys.exit(1)
+    # First epoch only, so every run is measured over the same amount of work
+    results.append((num_procs, throughputs[0]))
+
+print_scaling_report(results)
+with open(os.path.join(os.environ["MODEL_DIR"], "scaling_report.json"), 'w') as report_fd:
+    json.dump([{"procs": num_procs, "frames_per_sec": throughput} for num_procs, throughput in results], report_fd, indent=2)
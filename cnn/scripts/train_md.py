@@ -1,7 +1,7 @@
+import copy
 import math
 import os
 import random
-import shutil
 import sys
 import time
 
@@ -18,11 +18,19 @@ sys.path.append("./cnn")
 from cnn_md import CNNMultidecoder, CNNVariationalMultidecoder
 from cnn_md import CNNDomainAdversarialMultidecoder
 from cnn_md import CNNGANMultidecoder
-from utils.hao_data import HaoDataset
+from checkpoint_writer import AsyncCheckpointWriter
+from eval_worker import EvalWorker
+from md_distributed import init_distributed, shard_scp_source, broadcast_model, broadcast_buffers
+from md_distributed import distribute_optimizer, allreduce_dict_sum, allreduce_scalar, allreduce_array, all_gather_objects, barrier
+from utils.hao_data import HaoDataset, HaoBlockShuffleDataset, HaoEvalDataset, pad_context
+from utils.utt_cache import cache_from_env, print_cache_stats
+from utils.scp_view import ScpView, scp_view, scp_source_from_env
+from utils.metrics_stream import metrics_from_env, normalized_losses
+from utils.timing import timer_from_env, finish_timing
 
 # Moved to function so that cProfile has a function to call
 def run_training(run_mode, domain_adversarial, gan):
-    run_start_t = time.clock()
+    run_start_t = time.perf_counter()
 
     # Set up noising
     noise_ratio = float(os.environ["NOISE_RATIO"])
@@ -109,7 +117,45 @@ def run_training(run_mode, domain_adversarial, gan):
     on_gpu = torch.cuda.is_available()
 
     val_batch_count = int(os.environ["VAL_BATCH_COUNT"])
-    log_interval = val_batch_count // 10 if val_batch_count >= 10 else val_batch_count
+
+    # VAL_MODE=bounded: validation rounds during training estimate the val loss from a fixed, speaker-stratified
+    # VAL_SAMPLE_FRACTION of the val set and stop once a VAL_CONFIDENCE_Z confidence interval decides
+    # improved/not improved against the best loss, or is within VAL_REL_TOLERANCE of the estimate (at least
+    # VAL_MIN_BATCHES utterances per class first). The final report always uses the full val set.
+    val_mode = os.environ.get("VAL_MODE", "full")
+    val_sample_fraction = float(os.environ.get("VAL_SAMPLE_FRACTION", "0.2"))
+    val_min_batches = int(os.environ.get("VAL_MIN_BATCHES", "20"))
+    val_confidence_z = float(os.environ.get("VAL_CONFIDENCE_Z", "1.96"))
+    val_rel_tolerance = float(os.environ.get("VAL_REL_TOLERANCE", "0.002"))
+
+    # EVAL_WORKER=true: validate each round's snapshot in a sidecar process (see cnn/eval_worker.py) while training
+    # goes on; early stopping and best checkpoints follow the results as they come back, a round or two late.
+    # Training only waits when more than EVAL_MAX_PENDING snapshots are unevaluated. The worker uses EVAL_THREADS
+    # CPU threads.
+    use_eval_worker = os.environ.get("EVAL_WORKER", "false") == "true"
+    eval_max_pending = int(os.environ.get("EVAL_MAX_PENDING", "2"))
+    eval_threads = int(os.environ.get("EVAL_THREADS", "4"))
+
+    # TRAIN_SAMPLER=block: stream training frames from shuffled blocks of TRAIN_BLOCK_UTTS utterances read in on-disk
+    # order, mixed through a TRAIN_SHUFFLE_BUFFER-frame shuffle buffer (HaoBlockShuffleDataset), instead of reading
+    # utterances in random order and shuffling frames within each one ("utterance", the default)
+    train_sampler = os.environ.get("TRAIN_SAMPLER", "utterance")
+    train_block_utts = int(os.environ.get("TRAIN_BLOCK_UTTS", "64"))
+    train_shuffle_buffer = int(os.environ.get("TRAIN_SHUFFLE_BUFFER", "65536"))
+
+    # Per-phase timing of the training loop (TIMING=true; see utils/timing.py)
+    timer = timer_from_env(sync=torch.cuda.synchronize if on_gpu else None)
+
+    # Gradient accumulation: every optimizer step sums the gradients of ACCUM_STEPS micro-batches of BATCH_SIZE frames
+    # LR_SCALING=linear multiplies LEARNING_RATE by the effective batch size over BATCH_SIZE (ACCUM_STEPS times the
+    # number of data-parallel ranks); LR_WARMUP_STEPS ramps up to that rate linearly over the first optimizer steps
+    accum_steps = int(os.environ.get("ACCUM_STEPS", "1"))
+    lr_scaling = os.environ.get("LR_SCALING", "none")
+    lr_warmup_steps = int(os.environ.get("LR_WARMUP_STEPS", "0"))
+
+    # VAL_BATCH_COUNT stays in micro-batches, so validation comes after the same amount of data for any ACCUM_STEPS
+    steps_per_round = max(1, val_batch_count // accum_steps)
+    log_interval = steps_per_round // 10 if steps_per_round >= 10 else steps_per_round
 
     # Set up data files
     training_scps = dict()
@@ -122,11 +168,21 @@ def run_training(run_mode, domain_adversarial, gan):
         val_scp_name = os.path.join(os.environ["CURRENT_FEATS"], "%s-val-norm.blogmel.scp" % decoder_class)
         val_scps[decoder_class] = val_scp_name
 
+    # Data-parallel training when launched as several ranks (see cnn/md_distributed.py and cnn/scripts/launch_md.py)
+    rank, world_size = init_distributed()
+    if world_size > 1:
+        print("Data-parallel training: rank %d of %d" % (rank, world_size), flush=True)
+
+    # JSON-lines throughput/loss/memory stream (METRICS_STREAM=<path>; see utils/metrics_stream.py)
+    metrics = metrics_from_env("train_md", on_gpu=on_gpu, rank=rank)
+
     # Fix random seed for debugging
     torch.manual_seed(1)
     if on_gpu:
         torch.cuda.manual_seed(1)
     random.seed(1)
+    # Each rank draws its own noise
+    np.random.seed(1 + rank)
 
     # Construct autoencoder with our parameters
     print("Constructing model...", flush=True)
@@ -214,8 +270,17 @@ def run_training(run_mode, domain_adversarial, gan):
         print("Unknown train mode %s" % run_mode, flush=True)
         sys.exit(1)
 
+    if use_eval_worker and world_size > 1:
+        print("Evaluation worker not supported for data-parallel training; validating inline", flush=True)
+        use_eval_worker = False
+    if use_eval_worker:
+        # CPU copy for the evaluation worker, taken before the model moves to the GPU
+        eval_model = copy.deepcopy(model)
+
     if on_gpu:
         model.cuda()
+    if world_size > 1:
+        broadcast_model(model)
 
     model_dir = os.environ["MODEL_DIR"]
     if domain_adversarial:
@@ -264,6 +329,43 @@ def run_training(run_mode, domain_adversarial, gan):
     def discriminative_loss(guess_output, truth_class):
         return nn.BCEWithLogitsLoss(size_average=False)(guess_output, truth_class)
 
+    # Domain adversary loss for one class's features; also run again for the encoder's negated-loss pass,
+    # so no micro-batch graph has to outlive its own backward pass
+    def domain_disc_loss(feats, decoder_class):
+        if run_mode == "ae":
+            if strided:
+                latent, fc_input_size, conv_input_sizes = model.encode(feats.view(-1,
+                                                                       1,
+                                                                       time_dim,
+                                                                       freq_dim))
+            else:
+                latent, fc_input_size, unpool_sizes, pooling_indices = model.encode(feats.view(-1,
+                                                                                               1,
+                                                                                               time_dim,
+                                                                                               freq_dim))
+        elif run_mode == "vae":
+            print("Domain adversarial VAEs not supported yet", flush=True)
+            sys.exit(1)
+        else:
+            print("Unknown train mode %s" % run_mode, flush=True)
+            sys.exit(1)
+
+        class_prediction = model.domain_adversary.forward(latent)
+        class_truth = torch.FloatTensor(np.zeros(class_prediction.size())) if decoder_class == "ihm" else torch.FloatTensor(np.ones(class_prediction.size()))
+        class_truth = Variable(class_truth)
+        if on_gpu:
+            class_truth = class_truth.cuda()
+        return discriminative_loss(class_prediction, class_truth)
+
+    # GAN discriminator loss for real examples of one class
+    def real_gan_disc_loss(feats, decoder_class):
+        class_prediction = model.forward_gan(feats, decoder_class)
+        class_truth = torch.FloatTensor(np.ones((class_prediction.size()[0], 1)))
+        class_truth = Variable(class_truth)
+        if on_gpu:
+            class_truth = class_truth.cuda()
+        return discriminative_loss(class_prediction, class_truth)
+
 
 
     # TRAIN MULTIDECODER
@@ -288,18 +390,74 @@ def run_training(run_mode, domain_adversarial, gan):
             gan_optimizers[decoder_class] = getattr(optim, optimizer_name)(model.gan_parameters(decoder_class),
                                                                            lr=learning_rate)
 
+    # With several ranks, every step() first averages that optimizer's gradients over all ranks
+    for decoder_class in decoder_classes:
+        decoder_optimizers[decoder_class] = distribute_optimizer(decoder_optimizers[decoder_class], world_size)
+    encoder_optimizer = distribute_optimizer(encoder_optimizer, world_size)
+    if domain_adversarial:
+        domain_adversary_optimizer = distribute_optimizer(domain_adversary_optimizer, world_size)
+    if gan:
+        for decoder_class in decoder_classes:
+            gan_optimizers[decoder_class] = distribute_optimizer(gan_optimizers[decoder_class], world_size)
+
+    all_optimizers = list(decoder_optimizers.values()) + [encoder_optimizer]
+    if domain_adversarial:
+        all_optimizers.append(domain_adversary_optimizer)
+    if gan:
+        all_optimizers.extend(gan_optimizers.values())
+
+    if lr_scaling == "linear":
+        target_learning_rate = learning_rate * accum_steps * world_size
+    elif lr_scaling == "none":
+        target_learning_rate = learning_rate
+    else:
+        print("Unknown LR scaling %s" % lr_scaling, flush=True)
+        sys.exit(1)
+    print("Effective batch size %d (%d x %d micro-batches x %d rank(s)); learning rate %g" % (batch_size * accum_steps * world_size,
+                                                                                           batch_size,
+                                                                                           accum_steps,
+                                                                                           world_size,
+                                                                                           target_learning_rate),
+          flush=True)
+
+    # Warmup starts from the unscaled rate (or from zero, without scaling)
+    def set_learning_rate(step):
+        if step < lr_warmup_steps:
+            start_learning_rate = learning_rate if target_learning_rate > learning_rate else 0.0
+            current_learning_rate = start_learning_rate + (target_learning_rate - start_learning_rate) * (step + 1) / lr_warmup_steps
+        else:
+            current_learning_rate = target_learning_rate
+        for optimizer in all_optimizers:
+            for param_group in optimizer.param_groups:
+                param_group["lr"] = current_learning_rate
+
     print("Setting up data...", flush=True)
     loader_kwargs = {"num_workers": 1, "pin_memory": True} if on_gpu else {}
 
+    # Decoded utterances shared by every dataset below (the val sample reuses val utterances); see job_config.sh
+    utt_cache = cache_from_env()
+
     print("Setting up training datasets...", flush=True)
     training_datasets = dict()
     training_loaders = dict()
     for decoder_class in decoder_classes:
-        current_dataset = HaoDataset(training_scps[decoder_class],
-                                     left_context=left_context,
-                                     right_context=right_context,
-                                     shuffle_utts=True,
-                                     shuffle_feats=True)
+        training_source = shard_scp_source(scp_source_from_env(training_scps[decoder_class]), rank, world_size)
+        if train_sampler == "block":
+            current_dataset = HaoBlockShuffleDataset(training_source,
+                                                     left_context=left_context,
+                                                     right_context=right_context,
+                                                     block_utts=train_block_utts,
+                                                     buffer_frames=train_shuffle_buffer,
+                                                     seed=1,
+                                                     cache=utt_cache)
+        else:
+            current_dataset = HaoDataset(training_source,
+                                         left_context=left_context,
+                                         right_context=right_context,
+                                         shuffle_utts=True,
+                                         shuffle_feats=True,
+                                         seed=1,
+                                         cache=utt_cache)
         training_datasets[decoder_class] = current_dataset
         training_loaders[decoder_class] = DataLoader(current_dataset,
                                                      batch_size=batch_size,
@@ -314,11 +472,13 @@ def run_training(run_mode, domain_adversarial, gan):
     val_datasets = dict()
     val_loaders = dict()
     for decoder_class in decoder_classes:
-        current_dataset = HaoDataset(val_scps[decoder_class],
+        current_dataset = HaoDataset(shard_scp_source(scp_source_from_env(val_scps[decoder_class]), rank, world_size),
                                      left_context=left_context,
                                      right_context=right_context,
                                      shuffle_utts=True,
-                                     shuffle_feats=True)
+                                     shuffle_feats=True,
+                                     seed=1,
+                                     cache=utt_cache)
         val_datasets[decoder_class] = current_dataset
         val_loaders[decoder_class] = DataLoader(current_dataset,
                                                 batch_size=batch_size,
@@ -329,6 +489,32 @@ def run_training(run_mode, domain_adversarial, gan):
                                                                    decoder_class),
               flush=True)
 
+    if val_mode == "bounded":
+        print("Setting up stratified val samples...", flush=True)
+        val_sample_loaders = dict()
+        for decoder_class in decoder_classes:
+            val_source = scp_source_from_env(val_scps[decoder_class])
+            val_source = val_source if isinstance(val_source, ScpView) else scp_view(val_source)
+            # No utterance shuffling: the sample is read in stratified order, so every prefix is a stratified sample.
+            # Whole utterances are the sampling unit: frames of one utterance are strongly correlated, so frame
+            # batches cut from a few utterances at a time are not independent draws for the interval.
+            current_dataset = HaoEvalDataset(shard_scp_source(val_source.stratified_subset(val_sample_fraction), rank, world_size),
+                                             shuffle_utts=False,
+                                             shuffle_feats=False,
+                                             cache=utt_cache)
+            val_sample_loaders[decoder_class] = DataLoader(current_dataset,
+                                                           batch_size=None,
+                                                           shuffle=False,
+                                                           **loader_kwargs)
+            print("Using at most %d val utterances per validation round for class %s" % (len(current_dataset),
+                                                                                         decoder_class),
+                  flush=True)
+
+        # One utterance per class per round, so the sample runs out with the smallest class (and shard)
+        val_sample_rounds = min(len(val_sample_loaders[decoder_class]) for decoder_class in decoder_classes)
+        if world_size > 1:
+            val_sample_rounds = int(allreduce_scalar(val_sample_rounds, op=torch.distributed.ReduceOp.MIN))
+
     # Set up minibatch shuffling (for training only) by decoder class
     print("Setting up minibatch shuffling for training...", flush=True)
     train_batch_counts = dict()
@@ -346,6 +532,12 @@ def run_training(run_mode, domain_adversarial, gan):
 
         # If datasets mismatch in size, use the smaller of the two
         total_train_batches = min(train_batch_counts[decoder_class], total_train_batches)
+
+    if world_size > 1:
+        # Every rank must run the same number of batches; losses are normalized by element counts over all shards
+        total_train_batches = int(allreduce_scalar(total_train_batches, op=torch.distributed.ReduceOp.MIN))
+        allreduce_dict_sum(train_element_counts)
+        allreduce_dict_sum(val_element_counts)
         
     print("%d total batches: %s" % (total_train_batches, str(train_batch_counts)), flush=True)
 
@@ -374,7 +566,15 @@ def run_training(run_mode, domain_adversarial, gan):
 
 
 
+    # Training frames drawn so far this epoch, by decoder class (the data loader position saved for resuming)
+    samples_consumed = {decoder_class: 0 for decoder_class in decoder_classes}
+
+    # Optimizer steps (logical batches) taken so far, for LR warmup
+    optimizer_steps = 0
+
+    # batch_count is in logical batches of accum_steps micro-batches
     def train(epoch, iteration, training_iterators, batch_count=10000):
+        nonlocal optimizer_steps
         decoder_class_losses = {}
         for decoder_class in decoder_classes:
             decoder_class_losses[decoder_class] = {}
@@ -395,39 +595,57 @@ def run_training(run_mode, domain_adversarial, gan):
 
         batches_processed = 0
         class_elements_processed = {decoder_class: 0 for decoder_class in decoder_classes}
+        metrics.reset_window()
 
         while batches_processed < batch_count:
-            # Get data for each decoder class
-            feat_dict = dict()
-            targets_dict = dict()
-            element_counts = dict()     # Used to get loss per element, rather than batch, in printed output
-            for decoder_class in decoder_classes:
-                feats, targets = training_iterators[decoder_class].next()
-                element_counts[decoder_class] = feats.size()[0]
-
-                feats = Variable(feats)
-                targets = Variable(targets)
-                if on_gpu:
-                    feats = feats.cuda()
-                    targets = targets.cuda()
+            # Get data for each decoder class, as accum_steps micro-batches whose gradients add up to one logical batch
+            micro_batches = []
+            element_counts = {decoder_class: 0 for decoder_class in decoder_classes}     # Used to get loss per element, rather than batch, in printed output
+            for micro_step in range(accum_steps):
+                feat_dict = dict()
+                targets_dict = dict()
+                for decoder_class in decoder_classes:
+                    timer.start("data_fetch")
+                    metrics.start_wait()
+                    feats, targets = next(training_iterators[decoder_class])
+                    metrics.stop_wait()
+                    timer.stop("data_fetch")
+                    element_counts[decoder_class] += feats.size()[0]
+                    samples_consumed[decoder_class] += feats.size()[0]
+
+                    feats = Variable(feats)
+                    targets = Variable(targets)
+                    if on_gpu:
+                        timer.start("host_to_device")
+                        feats = feats.cuda()
+                        targets = targets.cuda()
+                        timer.stop("host_to_device")
 
-                feat_dict[decoder_class] = feats
-                targets_dict[decoder_class] = targets
+                    feat_dict[decoder_class] = feats
+                    targets_dict[decoder_class] = targets
             
-            # Handle noising, if desired
-            noised_feat_dict = dict()
-            for decoder_class in decoder_classes:
-                feats = feat_dict[decoder_class]
-                if noise_ratio > 0.0:
-                    # Add noise to signal; randomly drop out % of elements
-                    noise_matrix = torch.FloatTensor(np.random.binomial(1, 1.0 - noise_ratio, size=feats.size()).astype(float))
-                    noise_matrix = Variable(noise_matrix)
-                    if on_gpu:
-                        noise_matrix = noise_matrix.cuda()
-                    noised_feats = torch.mul(feats, noise_matrix)
-                else:
-                    noised_feats = feats
-                noised_feat_dict[decoder_class] = noised_feats
+                # Handle noising, if desired
+                timer.start("noise")
+                noised_feat_dict = dict()
+                for decoder_class in decoder_classes:
+                    feats = feat_dict[decoder_class]
+                    if noise_ratio > 0.0:
+                        # Add noise to signal; randomly drop out % of elements
+                        noise_matrix = torch.FloatTensor(np.random.binomial(1, 1.0 - noise_ratio, size=feats.size()).astype(float))
+                        noise_matrix = Variable(noise_matrix)
+                        if on_gpu:
+                            noise_matrix = noise_matrix.cuda()
+                        noised_feats = torch.mul(feats, noise_matrix)
+                    else:
+                        noised_feats = feats
+                    noised_feat_dict[decoder_class] = noised_feats
+                timer.stop("noise")
+
+                micro_batches.append((feat_dict, targets_dict, noised_feat_dict))
+
+            # Warmup and (optionally) linearly scaled learning rate for this logical batch
+            set_learning_rate(optimizer_steps)
+            optimizer_steps += 1
 
 
             # STEP 1: Autoencoder training
@@ -441,138 +659,131 @@ def run_training(run_mode, domain_adversarial, gan):
                 other_decoder_class = decoder_classes[(i + 1) % len(decoder_classes)]
 
                 decoder_optimizers[decoder_class].zero_grad()
-                
-
-                # PHASE 1: Backprop through same decoder (denoised reconstruction)
-
-
-                noised_feats = noised_feat_dict[decoder_class]
-                targets = targets_dict[decoder_class]
 
-                if run_mode == "ae":
-                    recon_batch = model.forward_decoder(noised_feats, decoder_class)
-                elif run_mode == "vae":
-                    recon_batch, mu, logvar = model.forward_decoder(noised_feats, decoder_class)
-                else:
-                    print("Unknown train mode %s" % run_mode, flush=True)
-                    sys.exit(1)
-
-                if run_mode == "ae":
-                    r_loss = reconstruction_loss(recon_batch, targets)
-                    r_loss.backward(retain_graph=True)
-                elif run_mode == "vae":
-                    r_loss = reconstruction_loss(recon_batch, targets)
-                    k_loss = kld_loss(recon_batch, targets, mu, logvar)
-                    vae_loss = r_loss + k_loss
-                    vae_loss.backward(retain_graph=True)
-                else:
-                    print("Unknown train mode %s" % run_mode, flush=True)
-                    sys.exit(1)
-
-                decoder_class_losses[decoder_class]["autoencoding_recon_loss"] += r_loss.data[0]
-                if run_mode == "vae":
-                    decoder_class_losses[decoder_class]["autoencoding_kld"] += k_loss.data[0]
-            
-
-                if use_backtranslation:
-                    # PHASE 2: Backtranslation
+                for feat_dict, targets_dict, noised_feat_dict in micro_batches:
+                    # PHASE 1: Backprop through same decoder (denoised reconstruction)
 
 
-                    # Run (unnoised) features through other decoder in eval mode
-                    feats = feat_dict[decoder_class]
+                    timer.start("autoencoding")
+                    noised_feats = noised_feat_dict[decoder_class]
+                    targets = targets_dict[decoder_class]
 
-                    model.eval()
                     if run_mode == "ae":
-                        translated_feats = model.forward_decoder(feats, other_decoder_class)
-                    elif run_mode == "vae":
-                        translated_feats, translated_mu, translated_logvar = model.forward_decoder(feats, other_decoder_class)
-                    else:
-                        print("Unknown train mode %s" % run_mode, flush=True)
-                        sys.exit(1)
-                    
-                    # Run translated features back through original decoder
-                    model.train()
-                    if run_mode == "ae":
-                        recon_translated_batch = model.forward_decoder(translated_feats, decoder_class)
+                        recon_batch = model.forward_decoder(noised_feats, decoder_class)
                     elif run_mode == "vae":
-                        recon_translated_batch, mu, logvar = model.forward_decoder(translated_feats, decoder_class)
+                        recon_batch, mu, logvar = model.forward_decoder(noised_feats, decoder_class)
                     else:
                         print("Unknown train mode %s" % run_mode, flush=True)
                         sys.exit(1)
 
                     if run_mode == "ae":
-                        r_loss = reconstruction_loss(recon_translated_batch, targets)
+                        r_loss = reconstruction_loss(recon_batch, targets)
                         r_loss.backward(retain_graph=True)
                     elif run_mode == "vae":
-                        r_loss = reconstruction_loss(recon_translated_batch, targets)
-                        k_loss = kld_loss(recon_translated_batch, targets, mu, logvar)
+                        r_loss = reconstruction_loss(recon_batch, targets)
+                        k_loss = kld_loss(recon_batch, targets, mu, logvar)
                         vae_loss = r_loss + k_loss
                         vae_loss.backward(retain_graph=True)
                     else:
                         print("Unknown train mode %s" % run_mode, flush=True)
                         sys.exit(1)
-                    
-                    decoder_class_losses[decoder_class]["backtranslation_recon_loss"] += r_loss.data[0]
+
+                    decoder_class_losses[decoder_class]["autoencoding_recon_loss"] += r_loss.item()
                     if run_mode == "vae":
-                        decoder_class_losses[decoder_class]["backtranslation_kld"] += k_loss.data[0]
+                        decoder_class_losses[decoder_class]["autoencoding_kld"] += k_loss.item()
+                    timer.stop("autoencoding")
+            
+
+                    if use_backtranslation:
+                        # PHASE 2: Backtranslation
+
+
+                        timer.start("backtranslation")
+                        # Run (unnoised) features through other decoder in eval mode
+                        feats = feat_dict[decoder_class]
+
+                        model.eval()
+                        if run_mode == "ae":
+                            translated_feats = model.forward_decoder(feats, other_decoder_class)
+                        elif run_mode == "vae":
+                            translated_feats, translated_mu, translated_logvar = model.forward_decoder(feats, other_decoder_class)
+                        else:
+                            print("Unknown train mode %s" % run_mode, flush=True)
+                            sys.exit(1)
+                    
+                        # Run translated features back through original decoder
+                        model.train()
+                        if run_mode == "ae":
+                            recon_translated_batch = model.forward_decoder(translated_feats, decoder_class)
+                        elif run_mode == "vae":
+                            recon_translated_batch, mu, logvar = model.forward_decoder(translated_feats, decoder_class)
+                        else:
+                            print("Unknown train mode %s" % run_mode, flush=True)
+                            sys.exit(1)
+
+                        if run_mode == "ae":
+                            r_loss = reconstruction_loss(recon_translated_batch, targets)
+                            r_loss.backward(retain_graph=True)
+                        elif run_mode == "vae":
+                            r_loss = reconstruction_loss(recon_translated_batch, targets)
+                            k_loss = kld_loss(recon_translated_batch, targets, mu, logvar)
+                            vae_loss = r_loss + k_loss
+                            vae_loss.backward(retain_graph=True)
+                        else:
+                            print("Unknown train mode %s" % run_mode, flush=True)
+                            sys.exit(1)
+                    
+                        decoder_class_losses[decoder_class]["backtranslation_recon_loss"] += r_loss.item()
+                        if run_mode == "vae":
+                            decoder_class_losses[decoder_class]["backtranslation_kld"] += k_loss.item()
+                        timer.stop("backtranslation")
 
                 # Now that all losses are totaled, update weights for current decoder
+                timer.start("optimizer_step")
                 decoder_optimizers[decoder_class].step()
+                timer.stop("optimizer_step")
 
             # Now that we've seen both classes, update the encoder
+            timer.start("optimizer_step")
             encoder_optimizer.step()
+            timer.stop("optimizer_step")
 
 
             # STEP 2: Adversarial training
 
 
+            # Adversarial losses are back-propagated one micro-batch at a time, and each micro-batch's forward pass
+            # is run again for the negated-loss pass, so memory does not grow with accum_steps
             if domain_adversarial:
                 # Train just domain_adversary
+                timer.start("domain_adversary")
                 domain_adversary_optimizer.zero_grad()
-                disc_losses = dict()
-                for decoder_class in decoder_classes:
-                    feats = feat_dict[decoder_class]
+                for feat_dict, targets_dict, noised_feat_dict in micro_batches:
+                    for decoder_class in decoder_classes:
+                        disc_loss = domain_disc_loss(feat_dict[decoder_class], decoder_class)
+                        disc_loss.backward()
+                timer.stop("domain_adversary")
 
-                    if run_mode == "ae":
-                        if strided:
-                            latent, fc_input_size, conv_input_sizes = model.encode(feats.view(-1,
-                                                                                   1,
-                                                                                   time_dim,
-                                                                                   freq_dim))
-                        else:
-                            latent, fc_input_size, unpool_sizes, pooling_indices = model.encode(feats.view(-1,
-                                                                                                           1,
-                                                                                                           time_dim,
-                                                                                                           freq_dim))
-                    elif run_mode == "vae":
-                        print("Domain adversarial VAEs not supported yet", flush=True)
-                        sys.exit(1)
-                    else:
-                        print("Unknown train mode %s" % run_mode, flush=True)
-                        sys.exit(1)
-                    
-                    class_prediction = model.domain_adversary.forward(latent)
-                    class_truth = torch.FloatTensor(np.zeros(class_prediction.size())) if decoder_class == "ihm" else torch.FloatTensor(np.ones(class_prediction.size()))
-                    class_truth = Variable(class_truth)
-                    if on_gpu:
-                        class_truth = class_truth.cuda()
-                    disc_loss = discriminative_loss(class_prediction, class_truth)
-                    disc_loss.backward(retain_graph=True)
-                    disc_losses[decoder_class] = disc_loss
-                
                 # Now that we've seen both classes, update the adversary
+                timer.start("optimizer_step")
                 domain_adversary_optimizer.step()
+                timer.stop("optimizer_step")
                         
                 # Train just encoder, using negative discriminative loss instead
+                timer.start("domain_adversary_encoder")
                 encoder_optimizer.zero_grad()
-                for decoder_class in decoder_classes:
-                    disc_loss = disc_losses[decoder_class]
-                    domain_adv_loss = -disc_loss
-                    domain_adv_loss.backward(retain_graph=True)
-                    decoder_class_losses[decoder_class]["domain_adversarial_loss"] += domain_adv_loss.data[0]
+                for feat_dict, targets_dict, noised_feat_dict in micro_batches:
+                    for decoder_class in decoder_classes:
+                        disc_loss = domain_disc_loss(feat_dict[decoder_class], decoder_class)
+                        domain_adv_loss = -disc_loss
+                        domain_adv_loss.backward()
+                        decoder_class_losses[decoder_class]["domain_adversarial_loss"] += domain_adv_loss.item()
+                timer.stop("domain_adversary_encoder")
 
                 # Now that we've seen both classes, update the encoder
+                timer.start("optimizer_step")
                 encoder_optimizer.step()
+                timer.stop("optimizer_step")
             elif gan:
                 # Generative adversarial loss
                 # Adversary determines whether output is real data, or TRANSFORMED data
@@ -584,80 +795,84 @@ def run_training(run_mode, domain_adversarial, gan):
                     decoder_optimizers[decoder_class].zero_grad()
 
                 # Train just discriminators
-                real_disc_losses = dict()   # Store these so we don't need to compute them again
-                fake_disc_losses = dict()   # Store these so we don't need to compute them again
-                for i in range(len(decoder_classes)):
-                    # This is dumb with two classes, I know
-                    decoder_class = decoder_classes[i]
-                    other_decoder_class = decoder_classes[(i + 1) % len(decoder_classes)]
-
-                    feats = feat_dict[decoder_class] 
-
-                    if run_mode == "ae":
-                        # Create minibatch of transformed examples
-                        sim_feats = model.forward_decoder(feats, other_decoder_class)
-                    elif run_mode == "vae":
-                        print("Generative adversarial VAEs not supported yet", flush=True)
-                        sys.exit(1)
-                    else:
-                        print("Unknown train mode %s" % run_mode, flush=True)
-                        sys.exit(1)
-                    
-                    # Real examples
-                    class_prediction = model.forward_gan(feats, decoder_class)
-                    class_truth = torch.FloatTensor(np.ones((class_prediction.size()[0], 1)))
-                    class_truth = Variable(class_truth)
-                    if on_gpu:
-                        class_truth = class_truth.cuda()
-                    real_disc_loss = discriminative_loss(class_prediction, class_truth)
+                timer.start("gan_discriminators")
+                for feat_dict, targets_dict, noised_feat_dict in micro_batches:
+                    for i in range(len(decoder_classes)):
+                        # This is dumb with two classes, I know
+                        decoder_class = decoder_classes[i]
+                        other_decoder_class = decoder_classes[(i + 1) % len(decoder_classes)]
+
+                        feats = feat_dict[decoder_class] 
+
+                        if run_mode == "ae":
+                            # Create minibatch of transformed examples
+                            sim_feats = model.forward_decoder(feats, other_decoder_class)
+                        elif run_mode == "vae":
+                            print("Generative adversarial VAEs not supported yet", flush=True)
+                            sys.exit(1)
+                        else:
+                            print("Unknown train mode %s" % run_mode, flush=True)
+                            sys.exit(1)
                     
-                    real_disc_loss.backward(retain_graph=True)
-                    real_disc_losses[decoder_class] = real_disc_loss
+                        # Real examples
+                        real_disc_loss = real_gan_disc_loss(feats, decoder_class)
+                        real_disc_loss.backward()
                     
-                    # Fake examples
-                    class_prediction = model.forward_gan(sim_feats, other_decoder_class)
-                    class_truth = torch.FloatTensor(np.zeros((class_prediction.size()[0], 1)))
-                    class_truth = Variable(class_truth)
-                    if on_gpu:
-                        class_truth = class_truth.cuda()
-                    fake_disc_loss = discriminative_loss(class_prediction, class_truth)
+                        # Fake examples
+                        class_prediction = model.forward_gan(sim_feats, other_decoder_class)
+                        class_truth = torch.FloatTensor(np.zeros((class_prediction.size()[0], 1)))
+                        class_truth = Variable(class_truth)
+                        if on_gpu:
+                            class_truth = class_truth.cuda()
+                        fake_disc_loss = discriminative_loss(class_prediction, class_truth)
                     
-                    fake_disc_loss.backward(retain_graph=True)
-                    fake_disc_losses[other_decoder_class] = real_disc_loss
+                        fake_disc_loss.backward()
+                timer.stop("gan_discriminators")
 
+                timer.start("optimizer_step")
                 for decoder_class in decoder_classes:
                     # Update discriminators, now that we've seen real and fake examples for both
                     gan_optimizers[decoder_class].step()
+                timer.stop("optimizer_step")
                 
                 # Train encoder + decoders, w/ negative discriminative losses
+                # The generator pass has always reused the real-example loss for the fake term; it is kept as it was
+                timer.start("gan_generators")
                 encoder_optimizer.zero_grad()
-                for i in range(len(decoder_classes)):
-                    # This is dumb with two classes, I know
-                    decoder_class = decoder_classes[i]
-                    other_decoder_class = decoder_classes[(i + 1) % len(decoder_classes)]
+                for feat_dict, targets_dict, noised_feat_dict in micro_batches:
+                    for i in range(len(decoder_classes)):
+                        # This is dumb with two classes, I know
+                        decoder_class = decoder_classes[i]
+                        other_decoder_class = decoder_classes[(i + 1) % len(decoder_classes)]
+
+                        real_disc_loss = real_gan_disc_loss(feat_dict[decoder_class], decoder_class)
 
-                    # Real examples
-                    real_disc_loss = real_disc_losses[decoder_class]
-                    real_adv_loss = -real_disc_loss
-                    real_adv_loss.backward(retain_graph=True)
+                        # Real examples
+                        real_adv_loss = -real_disc_loss
+                        real_adv_loss.backward(retain_graph=True)
 
-                    decoder_class_losses[decoder_class]["real_gan_loss"] += real_adv_loss.data[0]                
+                        decoder_class_losses[decoder_class]["real_gan_loss"] += real_adv_loss.item()                
                     
-                    # Fake examples
-                    fake_disc_loss = fake_disc_losses[other_decoder_class]
-                    fake_adv_loss = -fake_disc_loss
-                    fake_adv_loss.backward(retain_graph=True)
+                        # Fake examples
+                        fake_adv_loss = -real_disc_loss
+                        fake_adv_loss.backward()
 
-                    decoder_class_losses[other_decoder_class]["fake_gan_loss"] += fake_adv_loss.data[0]                
+                        decoder_class_losses[other_decoder_class]["fake_gan_loss"] += fake_adv_loss.item()                
+                timer.stop("gan_generators")
                 # Update decoders and encoder, now that we've seen real and fake examples for both
+                timer.start("optimizer_step")
                 for decoder_class in decoder_classes:
                     decoder_optimizers[decoder_class].step()
                 encoder_optimizer.step()
+                timer.stop("optimizer_step")
 
             # Print updates, if any
             batches_processed += 1
             for decoder_class in decoder_classes:
                 class_elements_processed[decoder_class] += element_counts[decoder_class]
+                metrics.add(decoder_class, frames=element_counts[decoder_class], batches=accum_steps)
+            timer.count("batches")
+            timer.count("frames", sum(element_counts.values()))
 
             if batches_processed % log_interval == 0:
                 print("Train epoch %d, iteration %d: [%d/%d (%.1f%%)]" % (epoch,
@@ -667,9 +882,19 @@ def run_training(run_mode, domain_adversarial, gan):
                                                                           batches_processed / batch_count * 100.0),
                       flush=True)
                 print_loss_dict(decoder_class_losses, class_elements_processed) 
+                timer.maybe_report()
+                metrics.emit_throughput("train_progress",
+                                        epoch=epoch,
+                                        iteration=iteration,
+                                        batch=batches_processed,
+                                        batch_count=batch_count,
+                                        optimizer_steps=optimizer_steps,
+                                        losses=normalized_losses(decoder_class_losses, class_elements_processed),
+                                        total_loss=total_loss(decoder_class_losses, class_elements_processed))
         return (decoder_class_losses, class_elements_processed)
 
-    def test(epoch, loaders, recon_only=False, noised=True):
+    # Zeroed per-class loss sums, with the keys test_batch() adds to
+    def new_test_loss_dict(recon_only=False):
         decoder_class_losses = {}
         for decoder_class in decoder_classes:
             decoder_class_losses[decoder_class] = {}
@@ -687,262 +912,684 @@ def run_training(run_mode, domain_adversarial, gan):
             elif gan and not recon_only:
                 decoder_class_losses[decoder_class]["real_gan_loss"] = 0.0
                 decoder_class_losses[decoder_class]["fake_gan_loss"] = 0.0
+        return decoder_class_losses
 
-        other_decoder_class = decoder_classes[1]
-        for decoder_class in decoder_classes:
-            for feats, targets in loaders[decoder_class]:
-                # Set to volatile so history isn't saved (i.e., not training time)
-                feats = Variable(feats, volatile=True)
-                targets = Variable(targets, volatile=True)
+    # Add one validation batch of decoder_class to the loss sums (no weight updates)
+    def test_batch(feats, targets, decoder_class, other_decoder_class, decoder_class_losses, recon_only=False, noised=True):
+        # Set to volatile so history isn't saved (i.e., not training time)
+        feats = Variable(feats, volatile=True)
+        targets = Variable(targets, volatile=True)
+        if on_gpu:
+            feats = feats.cuda()
+            targets = targets.cuda()
+
+        # Set up noising, if needed
+        if noised:
+            if noise_ratio > 0.0:
+                # Add noise to signal; randomly drop out % of elements
+                noise_matrix = torch.FloatTensor(np.random.binomial(1, 1.0 - noise_ratio, size=feats.size()).astype(float))
+                noise_matrix = Variable(noise_matrix, volatile=True)
                 if on_gpu:
-                    feats = feats.cuda()
-                    targets = targets.cuda()
-            
-                # Set up noising, if needed
-                if noised:
-                    if noise_ratio > 0.0:
-                        # Add noise to signal; randomly drop out % of elements
-                        noise_matrix = torch.FloatTensor(np.random.binomial(1, 1.0 - noise_ratio, size=feats.size()).astype(float))
-                        noise_matrix = Variable(noise_matrix, volatile=True)
-                        if on_gpu:
-                            noise_matrix = noise_matrix.cuda()
-                        noised_feats = torch.mul(feats, noise_matrix)
-                    else:
-                        noised_feats = feats.clone()
+                    noise_matrix = noise_matrix.cuda()
+                noised_feats = torch.mul(feats, noise_matrix)
+            else:
+                noised_feats = feats.clone()
 
-                # PHASE 1: Backprop through same decoder (denoised autoencoding)
-                model.eval()
-                if run_mode == "ae":
-                    if noised:
-                        recon_batch = model.forward_decoder(noised_feats, decoder_class)
-                    else:
-                        recon_batch = model.forward_decoder(feats, decoder_class)
-                elif run_mode == "vae":
-                    if noised:
-                        recon_batch, mu, logvar = model.forward_decoder(noised_feats, decoder_class)
-                    else:
-                        recon_batch, mu, logvar = model.forward_decoder(feats, decoder_class)
-                else:
-                    print("Unknown train mode %s" % run_mode, flush=True)
-                    sys.exit(1)
-
-                if run_mode == "ae" or recon_only:
-                    r_loss = reconstruction_loss(recon_batch, targets)
-                elif run_mode == "vae":
-                    r_loss = reconstruction_loss(recon_batch, targets)
-                    k_loss = kld_loss(recon_batch, targets, mu, logvar)
-                    vae_loss = r_loss + k_loss
-                else:
-                    print("Unknown train mode %s" % run_mode, flush=True)
-                    sys.exit(1)
+        # PHASE 1: Backprop through same decoder (denoised autoencoding)
+        model.eval()
+        if run_mode == "ae":
+            if noised:
+                recon_batch = model.forward_decoder(noised_feats, decoder_class)
+            else:
+                recon_batch = model.forward_decoder(feats, decoder_class)
+        elif run_mode == "vae":
+            if noised:
+                recon_batch, mu, logvar = model.forward_decoder(noised_feats, decoder_class)
+            else:
+                recon_batch, mu, logvar = model.forward_decoder(feats, decoder_class)
+        else:
+            print("Unknown train mode %s" % run_mode, flush=True)
+            sys.exit(1)
 
-                decoder_class_losses[decoder_class]["autoencoding_recon_loss"] += r_loss.data[0]
-                if run_mode == "vae" and not recon_only:
-                    decoder_class_losses[decoder_class]["autoencoding_kld"] += k_loss.data[0]
+        if run_mode == "ae" or recon_only:
+            r_loss = reconstruction_loss(recon_batch, targets)
+        elif run_mode == "vae":
+            r_loss = reconstruction_loss(recon_batch, targets)
+            k_loss = kld_loss(recon_batch, targets, mu, logvar)
+            vae_loss = r_loss + k_loss
+        else:
+            print("Unknown train mode %s" % run_mode, flush=True)
+            sys.exit(1)
 
-                if use_backtranslation:
-                    # PHASE 2: Backtranslation
+        decoder_class_losses[decoder_class]["autoencoding_recon_loss"] += r_loss.item()
+        if run_mode == "vae" and not recon_only:
+            decoder_class_losses[decoder_class]["autoencoding_kld"] += k_loss.item()
 
-                    # Run (unnoised) features through other decoder
-                    if run_mode == "ae":
-                        translated_feats = model.forward_decoder(feats, other_decoder_class)
-                    elif run_mode == "vae":
-                        translated_feats, translated_mu, translated_logvar = model.forward_decoder(feats, other_decoder_class)
-                    else:
-                        print("Unknown train mode %s" % run_mode, flush=True)
-                        sys.exit(1)
-                    
-                    # Run translated features back through original decoder
-                    if run_mode == "ae":
-                        recon_translated_batch = model.forward_decoder(translated_feats, decoder_class)
-                    elif run_mode == "vae":
-                        recon_translated_batch, mu, logvar = model.forward_decoder(translated_feats, decoder_class)
-                    else:
-                        print("Unknown train mode %s" % run_mode, flush=True)
-                        sys.exit(1)
+        if use_backtranslation:
+            # PHASE 2: Backtranslation
 
-                    if run_mode == "ae" or recon_only:
-                        r_loss = reconstruction_loss(recon_translated_batch, targets)
-                    elif run_mode == "vae":
-                        r_loss = reconstruction_loss(recon_translated_batch, targets)
-                        k_loss = kld_loss(recon_translate_batch, targets, mu, logvar)
-                        vae_loss = r_loss + k_loss
-                    else:
-                        print("Unknown train mode %s" % run_mode, flush=True)
-                        sys.exit(1)
-                    
-                    decoder_class_losses[decoder_class]["backtranslation_recon_loss"] += r_loss.data[0]
-                    if run_mode == "vae" and not recon_only:
-                        decoder_class_losses[decoder_class]["backtranslation_kld"] += k_loss.data[0]
-               
-                if domain_adversarial and not recon_only:
-                    # Domain adversarial loss
-                    if run_mode == "ae":
-                        if strided:
-                            latent, fc_input_size, conv_input_sizes = model.encode(feats.view(-1,
-                                                                                   1,
-                                                                                   time_dim,
-                                                                                   freq_dim))
-                        else:
-                            latent, fc_input_size, unpool_sizes, pooling_indices = model.encode(feats.view(-1,
-                                                                                                           1,
-                                                                                                           time_dim,
-                                                                                                           freq_dim))
-                    elif run_mode == "vae":
-                        print("Domain adversarial VAEs not supported yet", flush=True)
-                        sys.exit(1)
-                    else:
-                        print("Unknown train mode %s" % run_mode, flush=True)
-                        sys.exit(1)
-                    
-                    class_prediction = model.domain_adversary.forward(latent)
-                    class_truth = torch.FloatTensor(np.zeros(class_prediction.size())) if decoder_class == "ihm" else torch.FloatTensor(np.ones(class_prediction.size()))
-                    class_truth = Variable(class_truth, volatile=True)
-                    if on_gpu:
-                        class_truth = class_truth.cuda()
-                    disc_loss = discriminative_loss(class_prediction, class_truth)
-                    domain_adv_loss = -disc_loss
-                    
-                    decoder_class_losses[decoder_class]["domain_adversarial_loss"] += domain_adv_loss.data[0]
-                elif gan and not recon_only:
-                    # Generative adversarial loss
-                    # Adversary determines whether output is real data, or TRANSFORMED data
-                    # i.e., is this example real SDM1 data, or IHM data decoded into SDM1 via multidecoder?
-                    if run_mode == "ae":
-                        # Create minibatch of transformed examples
-                        sim_feats = model.forward_decoder(feats, other_decoder_class)
-                    elif run_mode == "vae":
-                        print("Generative adversarial VAEs not supported yet", flush=True)
-                        sys.exit(1)
-                    else:
-                        print("Unknown train mode %s" % run_mode, flush=True)
-                        sys.exit(1)
-                
-                    # Real examples
-                    class_prediction = model.forward_gan(feats, decoder_class)
-                    class_truth = torch.FloatTensor(np.ones((class_prediction.size()[0], 1)))
-                    class_truth = Variable(class_truth, volatile=True)
-                    if on_gpu:
-                        class_truth = class_truth.cuda()
-                    real_disc_loss = discriminative_loss(class_prediction, class_truth)
-                    real_adv_loss = -real_disc_loss
-                    decoder_class_losses[decoder_class]["real_gan_loss"] += real_adv_loss.data[0]                
-                    
-                    # Fake examples
-                    class_prediction = model.forward_gan(sim_feats, other_decoder_class)
-                    class_truth = torch.FloatTensor(np.zeros((class_prediction.size()[0], 1)))
-                    class_truth = Variable(class_truth, volatile=True)
-                    if on_gpu:
-                        class_truth = class_truth.cuda()
-                    fake_disc_loss = discriminative_loss(class_prediction, class_truth)
-                    fake_adv_loss = -fake_disc_loss
-                    decoder_class_losses[other_decoder_class]["fake_gan_loss"] += fake_adv_loss.data[0]                
+            # Run (unnoised) features through other decoder
+            if run_mode == "ae":
+                translated_feats = model.forward_decoder(feats, other_decoder_class)
+            elif run_mode == "vae":
+                translated_feats, translated_mu, translated_logvar = model.forward_decoder(feats, other_decoder_class)
+            else:
+                print("Unknown train mode %s" % run_mode, flush=True)
+                sys.exit(1)
+
+            # Run translated features back through original decoder
+            if run_mode == "ae":
+                recon_translated_batch = model.forward_decoder(translated_feats, decoder_class)
+            elif run_mode == "vae":
+                recon_translated_batch, mu, logvar = model.forward_decoder(translated_feats, decoder_class)
+            else:
+                print("Unknown train mode %s" % run_mode, flush=True)
+                sys.exit(1)
+
+            if run_mode == "ae" or recon_only:
+                r_loss = reconstruction_loss(recon_translated_batch, targets)
+            elif run_mode == "vae":
+                r_loss = reconstruction_loss(recon_translated_batch, targets)
+                k_loss = kld_loss(recon_translate_batch, targets, mu, logvar)
+                vae_loss = r_loss + k_loss
+            else:
+                print("Unknown train mode %s" % run_mode, flush=True)
+                sys.exit(1)
+
+            decoder_class_losses[decoder_class]["backtranslation_recon_loss"] += r_loss.item()
+            if run_mode == "vae" and not recon_only:
+                decoder_class_losses[decoder_class]["backtranslation_kld"] += k_loss.item()
+
+        if domain_adversarial and not recon_only:
+            # Domain adversarial loss
+            if run_mode == "ae":
+                if strided:
+                    latent, fc_input_size, conv_input_sizes = model.encode(feats.view(-1,
+                                                                           1,
+                                                                           time_dim,
+                                                                           freq_dim))
+                else:
+                    latent, fc_input_size, unpool_sizes, pooling_indices = model.encode(feats.view(-1,
+                                                                                                   1,
+                                                                                                   time_dim,
+                                                                                                   freq_dim))
+            elif run_mode == "vae":
+                print("Domain adversarial VAEs not supported yet", flush=True)
+                sys.exit(1)
+            else:
+                print("Unknown train mode %s" % run_mode, flush=True)
+                sys.exit(1)
+
+            class_prediction = model.domain_adversary.forward(latent)
+            class_truth = torch.FloatTensor(np.zeros(class_prediction.size())) if decoder_class == "ihm" else torch.FloatTensor(np.ones(class_prediction.size()))
+            class_truth = Variable(class_truth, volatile=True)
+            if on_gpu:
+                class_truth = class_truth.cuda()
+            disc_loss = discriminative_loss(class_prediction, class_truth)
+            domain_adv_loss = -disc_loss
+
+            decoder_class_losses[decoder_class]["domain_adversarial_loss"] += domain_adv_loss.item()
+        elif gan and not recon_only:
+            # Generative adversarial loss
+            # Adversary determines whether output is real data, or TRANSFORMED data
+            # i.e., is this example real SDM1 data, or IHM data decoded into SDM1 via multidecoder?
+            if run_mode == "ae":
+                # Create minibatch of transformed examples
+                sim_feats = model.forward_decoder(feats, other_decoder_class)
+            elif run_mode == "vae":
+                print("Generative adversarial VAEs not supported yet", flush=True)
+                sys.exit(1)
+            else:
+                print("Unknown train mode %s" % run_mode, flush=True)
+                sys.exit(1)
+
+            # Real examples
+            class_prediction = model.forward_gan(feats, decoder_class)
+            class_truth = torch.FloatTensor(np.ones((class_prediction.size()[0], 1)))
+            class_truth = Variable(class_truth, volatile=True)
+            if on_gpu:
+                class_truth = class_truth.cuda()
+            real_disc_loss = discriminative_loss(class_prediction, class_truth)
+            real_adv_loss = -real_disc_loss
+            decoder_class_losses[decoder_class]["real_gan_loss"] += real_adv_loss.item()                
+
+            # Fake examples
+            class_prediction = model.forward_gan(sim_feats, other_decoder_class)
+            class_truth = torch.FloatTensor(np.zeros((class_prediction.size()[0], 1)))
+            class_truth = Variable(class_truth, volatile=True)
+            if on_gpu:
+                class_truth = class_truth.cuda()
+            fake_disc_loss = discriminative_loss(class_prediction, class_truth)
+            fake_adv_loss = -fake_disc_loss
+            decoder_class_losses[other_decoder_class]["fake_gan_loss"] += fake_adv_loss.item()                
+
+    def test(epoch, loaders, recon_only=False, noised=True):
+        decoder_class_losses = new_test_loss_dict(recon_only=recon_only)
+
+        other_decoder_class = decoder_classes[1]
+        for decoder_class in decoder_classes:
+            # Same utterance order and frame shuffles on every pass, so losses are comparable between rounds
+            loaders[decoder_class].dataset.set_epoch(0)
+            for feats, targets in loaders[decoder_class]:
+                test_batch(feats, targets, decoder_class, other_decoder_class, decoder_class_losses, recon_only=recon_only, noised=noised)
 
             other_decoder_class = decoder_class
+
+        if world_size > 1:
+            # Sum losses over all ranks' shards
+            allreduce_dict_sum(decoder_class_losses)
             
         return decoder_class_losses
 
+    # Estimate of test()'s total loss from sums over sampled utterances, per class: utterances n, frames x and each
+    # utterance's contribution y to the class's share of the total (ratio estimator sum(y)/sum(x) per class, with
+    # a finite-population-corrected normal interval); returns (estimate, confidence interval half-width)
+    def estimate_total_loss(sums):
+        estimate = 0.0
+        variance = 0.0
+        for class_idx, decoder_class in enumerate(decoder_classes):
+            n, sum_x, sum_y, sum_xx, sum_xy, sum_yy = sums[class_idx]
+            ratio = sum_y / sum_x
+            estimate += ratio
+            if n < 2:
+                variance = float('inf')
+                continue
+            residual_ss = max(0.0, sum_yy - 2.0 * ratio * sum_xy + ratio * ratio * sum_xx)
+            fpc = max(0.0, 1.0 - sum_x / val_element_counts[decoder_class])
+            variance += fpc * (residual_ss / (n - 1)) * n / (sum_x * sum_x)
+        return estimate, val_confidence_z * math.sqrt(variance)
+
+    # Context windows for every frame of an utterance, in chunks of at most batch_size frames (test_batch() input)
+    def utt_batches(feat_mat):
+        padded_mat = torch.from_numpy(pad_context(feat_mat.numpy(), left_context, right_context))
+        windows = padded_mat.unfold(0, left_context + right_context + 1, 1).transpose(1, 2).contiguous()
+        for start in range(0, windows.size()[0], batch_size):
+            yield windows[start:start + batch_size]
+
+    # Bounded-cost alternative to test() for validation rounds (VAL_MODE=bounded): one utterance per class per round
+    # from the stratified sample until the estimate's interval settles how it compares to best_loss
+    # Returns (estimated total loss, half-width, sampled loss sums, sampled element counts, rounds, decision)
+    def test_bounded(epoch, loaders, best_loss):
+        decoder_class_losses = new_test_loss_dict()
+        sample_element_counts = {decoder_class: 0 for decoder_class in decoder_classes}
+        other_decoder_classes = {decoder_class: decoder_classes[class_idx - 1] if class_idx > 0 else decoder_classes[1]
+                                 for class_idx, decoder_class in enumerate(decoder_classes)}
+
+        iterators = {decoder_class: iter(loaders[decoder_class]) for decoder_class in decoder_classes}
+
+        sums = np.zeros((len(decoder_classes), 6))
+        estimate, half_width = float('inf'), float('inf')
+        decision = "sample exhausted"
+        rounds = 0
+        while rounds < val_sample_rounds:
+            round_sums = np.zeros((len(decoder_classes), 6))
+            for class_idx, decoder_class in enumerate(decoder_classes):
+                utt_feats, utt_targets, utt_id = next(iterators[decoder_class])
+                loss_before = total_loss(decoder_class_losses, val_element_counts)
+                for feats in utt_batches(utt_feats):
+                    test_batch(feats, feats.clone(), decoder_class, other_decoder_classes[decoder_class], decoder_class_losses)
+                # Scaled so that summing y over the whole val set of this class gives N * (its share of the total)
+                y = (total_loss(decoder_class_losses, val_element_counts) - loss_before) * val_element_counts[decoder_class]
+                x = float(utt_feats.size()[0])
+                round_sums[class_idx] += [1.0, x, y, x * x, x * y, y * y]
+                sample_element_counts[decoder_class] += utt_feats.size()[0]
+            if world_size > 1:
+                # Every rank sees the same sums, and so makes the same stopping decision
+                round_sums = allreduce_array(round_sums)
+            sums += round_sums
+            rounds += 1
+
+            if rounds < val_min_batches:
+                continue
+            estimate, half_width = estimate_total_loss(sums)
+            if estimate + half_width < best_loss:
+                decision = "improved"
+                break
+            if estimate - half_width > best_loss:
+                decision = "not improved"
+                break
+            if half_width <= val_rel_tolerance * abs(estimate):
+                decision = "converged"
+                break
+
+        if decision == "sample exhausted":
+            estimate, half_width = estimate_total_loss(sums)
+        if world_size > 1:
+            allreduce_dict_sum(decoder_class_losses)
+            allreduce_dict_sum(sample_element_counts)
+        return estimate, half_width, decoder_class_losses, sample_element_counts, rounds, decision
+
     # Save model with best val set loss thus far
     best_val_loss = float('inf')
-    save_best_only = True   # Set to False to always save model state, regardless of improvement
 
-    def save_checkpoint(state_obj, is_best, model_dir):
-        if not save_best_only:
+    # Besides best_*, optionally keep the last CHECKPOINT_KEEP_LAST validation-round checkpoints (0 = best only)
+    keep_last_checkpoints = int(os.environ.get("CHECKPOINT_KEEP_LAST", "0"))
+
+    # Checkpoints are serialized on a background thread; see cnn/checkpoint_writer.py
+    checkpoint_writer = AsyncCheckpointWriter()
+
+    # state_obj is the whole checkpoint or, with snapshot_path, the fields to update in a snapshot already on disk
+    # (which is then removed)
+    def save_checkpoint(state_obj, is_best, model_dir, snapshot_path=None):
+        def queue_save(path, **kwargs):
+            if snapshot_path is None:
+                return checkpoint_writer.save(state_obj, path, **kwargs)
+            return checkpoint_writer.save_from(snapshot_path, path, updates=state_obj, remove_src=True, **kwargs)
+
+        if keep_last_checkpoints > 0:
             if domain_adversarial:
-                ckpt_path = os.path.join(model_dir, "ckpt_cnn_domain_adversarial_fc_%s_act_%s_%s_ratio%s_md_%d.pth.tar" % (os.environ["DOMAIN_ADV_FC_DELIM"],
+                ckpt_path = os.path.join(model_dir, "ckpt_cnn_domain_adversarial_fc_%s_act_%s_%s_ratio%s_md_%d_%d.pth.tar" % (os.environ["DOMAIN_ADV_FC_DELIM"],
                                                                                                         domain_adv_activation,
                                                                                                         run_mode,
                                                                                                         str(noise_ratio),
-                                                                                                        state_obj["epoch"]))
+                                                                                                        state_obj["epoch"],
+                                                                                                        state_obj["iteration"]))
             elif gan:
-                ckpt_path = os.path.join(model_dir, "ckpt_cnn_gan_fc_%s_act_%s_%s_ratio%s_md_%d.pth.tar" % (os.environ["GAN_FC_DELIM"],
+                ckpt_path = os.path.join(model_dir, "ckpt_cnn_gan_fc_%s_act_%s_%s_ratio%s_md_%d_%d.pth.tar" % (os.environ["GAN_FC_DELIM"],
                                                                                                         gan_activation,
                                                                                                         run_mode,
                                                                                                         str(noise_ratio),
-                                                                                                        state_obj["epoch"]))
+                                                                                                        state_obj["epoch"],
+                                                                                                        state_obj["iteration"]))
             else:
-                ckpt_path = os.path.join(model_dir, "ckpt_cnn_%s_ratio%s_md_%d.pth.tar" % (run_mode, str(noise_ratio), state_obj["epoch"]))
-
-            torch.save(state_obj, ckpt_path)
-            if is_best:
-                shutil.copyfile(ckpt_path, best_ckpt_path)
-        else:
-            torch.save(state_obj, best_ckpt_path)
+                ckpt_path = os.path.join(model_dir, "ckpt_cnn_%s_ratio%s_md_%d_%d.pth.tar" % (run_mode,
+                                                                                          str(noise_ratio),
+                                                                                          state_obj["epoch"],
+                                                                                          state_obj["iteration"]))
+
+            queue_save(ckpt_path,
+                       copies=[best_ckpt_path] if is_best else [],
+                       rotate_group="last",
+                       keep_last=keep_last_checkpoints)
+        elif is_best:
+            queue_save(best_ckpt_path)
 
     # Regularize via patience-based early stopping
     max_patience = 5
     iterations_since_improvement = 0
 
-    setup_end_t = time.clock()
+    # Model and optimizer state for best_*/ckpt_* checkpoints (val losses are filled in once known)
+    def checkpoint_state(epoch, iteration):
+        state_obj = {
+            "epoch": epoch,
+            "iteration": iteration,
+            "state_dict": model.state_dict(),
+            "decoder_optimizers": {decoder_class: decoder_optimizers[decoder_class].state_dict() for decoder_class in decoder_classes},
+            "encoder_optimizer": encoder_optimizer.state_dict(),
+        }
+        if domain_adversarial:
+            state_obj["domain_adversary_optimizer"] = domain_adversary_optimizer.state_dict()
+        elif gan:
+            state_obj["gan_optimizers"] = {decoder_class: gan_optimizers[decoder_class].state_dict() for decoder_class in decoder_classes}
+        return state_obj
+
+    # Validate the model's current weights (full pass, or bounded estimate against best_loss)
+    def evaluate(epoch, iteration, best_loss):
+        start_t = time.perf_counter()
+        result = {"epoch": epoch, "iteration": iteration, "rounds": None, "decision": None}
+        if val_mode == "bounded":
+            val_loss, half_width, loss_dict, counts, rounds, decision = test_bounded(epoch, val_sample_loaders, best_loss)
+            result.update(rounds=rounds, decision=decision)
+        else:
+            loss_dict = test(epoch, val_loaders)
+            counts = val_element_counts
+            val_loss = total_loss(loss_dict, counts)
+            half_width = 0.0
+        result.update(val_loss=val_loss, half_width=half_width, loss_dict=loss_dict, counts=counts,
+                      seconds=time.perf_counter() - start_t)
+        return result
+
+    # Early stopping and best-checkpoint bookkeeping for one validation result, computed inline or by the evaluation
+    # worker; the weights it describes are state_obj, or the snapshot at snapshot_path. Returns True to stop.
+    def handle_val_result(result, state_obj=None, snapshot_path=None):
+        nonlocal best_val_loss, iterations_since_improvement
+        if result.get("error") is not None:
+            print("Evaluation of epoch %d, iteration %d failed:\n%s" % (result["request"]["epoch"],
+                                                                         result["request"]["iteration"],
+                                                                         result["error"]),
+                  flush=True)
+            raise RuntimeError("Evaluation worker failed")
+
+        print("\nEPOCH %d, ITER %d VALIDATION" % (result["epoch"],
+                                                  result["iteration"]),
+              flush=True)
+        print_loss_dict(result["loss_dict"], result["counts"])
+        val_loss = result["val_loss"]
+        if val_mode == "bounded":
+            print("Estimated val set loss: %.6f +/- %.6f after %d of %d utterances per class (%s, %.3fs)" % (val_loss,
+                                                                                                             result["half_width"],
+                                                                                                             result["rounds"],
+                                                                                                             val_sample_rounds,
+                                                                                                             result["decision"],
+                                                                                                             result["seconds"]),
+                  flush=True)
+        latency = None
+        if snapshot_path is not None:
+            latency = time.perf_counter() - result["request"]["submit_t"]
+            print("Evaluated in worker in %.3fs (%.3fs after the snapshot was taken)" % (result["seconds"], latency), flush=True)
+
+        is_best = (val_loss <= best_val_loss)
+        if is_best:
+            best_val_loss = val_loss
+            iterations_since_improvement = 0
+            print("\nNew best val set loss: %.6f" % best_val_loss, flush=True)
+        else:
+            iterations_since_improvement += 1
+            print("\nNo improvement in %d iterations (best val set loss: %.6f)" % (iterations_since_improvement, best_val_loss),
+                  flush=True)
+        metrics.emit("validation",
+                     epoch=result["epoch"],
+                     iteration=result["iteration"],
+                     seconds=result["seconds"],
+                     latency_seconds=latency,
+                     val_mode=val_mode,
+                     losses=normalized_losses(result["loss_dict"], result["counts"]),
+                     total_loss=val_loss,
+                     half_width=result["half_width"],
+                     best_val_loss=best_val_loss,
+                     is_best=is_best,
+                     iterations_since_improvement=iterations_since_improvement)
+        stop = not is_best and iterations_since_improvement >= max_patience
+
+        # Only rank 0 writes checkpoints (every rank holds the same weights)
+        if rank == 0 and not stop and (keep_last_checkpoints > 0 or is_best):
+            # Save a checkpoint for our model!
+            if snapshot_path is None:
+                state_obj.update(best_val_loss=best_val_loss, val_loss=val_loss)
+                with timer.time("checkpoint"):
+                    save_checkpoint(state_obj, is_best, model_dir)
+            else:
+                with timer.time("checkpoint"):
+                    save_checkpoint({"epoch": result["epoch"], "iteration": result["iteration"], "best_val_loss": best_val_loss, "val_loss": val_loss},
+                                    is_best,
+                                    model_dir,
+                                    snapshot_path=snapshot_path)
+            print("Queued checkpoint for model", flush=True)
+            return stop
+        elif rank == 0 and not stop:
+            print("Not saving checkpoint; no improvement made", flush=True)
+
+        if snapshot_path is not None:
+            os.remove(snapshot_path)
+        return stop
+
+    # Evaluation worker: the snapshot is written by the checkpoint writer and submitted once it's on disk
+    # Requests whose results haven't been handled yet, in submission order; saved with the resume checkpoint, so a
+    # preempted run evaluates those snapshots again instead of losing them
+    pending_evals = []
+
+    def submit_snapshot(state_obj, epoch, iteration):
+        snapshot_path = os.path.join(model_dir, "eval_%d_%d_%s" % (epoch, iteration, os.path.basename(best_ckpt_path)[len("best_"):]))
+        request = {
+            "path": snapshot_path,
+            "epoch": epoch,
+            "iteration": iteration,
+            "best_loss": best_val_loss,
+            "submit_t": time.perf_counter(),
+        }
+        pending_evals.append(request)
+        eval_worker.reserve()
+        future = checkpoint_writer.save(state_obj, snapshot_path)
+        future.add_done_callback(lambda future: eval_worker.submit(request))
+
+    # Snapshot written by a preempted run, already on disk
+    def resubmit_snapshot(request):
+        request = dict(request, submit_t=time.perf_counter())
+        pending_evals.append(request)
+        eval_worker.reserve()
+        eval_worker.submit(request)
+
+    def handle_worker_result(val_result):
+        pending_evals[:] = [request for request in pending_evals if request["path"] != val_result["request"]["path"]]
+        return handle_val_result(val_result, snapshot_path=val_result["request"]["path"])
+
+    # Runs once in the forked evaluation worker: validate on the CPU, with the worker's own model and loaders
+    def eval_worker_init():
+        nonlocal model, on_gpu, val_loaders, val_sample_loaders
+        model = eval_model
+        on_gpu = False
+        torch.set_num_threads(eval_threads)
+        val_loaders = {decoder_class: DataLoader(val_datasets[decoder_class], batch_size=batch_size, shuffle=False)
+                       for decoder_class in decoder_classes}
+        if val_mode == "bounded":
+            val_sample_loaders = {decoder_class: DataLoader(val_sample_loaders[decoder_class].dataset, batch_size=None, shuffle=False)
+                                  for decoder_class in decoder_classes}
+
+    def eval_worker_evaluate(request):
+        checkpoint = torch.load(request["path"], map_location=lambda storage,loc: storage)
+        model.load_state_dict(checkpoint["state_dict"])
+        return evaluate(request["epoch"], request["iteration"], request["best_loss"])
+
+    # Everything needed to continue a preempted run mid-epoch: model and optimizers, early stopping state,
+    # data loader position and RNG states. Rewritten after every validation round; removed once training finishes.
+    resume_training = os.environ.get("RESUME_TRAINING", "true") == "true"
+    resume_ckpt_path = os.path.join(model_dir, "resume_%s" % os.path.basename(best_ckpt_path)[len("best_"):])
+
+    def rng_states():
+        states = {
+            "torch": torch.get_rng_state(),
+            "numpy": np.random.get_state(),
+            "random": random.getstate(),
+        }
+        if on_gpu:
+            states["cuda"] = torch.cuda.get_rng_state_all()
+        return states
+
+    def set_rng_states(states):
+        torch.set_rng_state(states["torch"])
+        np.random.set_state(states["numpy"])
+        random.setstate(states["random"])
+        if on_gpu and "cuda" in states:
+            torch.cuda.set_rng_state_all(states["cuda"])
+
+    iterations_per_epoch = max(1, int(math.floor(total_train_batches / (steps_per_round * accum_steps))))
+    start_epoch = 1
+    start_iteration = 0
+    resume_rng_states = None
+    resume_pending_evals = []
+    if resume_training and os.path.exists(resume_ckpt_path):
+        print("Resuming from %s..." % resume_ckpt_path, flush=True)
+        checkpoint = torch.load(resume_ckpt_path, map_location=lambda storage,loc: storage)
+        model.load_state_dict(checkpoint["state_dict"])
+        encoder_optimizer.load_state_dict(checkpoint["encoder_optimizer"])
+        for decoder_class in decoder_classes:
+            decoder_optimizers[decoder_class].load_state_dict(checkpoint["decoder_optimizers"][decoder_class])
+        if domain_adversarial:
+            domain_adversary_optimizer.load_state_dict(checkpoint["domain_adversary_optimizer"])
+        elif gan:
+            for decoder_class in decoder_classes:
+                gan_optimizers[decoder_class].load_state_dict(checkpoint["gan_optimizers"][decoder_class])
+        best_val_loss = checkpoint["best_val_loss"]
+        iterations_since_improvement = checkpoint["iterations_since_improvement"]
+        optimizer_steps = checkpoint["optimizer_steps"]
+        resume_pending_evals = checkpoint.get("pending_evals", [])
+        resume_rng_states = checkpoint["rng_states"]
+        if isinstance(resume_rng_states, list):
+            # One entry per rank (data-parallel run)
+            if len(resume_rng_states) != world_size:
+                print("Resume checkpoint was written by %d ranks, not %d" % (len(resume_rng_states), world_size), flush=True)
+                sys.exit(1)
+            resume_rng_states = resume_rng_states[rank]
+
+        # Continue with the round after the saved one
+        start_epoch = checkpoint["epoch"]
+        start_iteration = checkpoint["iteration"] + 1
+        if start_iteration >= iterations_per_epoch:
+            start_epoch += 1
+            start_iteration = 0
+        else:
+            for decoder_class in decoder_classes:
+                samples_consumed[decoder_class] = checkpoint["samples_consumed"][decoder_class]
+        print("Resuming at epoch %d, iteration %d (best val set loss: %.6f)" % (start_epoch, start_iteration, best_val_loss),
+              flush=True)
+
+    setup_end_t = time.perf_counter()
     print("Completed setup in %.3f seconds" % (setup_end_t - run_start_t), flush=True)
 
+    metrics.emit("run_start",
+                 run_mode=run_mode,
+                 domain_adversarial=domain_adversarial,
+                 gan=gan,
+                 decoder_classes=decoder_classes,
+                 batch_size=batch_size,
+                 accum_steps=accum_steps,
+                 world_size=world_size,
+                 start_epoch=start_epoch,
+                 start_iteration=start_iteration,
+                 setup_seconds=setup_end_t - run_start_t)
+
+    # Forked only now, so the worker inherits the finished setup (and none of the loader iterators)
+    eval_worker = None
+    if use_eval_worker:
+        eval_worker = EvalWorker(eval_worker_init, eval_worker_evaluate, max_pending=eval_max_pending)
+        print("Started evaluation worker (pid %d)" % eval_worker.process.pid, flush=True)
+    # Snapshots the preempted run had queued for evaluation but not yet acted on
+    for request in resume_pending_evals:
+        if not os.path.exists(request["path"]):
+            print("Snapshot %s from the preempted run is missing; not evaluating it" % request["path"], flush=True)
+        elif eval_worker is None:
+            print("Evaluation worker is off; discarding snapshot %s from the preempted run" % request["path"], flush=True)
+            if rank == 0:
+                os.remove(request["path"])
+        else:
+            print("Re-evaluating snapshot of epoch %d, iteration %d from the preempted run" % (request["epoch"],
+                                                                                              request["iteration"]),
+                  flush=True)
+            resubmit_snapshot(request)
+
     # 1-indexed for pretty printing
     print("Starting training!", flush=True)
-    for epoch in range(1, epochs + 1):
+    epoch = min(start_epoch, epochs)
+    for epoch in range(start_epoch, epochs + 1):
         stopped = False
 
         print("\nSTARTING EPOCH %d" % epoch, flush=True)
-        train_start_t = time.clock()
+        train_start_t = time.perf_counter()
 
+        # Position each dataset at the start of this epoch, or where the preempted run left off
+        for decoder_class in decoder_classes:
+            training_datasets[decoder_class].set_epoch(epoch)
+            if epoch == start_epoch and start_iteration > 0:
+                training_datasets[decoder_class].fast_forward(samples_consumed[decoder_class])
+            else:
+                samples_consumed[decoder_class] = 0
         training_iterators = {decoder_class: iter(training_loaders[decoder_class]) for decoder_class in decoder_classes}
 
-        for iteration in range(max(1, int(math.floor(total_train_batches / val_batch_count)))):
-            train_loss_dict, elements_processed = train(epoch, iteration, training_iterators, batch_count=val_batch_count)
+        # Restore RNG states only now, as creating the iterators above draws from the torch RNG
+        if resume_rng_states is not None:
+            set_rng_states(resume_rng_states)
+            resume_rng_states = None
+
+        # Training throughput (validation excluded), for comparing runs with different numbers of ranks
+        epoch_train_time = 0.0
+        epoch_train_elements = 0
+
+        first_iteration = start_iteration if epoch == start_epoch else 0
+        for iteration in range(first_iteration, iterations_per_epoch):
+            iteration_start_t = time.perf_counter()
+            train_loss_dict, elements_processed = train(epoch, iteration, training_iterators, batch_count=steps_per_round)
+            epoch_train_time += time.perf_counter() - iteration_start_t
+            epoch_train_elements += sum(elements_processed.values())
             print_loss_dict(train_loss_dict, elements_processed)
-                
-            val_loss_dict = test(epoch, val_loaders)
-            print("\nEPOCH %d, ITER %d VALIDATION" % (epoch,
-                                                      iteration),
-                  flush=True)
-            print_loss_dict(val_loss_dict, val_element_counts)
-            val_loss = total_loss(val_loss_dict, val_element_counts)
-            
-            is_best = (val_loss <= best_val_loss)
-            if is_best:
-                best_val_loss = val_loss
-                iterations_since_improvement = 0
-                print("\nNew best val set loss: %.6f" % best_val_loss, flush=True)
-            else:
-                iterations_since_improvement += 1
-                print("\nNo improvement in %d iterations (best val set loss: %.6f)" % (iterations_since_improvement, best_val_loss),
-                      flush=True)
-                if iterations_since_improvement >= max_patience:
-                    print("STOPPING EARLY", flush=True)
-                    stopped = True
-                    break
-
-            if not save_best_only or (save_best_only and is_best):
-                # Save a checkpoint for our model!
-                state_obj = {
-                    "epoch": epoch,
-                    "state_dict": model.state_dict(),
-                    "best_val_loss": best_val_loss,
-                    "val_loss": val_loss,
-                    "decoder_optimizers": {decoder_class: decoder_optimizers[decoder_class].state_dict() for decoder_class in decoder_classes},
-                    "encoder_optimizer": encoder_optimizer.state_dict(),
-                }
-                if domain_adversarial:
-                    state_obj["domain_adversary_optimizer"] = domain_adversary_optimizer.state_dict()
-                elif gan:
-                    state_obj["gan_optimizers"] = {decoder_class: gan_optimizers[decoder_class].state_dict() for decoder_class in decoder_classes}
-
-                save_checkpoint(state_obj, is_best, model_dir)
-                print("Saved checkpoint for model", flush=True)
+
+            if world_size > 1:
+                broadcast_buffers(model)
+            state_obj = checkpoint_state(epoch, iteration)
+            if eval_worker is not None:
+                # Queue this round's snapshot and act on whichever earlier rounds have been evaluated by now
+                with timer.time("validation"):
+                    submit_snapshot(state_obj, epoch, iteration)
+                    val_results = eval_worker.poll_bounded()
+                for val_result in val_results:
+                    if handle_worker_result(val_result):
+                        stopped = True
             else:
-                print("Not saving checkpoint; no improvement made", flush=True)
+                with timer.time("validation"):
+                    val_result = evaluate(epoch, iteration, best_val_loss)
+                stopped = handle_val_result(val_result, state_obj=state_obj)
+            if stopped:
+                print("STOPPING EARLY", flush=True)
+                break
+
+            # Every rank has run the same number of full batches, so rank 0's samples_consumed holds for all of them
+            current_rng_states = rng_states()
+            if world_size > 1:
+                current_rng_states = all_gather_objects(current_rng_states, world_size)
+            if rank != 0:
+                continue
+
+            resume_obj = {
+                "epoch": epoch,
+                "iteration": iteration,
+                "state_dict": model.state_dict(),
+                "best_val_loss": best_val_loss,
+                "iterations_since_improvement": iterations_since_improvement,
+                "samples_consumed": dict(samples_consumed),
+                "optimizer_steps": optimizer_steps,
+                "rng_states": current_rng_states,
+                "pending_evals": [dict(request, submit_t=None) for request in pending_evals],
+                "decoder_optimizers": {decoder_class: decoder_optimizers[decoder_class].state_dict() for decoder_class in decoder_classes},
+                "encoder_optimizer": encoder_optimizer.state_dict(),
+            }
+            if domain_adversarial:
+                resume_obj["domain_adversary_optimizer"] = domain_adversary_optimizer.state_dict()
+            elif gan:
+                resume_obj["gan_optimizers"] = {decoder_class: gan_optimizers[decoder_class].state_dict() for decoder_class in decoder_classes}
+            with timer.time("checkpoint"):
+                checkpoint_writer.save(resume_obj, resume_ckpt_path)
         
-        train_end_t = time.clock()
+        train_end_t = time.perf_counter()
         print("\nEPOCH %d (%.3fs)" % (epoch,
                                       train_end_t - train_start_t),
               flush=True)
 
+        if world_size > 1:
+            epoch_train_elements = int(allreduce_scalar(epoch_train_elements))
+            epoch_train_time = allreduce_scalar(epoch_train_time, op=torch.distributed.ReduceOp.MAX)
+        if epoch_train_time > 0.0:
+            print("Training throughput: %.1f frames/s over %d rank(s) (%d frames in %.3fs)" % (epoch_train_elements / epoch_train_time,
+                                                                                               world_size,
+                                                                                               epoch_train_elements,
+                                                                                               epoch_train_time),
+                  flush=True)
+        # Only this process's lookups (loader workers count their own)
+        print_cache_stats(utt_cache)
+        metrics.emit("epoch_end",
+                     epoch=epoch,
+                     seconds=train_end_t - train_start_t,
+                     train_seconds=epoch_train_time,
+                     train_frames=epoch_train_elements,
+                     train_frames_per_sec=epoch_train_elements / epoch_train_time if epoch_train_time > 0.0 else 0.0,
+                     world_size=world_size,
+                     stopped=stopped,
+                     utt_cache=utt_cache.stats() if utt_cache is not None else None)
+
         if stopped:
             # Need to break out of outer loop as well
             break
 
+    # Results for snapshots still being evaluated can still change the best checkpoint
+    if eval_worker is not None:
+        print("Waiting for %d pending evaluation(s)..." % eval_worker.pending, flush=True)
+        for val_result in eval_worker.drain():
+            handle_worker_result(val_result)
+        eval_worker.close()
+
     # Once done, load best checkpoint and determine reconstruction loss alone
     print("Computing reconstruction loss...", flush=True)
 
+    # Make sure the best checkpoint is fully written before reading it back
+    with timer.time("checkpoint_flush"):
+        checkpoint_writer.close()
+    finish_timing(timer)
+
+    # Training is done; a rerun should start over rather than resume
+    if rank == 0 and os.path.exists(resume_ckpt_path):
+        os.remove(resume_ckpt_path)
+
+    # Other ranks read rank 0's best checkpoint
+    barrier(world_size)
+
     # Load checkpoint (potentially trained on GPU) into CPU memory (hence the map_location)
     checkpoint = torch.load(best_ckpt_path, map_location=lambda storage,loc: storage)
 
@@ -954,13 +1601,23 @@ def run_training(run_mode, domain_adversarial, gan):
     train_loss_dict = test(epoch, training_loaders, recon_only=True, noised=False)
     print("\nTRAINING SET", flush=True)
     print_loss_dict(train_loss_dict, train_element_counts)
+    metrics.emit("final_losses",
+                 split="train",
+                 losses=normalized_losses(train_loss_dict, train_element_counts),
+                 total_loss=total_loss(train_loss_dict, train_element_counts))
 
     val_loss_dict = test(epoch, val_loaders, recon_only=True, noised=False)
     print("\nDEV SET", flush=True)
     print_loss_dict(val_loss_dict, val_element_counts)
+    metrics.emit("final_losses",
+                 split="dev",
+                 losses=normalized_losses(val_loss_dict, val_element_counts),
+                 total_loss=total_loss(val_loss_dict, val_element_counts))
 
-    run_end_t = time.clock()
+    run_end_t = time.perf_counter()
     print("\nCompleted training run in %.3f seconds" % (run_end_t - run_start_t), flush=True)
+    metrics.emit("run_end", seconds=run_end_t - run_start_t)
+    metrics.close()
 
 
 
@@ -0,0 +1,43 @@
+import asyncio
+import os
+import sys
+
+import torch
+
+sys.path.append("./")
+sys.path.append("./cnn")
+from md_translate import load_multidecoder
+from translation_server import TranslationServer
+
+# Parse command line args
+if len(sys.argv) == 5:
+    run_mode = sys.argv[1]
+    domain_adversarial = True if sys.argv[2] == "true" else False
+    gan = True if sys.argv[3] == "true" else False
+    address = sys.argv[4]
+else:
+    print("Usage: python cnn/scripts/translate_server.py <run mode> <domain_adversarial true/false> <GAN true/false> <unix:/path/to/socket or host:port>", flush=True)
+    sys.exit(1)
+
+# Batching parameters; deadline is how long the oldest request may wait for others to join its batch
+max_batch_frames = int(os.environ.get("SERVER_MAX_BATCH_FRAMES", "8192"))
+max_latency_ms = float(os.environ.get("SERVER_MAX_LATENCY_MS", "10"))
+stats_interval = float(os.environ.get("SERVER_STATS_INTERVAL", "60"))
+
+on_gpu = torch.cuda.is_available()
+
+print("Loading checkpoint...", flush=True)
+model = load_multidecoder(run_mode, domain_adversarial=domain_adversarial, gan=gan, on_gpu=on_gpu)
+print("Loaded checkpoint; best model ready now.", flush=True)
+print("Batching up to %d frames, waiting at most %.1f ms" % (max_batch_frames, max_latency_ms), flush=True)
+
+server = TranslationServer(model,
+                           run_mode=run_mode,
+                           on_gpu=on_gpu,
+                           max_batch_frames=max_batch_frames,
+                           max_latency=max_latency_ms / 1000.0,
+                           stats_interval=stats_interval)
+try:
+    asyncio.run(server.serve_forever(address))
+except KeyboardInterrupt:
+    print("Shutting down translation server", flush=True)
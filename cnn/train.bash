@@ -66,6 +66,9 @@ if [ "$PROFILE_RUN" = true ] ; then
     python3 cnn/scripts/train_md.py ${run_mode} ${domain_adversarial} ${gan} profile > $train_log
     echo "Profiling done"
     # echo "Profiling done -- please run 'snakeviz --port=8890 --server $LOG_DIR/train_${run_mode}.prof' to view the results in browser"
+elif [ "${TRAIN_PROCS:-1}" -gt 1 ] ; then
+    echo "Data-parallel training with ${TRAIN_PROCS} processes"
+    python3 cnn/scripts/launch_md.py ${TRAIN_PROCS} ${run_mode} ${domain_adversarial} ${gan} > $train_log
 else
     python3 cnn/scripts/train_md.py ${run_mode} ${domain_adversarial} ${gan} > $train_log
 fi
@@ -0,0 +1,58 @@
+#!/bin/bash
+#SBATCH -p gpu
+#SBATCH -n1
+#SBATCH -N1-1
+#SBATCH -c 4
+#SBATCH --gres=gpu:1
+#SBATCH --mem=32768
+#SBATCH --time=72:00:00
+#SBATCH -J translate_server
+#SBATCH --exclude=sls-sm-[5]
+
+echo "STARTING MULTIDECODER TRANSLATION SERVER"
+
+. ./path.sh
+. ./cnn/job_config.sh
+
+echo "Setting up environment..."
+export LD_LIBRARY_PATH=/usr/local/cuda-8.0/lib64:/data/sls/u/meng/skanda/cuda/lib64:$LD_LIBRARY_PATH
+source activate $AUGMENT_ENV
+echo "Environment set up."
+
+if [ "$#" -lt 1 ]; then
+    echo "Run mode not specified; exiting"
+    exit 1
+fi
+
+run_mode=$1
+echo "Using run mode ${run_mode}"
+
+domain_adversarial=false
+gan=false
+if [ "$#" -ge 2 ]; then
+    if [ "$2" == "domain" ]; then
+        domain_adversarial=true
+        echo "Using domain_adversarial training"
+    fi
+    
+    if [ "$2" == "gan" ]; then
+        gan=true
+        echo "Using generative adversarial net (GAN) style training"
+    fi
+fi
+
+# Listen on a local Unix socket unless an address is given (e.g. 127.0.0.1:5555)
+address=unix:$MODEL_DIR/translate_${run_mode}.sock
+if [ "$#" -ge 3 ]; then
+    address=$3
+fi
+
+server_log=$LOG_DIR/translate_server_${run_mode}_ratio${NOISE_RATIO}.log
+if [ -f $server_log ]; then
+    # Move old log
+    mv $server_log $LOG_DIR/translate_server_${run_mode}_ratio${NOISE_RATIO}-$(date +"%F_%T%z").log
+fi
+
+python3 cnn/scripts/translate_server.py ${run_mode} ${domain_adversarial} ${gan} ${address} > $server_log
+
+echo "DONE MULTIDECODER TRANSLATION SERVER"
@@ -0,0 +1,280 @@
+import asyncio
+import json
+import os
+import socket
+import struct
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from md_translate import translate_utterances
+
+# Wire format (both directions): 4-byte big-endian header length, JSON header, then optional payload
+# Feature payloads are row-major float32 matrices with shape given by "rows"/"cols" in the header
+HEADER_LEN = struct.Struct(">I")
+
+
+
+# PROTOCOL HELPERS
+
+
+
+def encode_message(header, mat=None):
+    payload = b""
+    if mat is not None:
+        mat = np.ascontiguousarray(mat, dtype=np.float32)
+        header = dict(header, rows=mat.shape[0], cols=mat.shape[1])
+        payload = mat.tobytes()
+    header_bytes = json.dumps(header).encode("utf-8")
+    return HEADER_LEN.pack(len(header_bytes)) + header_bytes + payload
+
+def payload_size(header):
+    if "rows" in header and "cols" in header:
+        return header["rows"] * header["cols"] * 4
+    return 0
+
+def decode_payload(header, payload):
+    if "rows" not in header or "cols" not in header:
+        return None
+    return np.frombuffer(payload, dtype=np.float32).reshape((header["rows"], header["cols"]))
+
+async def read_message(reader):
+    header_len, = HEADER_LEN.unpack(await reader.readexactly(HEADER_LEN.size))
+    header = json.loads((await reader.readexactly(header_len)).decode("utf-8"))
+    payload = await reader.readexactly(payload_size(header))
+    return header, decode_payload(header, payload)
+
+# Address is either "unix:<socket path>" or "<host>:<port>"
+def parse_address(address):
+    if address.startswith("unix:"):
+        return ("unix", address[len("unix:"):])
+    host, port = address.rsplit(":", 1)
+    return ("tcp", (host, int(port)))
+
+
+
+# SERVER
+
+
+
+# Tracks queue depth, batch sizes and request latencies for the stats endpoint
+class ServerStats(object):
+    def __init__(self, latency_window=10000):
+        self.requests = 0
+        self.frames = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self.batch_utt_histogram = Counter()    # Keyed by power-of-two bucket of utterances per batch
+        self.latencies = deque(maxlen=latency_window)
+
+    def record_batch(self, num_utts, num_frames, queue_depth):
+        self.batches += 1
+        self.requests += num_utts
+        self.frames += num_frames
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+        bucket = 1
+        while bucket < num_utts:
+            bucket *= 2
+        self.batch_utt_histogram[bucket] += 1
+
+    def record_latency(self, latency):
+        self.latencies.append(latency)
+
+    def summary(self, queue_depth):
+        if len(self.latencies) > 0:
+            p50, p99 = np.percentile(np.asarray(self.latencies), [50, 99])
+        else:
+            p50, p99 = 0.0, 0.0
+        return {
+            "requests": self.requests,
+            "frames": self.frames,
+            "batches": self.batches,
+            "mean_utts_per_batch": float(self.requests) / max(self.batches, 1),
+            "queue_depth": queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "batch_utt_histogram": {str(k): v for k, v in sorted(self.batch_utt_histogram.items())},
+            "latency_p50_ms": 1000.0 * float(p50),
+            "latency_p99_ms": 1000.0 * float(p99),
+        }
+
+# Hosts one loaded multidecoder and coalesces concurrent (utterance, target class) requests into batches
+# A batch is dispatched once it holds max_batch_frames frames or its oldest request has waited max_latency seconds
+class TranslationServer(object):
+    def __init__(self, model, run_mode="ae", on_gpu=False, max_batch_frames=8192, max_latency=0.01, stats_interval=60.0):
+        self.model = model
+        self.run_mode = run_mode
+        self.on_gpu = on_gpu
+        self.max_batch_frames = max_batch_frames
+        self.max_latency = max_latency
+        self.stats_interval = stats_interval
+
+        self.stats = ServerStats()
+        self.queue = None
+        self.server = None
+
+        # Single worker so that the model only ever runs one batch at a time
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def start(self, address):
+        self.queue = asyncio.Queue()
+        kind, location = parse_address(address)
+        if kind == "unix":
+            if os.path.exists(location):
+                os.remove(location)
+            self.server = await asyncio.start_unix_server(self.handle_client, path=location)
+        else:
+            self.server = await asyncio.start_server(self.handle_client, host=location[0], port=location[1])
+        self.batcher_task = asyncio.ensure_future(self.run_batcher())
+        if self.stats_interval > 0:
+            self.stats_task = asyncio.ensure_future(self.print_stats())
+        print("Translation server listening on %s" % address, flush=True)
+
+    async def serve_forever(self, address):
+        await self.start(address)
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    header, feats = await read_message(reader)
+                except asyncio.IncompleteReadError:
+                    # Client hung up
+                    break
+
+                op = header.get("op", "translate")
+                if op == "translate":
+                    error = self.check_translate_request(header, feats)
+                    if error is not None:
+                        response = encode_message({"status": "error", "error": error})
+                    else:
+                        future = asyncio.get_event_loop().create_future()
+                        await self.queue.put((time.perf_counter(), header["target_class"], feats, future))
+                        try:
+                            decoded_feats = await future
+                            response = encode_message({"status": "ok"}, decoded_feats)
+                        except Exception as e:
+                            response = encode_message({"status": "error", "error": "translation failed: %s" % repr(e)})
+                elif op == "stats":
+                    response = encode_message(dict(self.stats.summary(self.queue.qsize()), status="ok"))
+                else:
+                    response = encode_message({"status": "error", "error": "unknown op %s" % op})
+
+                writer.write(response)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    # Reject malformed requests here, before they can reach (and stop) the batcher; returns an error or None
+    def check_translate_request(self, header, feats):
+        if header.get("target_class") not in self.model.decoder_classes:
+            return "unknown target class %s" % header.get("target_class")
+        if feats is None:
+            return "translate request without a feature matrix (rows/cols)"
+        if feats.shape[1] != self.model.freq_dim:
+            return "expected %d feature columns, got %d" % (self.model.freq_dim, feats.shape[1])
+        if feats.shape[0] == 0:
+            return "empty utterance"
+        return None
+
+    async def run_batcher(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            # Block until at least one request is waiting, then gather more until full or out of time
+            pending = [await self.queue.get()]
+            num_frames = len(pending[0][2])
+            deadline = pending[0][0] + self.max_latency
+            while num_frames < self.max_batch_frames:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(request)
+                num_frames += len(request[2])
+            self.stats.record_batch(len(pending), num_frames, self.queue.qsize() + len(pending))
+
+            # One forward pass per target class present in the batch
+            by_class = dict()
+            for request in pending:
+                by_class.setdefault(request[1], []).append(request)
+            for target_class, requests in by_class.items():
+                try:
+                    decoded_utts = await loop.run_in_executor(self.executor,
+                                                              translate_utterances,
+                                                              self.model,
+                                                              [request[2] for request in requests],
+                                                              target_class,
+                                                              self.run_mode,
+                                                              self.on_gpu,
+                                                              self.max_batch_frames)
+                except Exception as e:
+                    for request in requests:
+                        if not request[3].done():
+                            request[3].set_exception(e)
+                    continue
+
+                done_t = time.perf_counter()
+                for request, decoded_feats in zip(requests, decoded_utts):
+                    self.stats.record_latency(done_t - request[0])
+                    # The client may have disconnected (cancelling its future) while the batch ran
+                    if not request[3].done():
+                        request[3].set_result(decoded_feats)
+
+    async def print_stats(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            print("Server stats: %s" % json.dumps(self.stats.summary(self.queue.qsize())), flush=True)
+
+
+
+# CLIENT
+
+
+
+# Blocking client, for use from training scripts, notebooks etc.
+class TranslationClient(object):
+    def __init__(self, address):
+        kind, location = parse_address(address)
+        if kind == "unix":
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.connect(location)
+
+    def close(self):
+        self.sock.close()
+
+    def recv_exactly(self, num_bytes):
+        chunks = []
+        while num_bytes > 0:
+            chunk = self.sock.recv(num_bytes)
+            if len(chunk) == 0:
+                raise RuntimeError("Translation server closed connection")
+            chunks.append(chunk)
+            num_bytes -= len(chunk)
+        return b"".join(chunks)
+
+    def request(self, header, mat=None):
+        self.sock.sendall(encode_message(header, mat))
+        header_len, = HEADER_LEN.unpack(self.recv_exactly(HEADER_LEN.size))
+        header = json.loads(self.recv_exactly(header_len).decode("utf-8"))
+        payload = self.recv_exactly(payload_size(header))
+        if header["status"] != "ok":
+            raise RuntimeError("Translation server error: %s" % header["error"])
+        return header, decode_payload(header, payload)
+
+    # Translate a (T, freq_dim) utterance into the domain of target_class
+    def translate(self, feats, target_class):
+        header, decoded_feats = self.request({"op": "translate", "target_class": target_class}, feats)
+        return decoded_feats
+
+    def stats(self):
+        header, payload = self.request({"op": "stats"})
+        return header
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import shutil
+import string
+import subprocess
+import time
+
+# Content-addressed cache for pipeline stage outputs (see utils/pipeline.py)
+# A stage's key is the SHA-256 of its command line, the contents of its config scripts, the config variables it
+# depends on (CNN_NAME, NOISE_RATIO, ARCH_NAME, ...) and the contents of its input files -- including every ARK an
+# input SCP points into, and model checkpoints. After a successful run, outputs are moved to <cache root>/<key>/,
+# made read-only and replaced by symlinks; on a later run with the same key the symlinks are recreated instead of
+# running the stage.
+# File digests are memoized by (size, mtime), so unchanged multi-GB ARKs are only hashed once.
+
+hash_chunk_size = 1 << 24
+
+
+
+# FINGERPRINTS
+
+
+
+class DigestMemo(object):
+    def __init__(self, memo_path):
+        self.memo_path = memo_path
+        self.memo = dict()
+        if os.path.exists(memo_path):
+            with open(memo_path, 'r') as memo_fd:
+                self.memo = json.load(memo_fd)
+        self.dirty = False
+
+    def file_digest(self, path):
+        real_path = os.path.realpath(path)
+        stat = os.stat(real_path)
+        memo_entry = self.memo.get(real_path)
+        if memo_entry is not None and memo_entry[0] == stat.st_size and memo_entry[1] == stat.st_mtime_ns:
+            return memo_entry[2]
+
+        sha = hashlib.sha256()
+        with open(real_path, 'rb') as file_fd:
+            chunk = file_fd.read(hash_chunk_size)
+            while len(chunk) > 0:
+                sha.update(chunk)
+                chunk = file_fd.read(hash_chunk_size)
+        digest = sha.hexdigest()
+        self.memo[real_path] = [stat.st_size, stat.st_mtime_ns, digest]
+        self.dirty = True
+        return digest
+
+    # SCP digest covers the SCP itself and every ARK it references
+    def scp_digest(self, scp_path):
+        ark_paths = set()
+        with open(scp_path, 'r') as scp_fd:
+            for scp_line in scp_fd:
+                fields = scp_line.split()
+                if len(fields) == 2:
+                    ark_paths.add(fields[1].rsplit(':', 1)[0])
+        sha = hashlib.sha256(self.file_digest(scp_path).encode("utf-8"))
+        for ark_path in sorted(ark_paths):
+            sha.update(("%s %s\n" % (ark_path, self.file_digest(ark_path))).encode("utf-8"))
+        return sha.hexdigest()
+
+    def digest(self, path):
+        if os.path.isdir(path):
+            sha = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    file_path = os.path.join(root, filename)
+                    sha.update(("%s %s\n" % (os.path.relpath(file_path, path), self.digest(file_path))).encode("utf-8"))
+            return sha.hexdigest()
+        if path.endswith(".scp"):
+            return self.scp_digest(path)
+        return self.file_digest(path)
+
+    def save(self):
+        if not self.dirty:
+            return
+        with open(self.memo_path + ".tmp", 'w') as memo_fd:
+            json.dump(self.memo, memo_fd)
+        os.replace(self.memo_path + ".tmp", self.memo_path)
+        self.dirty = False
+
+# Environment after sourcing path.sh and the given config scripts, as the stage's own bash script would see it
+# (extra_env: variables the runner passes to the stage on top of its own environment)
+def config_env(repo_root, config_scripts, extra_env=None):
+    command = ". ./path.sh > /dev/null 2>&1; "
+    for config_script in config_scripts:
+        command += ". %s > /dev/null 2>&1; " % config_script
+    command += "env -0"
+    result = subprocess.run(["bash", "-c", command], cwd=repo_root, stdout=subprocess.PIPE, check=True,
+                            env=dict(os.environ, **(extra_env or {})))
+    env = dict()
+    for entry in result.stdout.split(b"\0"):
+        if b"=" in entry:
+            key, value = entry.decode("utf-8", errors="replace").split("=", 1)
+            env[key] = value
+    return env
+
+
+
+# CACHE
+
+
+
+# What a stage depends on and produces; paths may use ${VAR} from the stage's config environment,
+# or be functions of that environment (returning None for an input the stage doesn't need with this config)
+class CacheSpec(object):
+    def __init__(self, config_scripts, inputs, outputs, env_keys=()):
+        self.config_scripts = list(config_scripts)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.env_keys = list(env_keys)
+
+    def resolve(self, env):
+        inputs = [resolve_path(path, env) for path in self.inputs]
+        outputs = [resolve_path(path, env) for path in self.outputs]
+        return [path for path in inputs if path is not None], outputs
+
+def resolve_path(path, env):
+    if callable(path):
+        return path(env)
+    return string.Template(path).substitute(env)
+
+# Cached entries are shared by every run that restores them, so nothing may write through the symlinks
+def set_writable(path, writable):
+    entry_paths = [path]
+    if os.path.isdir(path) and not os.path.islink(path):
+        for root, dirs, files in os.walk(path):
+            entry_paths.extend(os.path.join(root, name) for name in dirs + files)
+    for entry_path in entry_paths:
+        if os.path.islink(entry_path):
+            continue
+        mode = os.stat(entry_path).st_mode
+        os.chmod(entry_path, (mode | 0o200) if writable else (mode & ~0o222))
+
+class ArtifactCache(object):
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.digests = DigestMemo(os.path.join(root, "digests.json"))
+
+    # config_scripts are hashed by content, so e.g. a changed step size schedule in a sourced config
+    # invalidates the stage even if none of env_keys changed
+    def key(self, stage_name, argv, env, inputs, env_keys, config_scripts=()):
+        fingerprint = {
+            "stage": stage_name,
+            "argv": [os.path.basename(arg) if os.path.isabs(arg) else arg for arg in argv],
+            "config": [[os.path.basename(path), self.digests.file_digest(path)] for path in config_scripts],
+            "env": {env_key: env.get(env_key) for env_key in env_keys},
+            "inputs": [[path, self.digests.digest(path)] for path in inputs],
+        }
+        self.digests.save()
+        return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def cached_path(self, key, idx, output_path):
+        return os.path.join(self.entry_dir(key), "%d_%s" % (idx, os.path.basename(output_path.rstrip(os.sep))))
+
+    def has(self, key):
+        return os.path.exists(os.path.join(self.entry_dir(key), "COMPLETE"))
+
+    # Point each output path at its cached copy
+    def restore(self, key, outputs):
+        for idx, output_path in enumerate(outputs):
+            cached_path = self.cached_path(key, idx, output_path)
+            if os.path.islink(output_path):
+                os.remove(output_path)
+            elif os.path.exists(output_path):
+                # Keep whatever was there (e.g. a half-finished earlier run) out of the way rather than deleting it
+                os.rename(output_path, "%s.uncached-%s" % (output_path, time.strftime("%Y%m%d-%H%M%S")))
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+            os.symlink(cached_path, output_path)
+
+    # Before re-running a stage, turn outputs that are symlinks into the cache back into private copies,
+    # so the stage can build on them (e.g. resume from param-$((epoch-1))) without modifying cached entries
+    def detach(self, outputs):
+        cache_root = os.path.realpath(self.root) + os.sep
+        for output_path in outputs:
+            if not os.path.islink(output_path):
+                continue
+            target = os.path.realpath(output_path)
+            if not target.startswith(cache_root):
+                continue
+            os.remove(output_path)
+            if os.path.isdir(target):
+                shutil.copytree(target, output_path, symlinks=True)
+            elif os.path.exists(target):
+                shutil.copy2(target, output_path)
+            if os.path.exists(output_path):
+                set_writable(output_path, True)
+
+    # Move freshly produced outputs into the cache and leave symlinks behind
+    def store(self, key, outputs, metadata=None):
+        entry_dir = self.entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        for idx, output_path in enumerate(outputs):
+            if not os.path.exists(output_path):
+                raise RuntimeError("Stage output %s does not exist; not caching" % output_path)
+            cached_path = self.cached_path(key, idx, output_path)
+            if os.path.islink(output_path) and os.path.realpath(output_path) == os.path.realpath(cached_path):
+                continue
+            if os.path.lexists(cached_path):
+                if os.path.isdir(cached_path) and not os.path.islink(cached_path):
+                    set_writable(cached_path, True)
+                    shutil.rmtree(cached_path)
+                else:
+                    os.remove(cached_path)
+            shutil.move(output_path, cached_path)
+            set_writable(cached_path, False)
+            os.symlink(cached_path, output_path)
+
+        with open(os.path.join(entry_dir, "COMPLETE"), 'w') as complete_fd:
+            json.dump(dict(metadata or {}, outputs=outputs, stored=time.strftime("%F %T")), complete_fd, indent=2)
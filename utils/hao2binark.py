@@ -0,0 +1,86 @@
+#!/data/sls/r/u/atitus5/scratch/anaconda3/bin/python3
+
+import sys
+
+import numpy as np
+
+sys.path.append("./")
+sys.path.append(sys.path[0] + "/..")
+from utils.hao_data import write_kaldi_binary_mat
+
+# Streaming Hao-format -> Kaldi binary ARK converter (binary counterpart of batch2ark.py)
+# Reads "utt_id" / rows of floats / "." blocks from stdin and writes binary float matrices to stdout,
+# so e.g. latgen-faster-mapped can read "ark:-" without parsing text again
+
+# Override default pipe handling so that Python doesn't start writing to closed pipe
+# and cause a BrokenPipeError
+# See https://github.com/python/mypy/issues/2893 for explanation
+import signal
+signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+read_size = 1 << 22     # Bytes read from stdin at a time
+flush_size = 1 << 22    # Bytes buffered before writing to stdout
+
+class BufferedArkWriter(object):
+    def __init__(self, out_fd):
+        self.out_fd = out_fd
+        self.chunks = []
+        self.buffered = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.buffered += len(data)
+        if self.buffered >= flush_size:
+            self.flush()
+
+    def flush(self):
+        self.out_fd.write(b"".join(self.chunks))
+        self.out_fd.flush()
+        self.chunks = []
+        self.buffered = 0
+
+def parse_body(body):
+    num_rows = body.count(b"\n")
+    if num_rows == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    values = np.fromstring(body.decode("ascii"), dtype=np.float32, sep=' ')
+    return values.reshape((num_rows, -1))
+
+writer = BufferedArkWriter(sys.stdout.buffer)
+stdin = sys.stdin.buffer
+buf = bytearray()
+scan_from = 0   # Where the search for the current utterance's "\n.\n" terminator resumes (only new data is scanned)
+eof = False
+while not eof:
+    chunk = stdin.read(read_size)
+    if len(chunk) == 0:
+        eof = True
+        if len(buf) > 0 and not buf.endswith(b"\n"):
+            buf += b"\n"
+    buf += chunk
+
+    # Emit every complete utterance in the buffer; keep the incomplete tail for the next read
+    pos = 0
+    while True:
+        header_end = buf.find(b"\n", pos)
+        if header_end < 0:
+            break
+        if buf.startswith(b".\n", header_end + 1):
+            body_start = body_end = header_end + 1
+        else:
+            body_start = header_end + 1
+            body_end = buf.find(b"\n.\n", max(header_end, scan_from))
+            if body_end < 0:
+                # Back up 2 bytes, in case the terminator is split across reads
+                scan_from = max(header_end, len(buf) - 2)
+                break
+            body_end += 1
+
+        utt_id = buf[pos:header_end].decode("utf-8").strip()
+        write_kaldi_binary_mat(writer, utt_id, parse_body(buf[body_start:body_end]))
+        pos = body_end + 2
+        scan_from = 0
+    del buf[:pos]
+    scan_from = max(0, scan_from - pos)
+
+writer.flush()
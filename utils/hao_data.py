@@ -1,11 +1,12 @@
 import bisect
+import mmap
 import os
 import struct
 
 import numpy as np
 
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 
 def read_next_utt(scp_line, hao_ark_fd=None):
     # From https://github.com/yajiemiao/pdnn/blob/master/io_func/kaldi_feat.py
@@ -14,8 +15,13 @@ def read_next_utt(scp_line, hao_ark_fd=None):
     utt_id, path_pos = scp_line.replace('\n','').split(' ')
     path, pos = path_pos.split(':')
 
+    # Native Kaldi binary archives (copy-feats output etc.) are read straight from the mapped file
+    if is_kaldi_binary(path, int(pos)):
+        return utt_id, read_kaldi_binary_mat_at(path, int(pos)), hao_ark_fd
+
     if hao_ark_fd is not None:
-        if hao_ark_fd.name != path.split(os.sep)[-1]:
+        # Descriptors are opened with the SCP's path, so compare against it in full
+        if hao_ark_fd.name != path:
             # New hao_ark file now -- close and get new descriptor
             hao_ark_fd.close()
             hao_ark_fd = open(path, 'r')
@@ -23,7 +29,8 @@ def read_next_utt(scp_line, hao_ark_fd=None):
         hao_ark_fd = open(path, 'r')
     hao_ark_fd.seek(int(pos),0)
 
-    utt_id = hao_ark_fd.readline().rstrip('\n')
+    # Skip utterance ID in ARK; the SCP's ID takes precedence (it may be remapped by a view)
+    hao_ark_fd.readline()
 
     tmp_mat = []
     current_line = hao_ark_fd.readline().rstrip('\n')
@@ -34,6 +41,38 @@ def read_next_utt(scp_line, hao_ark_fd=None):
 
     return utt_id, utt_mat, hao_ark_fd
 
+# os.stat() results by ARK path, taken once per process
+ark_identities = dict()
+
+# Key for the utterance at byte offset pos of an ARK: its resolved path plus the file's identity (inode, size,
+# modification time), so a regenerated ARK at the same path -- e.g. a rerun of augment_md.py, while a shared arena
+# from the previous run is still around -- never serves stale matrices. An ARK is assumed not to change while a process reads it.
+def utt_cache_key(path, pos):
+    identity = ark_identities.get(path)
+    if identity is None:
+        real_path = os.path.realpath(path)
+        stat = os.stat(real_path)
+        identity = "%s:%d:%d:%d" % (real_path, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        ark_identities[path] = identity
+    return "%s:%s" % (identity, pos)
+
+# read_next_utt() through an utterance cache from utils/utt_cache.py (None = no cache), keyed by ARK file and offset
+# Cached matrices are read-only; mapped Kaldi binary matrices are returned as-is, since the page cache already
+# shares them without any parsing
+def read_next_utt_cached(scp_line, cache, hao_ark_fd=None):
+    if cache is None:
+        return read_next_utt(scp_line, hao_ark_fd=hao_ark_fd)
+
+    utt_id, path_pos = scp_line.replace('\n','').split(' ')
+    path, pos = path_pos.split(':')
+    key = utt_cache_key(path, pos)
+    feat_mat = cache.get(key)
+    if feat_mat is None:
+        utt_id, feat_mat, hao_ark_fd = read_next_utt(scp_line, hao_ark_fd=hao_ark_fd)
+        if feat_mat.flags.writeable:
+            feat_mat = cache.put(key, feat_mat)
+    return utt_id, feat_mat, hao_ark_fd
+
 def write_kaldi_hao_ark(hao_ark_fd, utt_id, arr):
     # From https://github.com/yajiemiao/pdnn/blob/master/io_func/kaldi_feat.py
     mat = np.asarray(arr, dtype=np.float32, order='C')
@@ -58,10 +97,202 @@ def write_kaldi_hao_scp(hao_scp_fd, hao_ark_filepath):
             last_line = line
             last_pos += len(str.encode(line))   # Python 3 tell() doesn't work in text mode...
 
+# KALDI BINARY ARCHIVES
+# Kaldi binary matrix: "<utt_id> \0B<token> <header><data>"; Kaldi SCPs point just past "<utt_id> ", at the "\0B"
+# FM/DM: rows and cols (each a size byte + little-endian int32), then float32/float64 data
+# CM/CM2/CM3 (compressed): min value, range (float32), rows, cols (int32), then quantized data
+KALDI_HEADER_SIZES = {"FM": 10, "DM": 10, "CM": 16, "CM2": 16, "CM3": 16}
+
+# Returns (rows, cols, data size in bytes) for the header at header_offset in buf
+def kaldi_mat_shape(mat_type, buf, header_offset):
+    if mat_type == "FM" or mat_type == "DM":
+        size_rows, rows, size_cols, cols = struct.unpack_from('<bibi', buf, header_offset)
+        return rows, cols, rows * cols * (4 if mat_type == "FM" else 8)
+
+    min_value, value_range, rows, cols = struct.unpack_from('<ffii', buf, header_offset)
+    if mat_type == "CM":
+        # Four uint16 percentiles per column, then one byte per element
+        return rows, cols, cols * 8 + rows * cols
+    elif mat_type == "CM2":
+        return rows, cols, rows * cols * 2
+    else:
+        return rows, cols, rows * cols
+
+# FM matrices are returned as read-only views of buf (no copy); everything else is decoded into a new float32 array
+def decode_kaldi_mat(mat_type, buf, header_offset):
+    rows, cols, data_size = kaldi_mat_shape(mat_type, buf, header_offset)
+    data_offset = header_offset + KALDI_HEADER_SIZES[mat_type]
+    if mat_type == "FM":
+        return np.frombuffer(buf, dtype='<f4', count=rows * cols, offset=data_offset).reshape((rows, cols))
+    elif mat_type == "DM":
+        return np.frombuffer(buf, dtype='<f8', count=rows * cols, offset=data_offset).reshape((rows, cols)).astype(np.float32)
+
+    min_value, value_range = struct.unpack_from('<ff', buf, header_offset)
+    if mat_type == "CM2":
+        data = np.frombuffer(buf, dtype='<u2', count=rows * cols, offset=data_offset).reshape((rows, cols))
+        return (min_value + data.astype(np.float32) * (value_range / 65535.0)).astype(np.float32)
+    elif mat_type == "CM3":
+        data = np.frombuffer(buf, dtype=np.uint8, count=rows * cols, offset=data_offset).reshape((rows, cols))
+        return (min_value + data.astype(np.float32) * (value_range / 255.0)).astype(np.float32)
+
+    # CM: per-column piecewise-linear quantization between the 0/25/75/100th percentiles; data stored column-major
+    percentiles = np.frombuffer(buf, dtype='<u2', count=cols * 4, offset=data_offset).reshape((cols, 4))
+    percentiles = min_value + percentiles.astype(np.float32) * (value_range / 65535.0)
+    data = np.frombuffer(buf, dtype=np.uint8, count=rows * cols, offset=data_offset + cols * 8).reshape((cols, rows))
+    data = data.astype(np.float32)
+    p0, p25, p75, p100 = [percentiles[:, i:i + 1] for i in range(4)]
+    mat = np.where(data <= 64,
+                   p0 + (p25 - p0) * data / 64.0,
+                   np.where(data <= 192,
+                            p25 + (p75 - p25) * (data - 64.0) / 128.0,
+                            p75 + (p100 - p75) * (data - 192.0) / 63.0))
+    return np.ascontiguousarray(mat.T, dtype=np.float32)
+
+# Parse the matrix starting at pos ("\0B...") in an in-memory buffer (bytes or mmap)
+def read_kaldi_binary_mat_from_buffer(buf, pos):
+    if buf[pos:pos + 2] != b"\0B":
+        raise RuntimeError("Expected binary Kaldi matrix (\\0B header) at offset %d" % pos)
+    token_end = buf.find(b" ", pos + 2)
+    mat_type = bytes(buf[pos + 2:token_end]).decode("ascii")
+    if mat_type not in KALDI_HEADER_SIZES:
+        raise RuntimeError("Unsupported Kaldi matrix type %s at offset %d" % (mat_type, pos))
+    return decode_kaldi_mat(mat_type, buf, token_end + 1)
+
+def write_kaldi_binary_mat(ark_fd, utt_id, arr):
+    mat = np.asarray(arr, dtype='<f4', order='C')
+    rows, cols = mat.shape
+
+    ark_fd.write(utt_id.encode("utf-8") + b" \0BFM " + struct.pack('<bibi', 4, rows, 4, cols))
+    ark_fd.write(mat.tobytes())
+
+# Writes the matrix to a binary ARK opened with 'wb' and its "utt_id path:offset" line to the SCP, as copy-feats would
+def write_kaldi_binary_utt(ark_fd, scp_fd, ark_path, utt_id, arr):
+    mat_pos = ark_fd.tell() + len(utt_id.encode("utf-8")) + 1
+    write_kaldi_binary_mat(ark_fd, utt_id, arr)
+    scp_fd.write("%s %s:%d\n" % (utt_id, ark_path, mat_pos))
+
+# Reads every matrix (FM, DM or compressed) from a binary ARK file object, in order
+def read_kaldi_binary_ark(ark_fd):
+    while True:
+        utt_id = b""
+        c = ark_fd.read(1)
+        while c != b" " and c != b"":
+            utt_id += c
+            c = ark_fd.read(1)
+        if c == b"":
+            return
+        mat = read_kaldi_binary_mat(ark_fd)
+        yield utt_id.decode("utf-8").strip(), mat
+
+def read_kaldi_binary_mat(ark_fd):
+    pos = ark_fd.tell()
+    mat_bytes = ark_fd.read(2)
+    c = ark_fd.read(1)
+    while c != b" " and c != b"":
+        mat_bytes += c
+        c = ark_fd.read(1)
+    mat_bytes += c
+    mat_type = mat_bytes[2:-1].decode("ascii")
+    if mat_bytes[:2] != b"\0B" or mat_type not in KALDI_HEADER_SIZES:
+        raise RuntimeError("Expected binary Kaldi matrix at offset %d" % pos)
+
+    header = ark_fd.read(KALDI_HEADER_SIZES[mat_type])
+    rows, cols, data_size = kaldi_mat_shape(mat_type, header, 0)
+    mat = read_kaldi_binary_mat_from_buffer(mat_bytes + header + ark_fd.read(data_size), 0)
+    return mat.astype(np.float32)
+
+# Binary ARKs are memory-mapped once per process, so reads are slices of the page cache
+kaldi_ark_mmaps = dict()
+
+def kaldi_ark_mmap(path):
+    if path not in kaldi_ark_mmaps:
+        with open(path, 'rb') as ark_fd:
+            kaldi_ark_mmaps[path] = mmap.mmap(ark_fd.fileno(), 0, access=mmap.ACCESS_READ)
+    return kaldi_ark_mmaps[path]
+
+# Kaldi SCP offsets point at the "\0B" binary marker; Hao SCP offsets point at a text utterance ID line
+# (An ARK file is never a mix of both, so the answer is cached per file)
+kaldi_ark_paths = dict()
+
+def is_kaldi_binary(path, pos):
+    if path not in kaldi_ark_paths:
+        with open(path, 'rb') as ark_fd:
+            ark_fd.seek(pos, 0)
+            kaldi_ark_paths[path] = (ark_fd.read(2) == b"\0B")
+    return kaldi_ark_paths[path]
+
+# Zero-copy for uncompressed float matrices: the result is a read-only view of the mapped ARK
+def read_kaldi_binary_mat_at(path, pos):
+    return read_kaldi_binary_mat_from_buffer(kaldi_ark_mmap(path), pos)
+
+# Number of frames, from the matrix header alone
+def kaldi_binary_num_rows(path, pos):
+    buf = kaldi_ark_mmap(path)
+    token_end = buf.find(b" ", pos + 2)
+    rows, cols, data_size = kaldi_mat_shape(buf[pos + 2:token_end].decode("ascii"), buf, token_end + 1)
+    return rows
+
+# Accepts either a path to an SCP file or a view from utils/scp_view.py
+def read_scp_lines(scp_source):
+    if hasattr(scp_source, "scp_lines"):
+        return scp_source.scp_lines()
+    with open(scp_source, 'r') as scp_file:
+        return scp_file.readlines()
+
+# Frame counts for the given SCP lines, without decoding any features
+def count_scp_feats(scp_lines):
+    num_feats = []
+    hao_ark_fd = None
+    for scp_line in scp_lines:
+        utt_id, path_pos = scp_line.replace('\n','').split(' ')
+        path, pos = path_pos.split(':')
+
+        # Kaldi binary matrices carry their frame count in the header
+        if is_kaldi_binary(path, int(pos)):
+            num_feats.append(kaldi_binary_num_rows(path, int(pos)))
+            continue
+
+        if hao_ark_fd is not None:
+            if hao_ark_fd.name != path:
+                # New hao_ark file now -- close and get new descriptor
+                hao_ark_fd.close()
+                hao_ark_fd = open(path, 'r')
+        else:
+            hao_ark_fd = open(path, 'r')
+        hao_ark_fd.seek(int(pos),0)
+
+        # Skip utterance ID in ARK; use the SCP's
+        hao_ark_fd.readline()
+
+        utt_num_feats = 0
+        current_line = hao_ark_fd.readline().rstrip('\n')
+        while current_line != ".":
+            utt_num_feats += 1
+            current_line = hao_ark_fd.readline().rstrip('\n')
+        num_feats.append(utt_num_feats)
+    if hao_ark_fd is not None:
+        hao_ark_fd.close()
+    return num_feats
+
+# SCP lines sorted by ARK file and offset, i.e. in the order their data is laid out on disk
+def disk_order(scp_lines):
+    def disk_position(scp_line):
+        path, pos = scp_line.replace('\n','').split(' ')[1].split(':')
+        return (path, int(pos))
+    return sorted(scp_lines, key=disk_position)
+
+# Duplicate frames at start and end of utterance (as in Kaldi)
+def pad_context(feat_mat, left_context, right_context):
+    return np.concatenate([np.repeat(feat_mat[:1, :], left_context, axis=0),
+                           feat_mat,
+                           np.repeat(feat_mat[-1:, :], right_context, axis=0)]).astype(np.float32, copy=False)
+
 # Dataset class to support loading just features from Hao files
 # Do not use Pytorch's built-in shuffle in DataLoader -- use the optional arguments here instead
+# cache: optional utterance cache (see utils/utt_cache.py), e.g. to parse text ARKs only once over many epochs
 class HaoDataset(Dataset):
-    def __init__(self, scp_path, left_context=0, right_context=0, shuffle_utts=False, shuffle_feats=False, include_lookup=False):
+    def __init__(self, scp_path, left_context=0, right_context=0, shuffle_utts=False, shuffle_feats=False, include_lookup=False,
+                 seed=None, cache=None):
         super(HaoDataset, self).__init__()
 
         self.left_context = left_context
@@ -69,6 +300,7 @@ class HaoDataset(Dataset):
 
         # Load in Hao files
         self.scp_path = scp_path
+        self.cache = cache
 
         self.include_lookup = include_lookup
         if self.include_lookup:
@@ -76,42 +308,28 @@ class HaoDataset(Dataset):
             self.uttid_2_scpline = dict()
 
         # Determine how many utterances and features are included
-        self.num_feats = 0
-        self.hao_ark_fd = None
-        self.scp_lines = []
-        with open(self.scp_path, 'r') as scp_file:
-            for scp_line in scp_file:
-                utt_id, path_pos = scp_line.replace('\n','').split(' ')
-                path, pos = path_pos.split(':')
-
-                if self.hao_ark_fd is not None:
-                    if self.hao_ark_fd.name != path.split(os.sep)[-1]:
-                        # New hao_ark file now -- close and get new descriptor
-                        self.hao_ark_fd.close()
-                        self.hao_ark_fd = open(path, 'r')
-                else:
-                    self.hao_ark_fd = open(path, 'r')
-                self.hao_ark_fd.seek(int(pos),0)
-
-                utt_id = self.hao_ark_fd.readline().rstrip('\n')
-
-                current_line = self.hao_ark_fd.readline().rstrip('\n')
-                while current_line != ".":
-                    self.num_feats += 1
-                    current_line = self.hao_ark_fd.readline().rstrip('\n')
-
-                self.scp_lines.append(scp_line)
-
-                if self.include_lookup:
-                    self.uttid_2_scpline[utt_id] = scp_line
-        self.hao_ark_fd.close()
+        # Frame counts are kept by position in scp_lines (which may list an utterance more than once), so
+        # fast_forward() can skip utterances without reading them; shuffles reorder both lists together
         self.hao_ark_fd = None
+        self.scp_lines = read_scp_lines(self.scp_path)
+        self.utt_num_feats = count_scp_feats(self.scp_lines)
+        self.num_feats = sum(self.utt_num_feats)
+        if self.include_lookup:
+            for scp_line in self.scp_lines:
+                self.uttid_2_scpline[scp_line.split(' ')[0]] = scp_line
+
+        # All shuffling draws from the dataset's own generator, so a seeded dataset is reproducible
+        # (seed=None keeps the old unseeded behavior)
+        self.seed = seed
+        self.rng = np.random.RandomState(seed)
+        self.base_scp_lines = list(self.scp_lines)
+        self.base_utt_num_feats = list(self.utt_num_feats)
+        self.epoch = None
         
         # Set up shuffling of utterances within SCP (if enabled)
         self.shuffle_utts = shuffle_utts
         if self.shuffle_utts:
-            # Shuffle SCP list in place
-            np.random.shuffle(self.scp_lines)
+            self.permute_utts(self.rng.permutation(len(self.scp_lines)))
 
         # Set up shuffling of frames within utterance (if enabled)
         self.shuffle_feats = shuffle_feats
@@ -122,6 +340,10 @@ class HaoDataset(Dataset):
         self.current_utt_idx = 0
         self.current_feat_idx = 0
 
+        # Set by fast_forward(): samples skipped this epoch, and where to start in the next utterance read
+        self.samples_skipped = 0
+        self.resume_feat_idx = 0
+
     def __del__(self):
         if self.hao_ark_fd is not None:
             self.hao_ark_fd.close()
@@ -129,11 +351,74 @@ class HaoDataset(Dataset):
     def __len__(self):
         return self.num_feats
 
+    # Read one utterance, from the cache or reusing the open ARK descriptor where possible
+    def read_utt(self, scp_line):
+        return read_next_utt_cached(scp_line, self.cache, hao_ark_fd=self.hao_ark_fd)
+
+    # Restart at the beginning of the given epoch, with an utterance order and frame shuffles that depend only
+    # on (seed, epoch). Call before creating each epoch's DataLoader iterator; loader workers get a copy of the
+    # dataset when the iterator is created, so this is also what gives every epoch a fresh order.
+    def set_epoch(self, epoch):
+        if self.seed is None:
+            raise RuntimeError("set_epoch() needs a seeded dataset; initialize with seed=<int>")
+
+        self.epoch = epoch
+        self.rng = np.random.RandomState([self.seed, epoch])
+        self.scp_lines = list(self.base_scp_lines)
+        self.utt_num_feats = list(self.base_utt_num_feats)
+        if self.shuffle_utts:
+            self.permute_utts(self.rng.permutation(len(self.scp_lines)))
+
+        self.current_utt_id = None
+        self.current_feat_mat = None
+        self.current_utt_idx = 0
+        self.current_feat_idx = 0
+        self.samples_skipped = 0
+        self.resume_feat_idx = 0
+
+    # Draw exactly what shuffling a num_feats-frame utterance in __getitem__ would, without reading it
+    def skip_utt_shuffle(self, num_feats):
+        if self.shuffle_feats:
+            self.rng.shuffle(np.empty(num_feats + self.left_context + self.right_context))
+
+    # Advance the cursor by num_samples frames (e.g. the ones a preempted run already trained on this epoch),
+    # leaving the dataset exactly as if those frames had been read. Only frame counts are needed,
+    # so skipping most of an epoch takes seconds.
+    def fast_forward(self, num_samples):
+        if self.current_feat_mat is not None:
+            raise RuntimeError("fast_forward() must be called at an utterance boundary, e.g. right after set_epoch()")
+
+        self.samples_skipped = (self.samples_skipped + num_samples) % len(self)
+        num_samples += self.resume_feat_idx
+        self.resume_feat_idx = 0
+        while num_samples > 0:
+            utt_num_feats = self.utt_num_feats[self.current_utt_idx]
+            if num_samples < utt_num_feats:
+                # Stop partway into this utterance; __getitem__ reads and shuffles it, then starts here
+                self.resume_feat_idx = num_samples
+                break
+
+            self.skip_utt_shuffle(utt_num_feats)
+            num_samples -= utt_num_feats
+            self.current_utt_idx += 1
+            if self.current_utt_idx == len(self.scp_lines):
+                self.reshuffle_utts()
+                self.current_utt_idx = 0
+
+    # Reorder the SCP list and its frame counts; order[i] is the current position of the new i-th utterance
+    # (a permutation draws exactly what shuffling the list in place would)
+    def permute_utts(self, order):
+        self.scp_lines = [self.scp_lines[i] for i in order]
+        self.utt_num_feats = [self.utt_num_feats[i] for i in order]
+
+    # End-of-epoch reshuffle of the SCP list, shared by __getitem__ and fast_forward()
+    def reshuffle_utts(self):
+        self.permute_utts(self.rng.permutation(len(self.scp_lines)))
+
     def __getitem__(self, idx):
         if self.current_feat_mat is None:
             scp_line = self.scp_lines[self.current_utt_idx]
-            self.current_utt_id, feat_mat, self.hao_ark_fd = read_next_utt(scp_line,
-                                                                           hao_ark_fd=self.hao_ark_fd)
+            self.current_utt_id, feat_mat, self.hao_ark_fd = self.read_utt(scp_line)
 
             # Duplicate frames at start and end of utterance (as in Kaldi)
             self.current_feat_mat = np.empty((feat_mat.shape[0] + self.left_context + self.right_context,
@@ -146,9 +431,10 @@ class HaoDataset(Dataset):
 
             # Shuffle features if enabled
             if self.shuffle_feats:
-                np.random.shuffle(self.current_feat_mat)
+                self.rng.shuffle(self.current_feat_mat)
             
-            self.current_feat_idx = 0
+            self.current_feat_idx = self.resume_feat_idx
+            self.resume_feat_idx = 0
 
         feats_tensor = torch.FloatTensor(self.current_feat_mat[self.current_feat_idx:self.current_feat_idx + self.left_context + self.right_context + 1, :])
         feats_tensor = feats_tensor.view((self.left_context + self.right_context + 1, -1))
@@ -164,9 +450,9 @@ class HaoDataset(Dataset):
             self.current_feat_idx = 0
             self.current_utt_idx += 1
 
-        if idx == len(self) - 1:
+        if (idx + self.samples_skipped) % len(self) == len(self) - 1:
             # We've seen all of the data (i.e. one epoch) -- shuffle SCP list in place
-            np.random.shuffle(self.scp_lines)
+            self.reshuffle_utts()
             self.current_utt_idx = 0
 
         return (feats_tensor, target_tensor)
@@ -176,30 +462,129 @@ class HaoDataset(Dataset):
         if not self.include_lookup:
             raise RuntimeError("Lookup table not built for this dataset; initialize with include_lookup=True to do so")
 
-        utt_id, feat_mat, hao_ark_fd = read_next_utt(self.uttid_2_scpline[utt_id])
+        utt_id, feat_mat, hao_ark_fd = read_next_utt_cached(self.uttid_2_scpline[utt_id], self.cache)
         return feat_mat
 
 
 
+# Frame-level streaming of Hao files with sequential I/O, as an alternative to HaoDataset's random utterance reads
+# Utterances are grouped into blocks of block_utts consecutive utterances in on-disk order; each epoch visits the
+# blocks in a shuffled order and reads every block front to back through one ARK descriptor. Frames (with context)
+# then pass through a shuffle buffer holding buffer_frames frames, so each batch mixes frames from many utterances.
+# With DataLoader workers, each worker streams every num_workers-th block through its own buffer.
+# Do not use Pytorch's built-in shuffle in DataLoader -- shuffling happens here
+class HaoBlockShuffleDataset(IterableDataset):
+    def __init__(self, scp_path, left_context=0, right_context=0, block_utts=64, buffer_frames=65536, seed=None,
+                 cache=None):
+        super(HaoBlockShuffleDataset, self).__init__()
+
+        self.left_context = left_context
+        self.right_context = right_context
+        self.scp_path = scp_path
+        self.cache = cache
+
+        self.scp_lines = disk_order(read_scp_lines(self.scp_path))
+        self.num_feats = sum(count_scp_feats(self.scp_lines))
+        self.blocks = [self.scp_lines[i:i + block_utts] for i in range(0, len(self.scp_lines), block_utts)]
+        self.buffer_frames = max(1, buffer_frames)
+
+        # Unseeded datasets still need a fixed seed, so that every worker agrees on the block order
+        self.seed = seed if seed is not None else np.random.randint(2 ** 31)
+        self.epoch = 0
+
+        # Frames to drop from the start of the next pass (see fast_forward())
+        self.samples_skipped = 0
+
+    def __len__(self):
+        return self.num_feats
+
+    # Block order and buffer draws depend only on (seed, epoch); call before creating each epoch's DataLoader iterator
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self.samples_skipped = 0
+
+    # Start the next pass num_samples frames in, as if those frames had been read already. The skipped frames
+    # still have to be read to reproduce the buffer's state; exact with at most one loader worker.
+    def fast_forward(self, num_samples):
+        self.samples_skipped = (self.samples_skipped + num_samples) % len(self)
+
+    def frame_pair(self, window):
+        feats_tensor = torch.FloatTensor(window).view((self.left_context + self.right_context + 1, -1))
+
+        # Target is identical to feature tensor
+        return (feats_tensor, feats_tensor.clone())
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+
+        block_order = np.random.RandomState([self.seed, self.epoch]).permutation(len(self.blocks))
+        rng = np.random.RandomState([self.seed, self.epoch, worker_id])
+        samples_skipped = self.samples_skipped // num_workers + (1 if worker_id < self.samples_skipped % num_workers else 0)
+
+        # Once the buffer is full, every new frame replaces a uniformly drawn one, which is yielded. Windows are
+        # copied into one preallocated array, so the buffer holds buffer_frames x window x dim floats and no
+        # references to the utterances they came from
+        window_size = self.left_context + self.right_context + 1
+        buffer = None
+        buffered = 0
+        draws = []
+        hao_ark_fd = None
+        for block_idx in block_order[worker_id::num_workers]:
+            for scp_line in self.blocks[block_idx]:
+                utt_id, feat_mat, hao_ark_fd = read_next_utt_cached(scp_line, self.cache, hao_ark_fd=hao_ark_fd)
+                padded_mat = pad_context(feat_mat, self.left_context, self.right_context)
+                if buffer is None:
+                    buffer = np.empty((min(self.buffer_frames, len(self)), window_size, padded_mat.shape[1]),
+                                      dtype=padded_mat.dtype)
+                for feat_idx in range(feat_mat.shape[0]):
+                    window = padded_mat[feat_idx:feat_idx + window_size]
+                    if buffered < self.buffer_frames:
+                        buffer[buffered] = window
+                        buffered += 1
+                        continue
+
+                    if len(draws) == 0:
+                        draws = list(rng.randint(self.buffer_frames, size=4096))
+                    buffer_idx = draws.pop()
+                    evicted = buffer[buffer_idx].copy()
+                    buffer[buffer_idx] = window
+                    if samples_skipped > 0:
+                        samples_skipped -= 1
+                        continue
+                    yield self.frame_pair(evicted)
+        if hao_ark_fd is not None:
+            hao_ark_fd.close()
+
+        # Flush what's left of the buffer in random order
+        for buffer_idx in rng.permutation(buffered):
+            if samples_skipped > 0:
+                samples_skipped -= 1
+                continue
+            yield self.frame_pair(buffer[buffer_idx].copy())
+
+
+
 # Utterance-by-utterance loading of Hao files
 # Includes utterance ID data data for evaluation and decoding
 # Do not use Pytorch's built-in shuffle in DataLoader -- use the optional arguments here instead
 class HaoEvalDataset(Dataset):
-    def __init__(self, scp_path, shuffle_utts=False, shuffle_feats=False):
+    def __init__(self, scp_path, shuffle_utts=False, shuffle_feats=False, cache=None):
         super(HaoEvalDataset, self).__init__()
 
         # Load in Hao files
         self.scp_path = scp_path
+        self.cache = cache
         self.uttid_2_scpline = dict()
-        with open(self.scp_path, 'r') as scp_file:
-            # Determine how many utterances are included
-            # Also sets up shuffling of utterances within SCP if desired
-            self.scp_lines = list(map(lambda line: line.replace('\n', ''), scp_file.readlines()))
-            self.utt_ids = []
-            for scp_line in self.scp_lines:
-                utt_id = scp_line.split(" ")[0]
-                self.utt_ids.append(utt_id)
-                self.uttid_2_scpline[utt_id] = scp_line
+
+        # Determine how many utterances are included
+        # Also sets up shuffling of utterances within SCP if desired
+        self.scp_lines = list(map(lambda line: line.replace('\n', ''), read_scp_lines(self.scp_path)))
+        self.utt_ids = []
+        for scp_line in self.scp_lines:
+            utt_id = scp_line.split(" ")[0]
+            self.utt_ids.append(utt_id)
+            self.uttid_2_scpline[utt_id] = scp_line
             
         self.shuffle_utts = shuffle_utts
         if self.shuffle_utts:
@@ -209,10 +594,20 @@ class HaoEvalDataset(Dataset):
         # Set up shuffling of feats within utterance
         self.shuffle_feats = shuffle_feats
 
+        # Frame counts by position in scp_lines, for length_batches(); counted on first use
+        self.scp_line_lengths = None
+
     # Utterance-level
     def __len__(self):
         return len(self.utt_ids)
 
+    # Frame count of every utterance, in the order __getitem__ indexes them (without reading any features)
+    # Batch samplers built from these need shuffle_utts=False, as end-of-epoch reshuffles change the order
+    def utt_lengths(self):
+        if self.scp_line_lengths is None:
+            self.scp_line_lengths = count_scp_feats(self.scp_lines)
+        return self.scp_line_lengths
+
     def utt_id(self, utt_idx):
         assert(utt_idx < len(self))
         return self.utt_ids[utt_idx]
@@ -221,7 +616,10 @@ class HaoEvalDataset(Dataset):
     def __getitem__(self, idx):
         # Get next utt from SCP file
         scp_line = self.scp_lines[idx]
-        utt_id, feat_mat, hao_ark_fd = read_next_utt(scp_line)
+        utt_id, feat_mat, hao_ark_fd = read_next_utt_cached(scp_line, self.cache)
+        if not feat_mat.flags.writeable:
+            # Read-only view of a mapped Kaldi ARK or a cached matrix; the tensor needs its own copy anyway
+            feat_mat = np.array(feat_mat)
         if self.shuffle_feats:
             # Shuffle features in-place
             np.random.shuffle(feat_mat)
@@ -239,5 +637,52 @@ class HaoEvalDataset(Dataset):
 
     # Get specific utterance 
     def feats_for_uttid(self, utt_id):
-        utt_id, feat_mat, hao_ark_fd = read_next_utt(self.uttid_2_scpline[utt_id])
+        utt_id, feat_mat, hao_ark_fd = read_next_utt_cached(self.uttid_2_scpline[utt_id], self.cache)
         return feat_mat
+
+
+
+# Batching whole utterances from a HaoEvalDataset: pass length_batches(dataset.utt_lengths(), ...) to a DataLoader as
+# its batch_sampler, and collate_padded_utts as its collate_fn
+
+# Greedy batches of utterance indices in order of length, so each batch holds similar lengths and little padding;
+# every batch fits max_frames padded frames (batch size times its longest utterance), unless a single utterance
+# is longer than that. With window set, only every window consecutive utterances are sorted together and batches
+# come window by window, so results can be written back in the original order a window at a time.
+# rng shuffles the order of the batches (within each window).
+def length_batches(lengths, max_frames, rng=None, window=None):
+    if window is None:
+        window = max(1, len(lengths))
+
+    batches = []
+    for window_start in range(0, len(lengths), window):
+        window_lengths = np.asarray(lengths[window_start:window_start + window])
+        order = window_start + np.argsort(window_lengths, kind='stable')
+        window_batches = []
+        current = []
+        current_max = 0
+        for idx in order:
+            if len(current) > 0 and max(current_max, lengths[idx]) * (len(current) + 1) > max_frames:
+                window_batches.append(current)
+                current = []
+                current_max = 0
+            current.append(int(idx))
+            current_max = max(current_max, lengths[idx])
+        if len(current) > 0:
+            window_batches.append(current)
+
+        if rng is not None:
+            rng.shuffle(window_batches)
+        batches.extend(window_batches)
+    return batches
+
+# Collates HaoEvalDataset items into (feats (batch, max_len, freq), lengths (batch,), mask (batch, max_len), utt_ids)
+# Padding frames are zeros, and 0 in the mask
+def collate_padded_utts(items):
+    lengths = torch.LongTensor([item[0].size()[0] for item in items])
+    max_length = int(lengths.max())
+    feats = torch.zeros(len(items), max_length, items[0][0].size()[1])
+    for i, item in enumerate(items):
+        feats[i, :item[0].size()[0], :] = item[0]
+    mask = (torch.arange(max_length).unsqueeze(0) < lengths.unsqueeze(1)).float()
+    return feats, lengths, mask, [item[2] for item in items]
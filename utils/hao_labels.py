@@ -0,0 +1,236 @@
+import os
+import sys
+
+import numpy as np
+
+import torch
+
+sys.path.append("./")
+from utils.hao_data import HaoDataset, read_scp_lines
+
+# Frame labels (e.g. ihm-train-tri3.bali) are Hao-format text: utterance ID line, label tokens, "." line
+# A label store packs every utterance's labels into one int32 array plus an utterance index,
+# so label lookups cost a slice instead of a text parse
+
+# Pdf-id list (e.g. ihm-pdfids.txt); network output index i corresponds to line i
+def read_pdfids(pdfid_path):
+    with open(pdfid_path, 'r') as pdfid_file:
+        return [line.strip() for line in pdfid_file if len(line.strip()) > 0]
+
+def read_next_labels(label_fd):
+    utt_id = label_fd.readline()
+    if utt_id == '':
+        return None, None
+    utt_id = utt_id.rstrip('\n')
+
+    tokens = []
+    current_line = label_fd.readline()
+    while current_line.rstrip('\n') != "." and current_line != '':
+        tokens.extend(current_line.split())
+        current_line = label_fd.readline()
+    return utt_id, tokens
+
+class HaoLabelStore(object):
+    def __init__(self, labels, utt_ids, offsets, lengths, pdfids=None):
+        self.labels = labels
+        self.utt_ids = list(utt_ids)
+        self.offsets = offsets
+        self.lengths = lengths
+        self.pdfids = pdfids
+
+        self.uttid_2_idx = {utt_id: idx for idx, utt_id in enumerate(self.utt_ids)}
+
+    def __len__(self):
+        return len(self.utt_ids)
+
+    def __contains__(self, utt_id):
+        return utt_id in self.uttid_2_idx
+
+    def num_frames(self):
+        return len(self.labels)
+
+    def labels_for_uttid(self, utt_id):
+        idx = self.uttid_2_idx[utt_id]
+        return self.labels[self.offsets[idx]:self.offsets[idx] + self.lengths[idx]]
+
+    # Map output indices back to pdf-id strings (as printed by frame-tdnn-predict)
+    def pdfids_for_labels(self, labels):
+        if self.pdfids is None:
+            return [str(label) for label in labels]
+        return [self.pdfids[label] for label in labels]
+
+    # Writes <prefix>.npy (labels) and <prefix>.idx ("utt_id offset length" per line)
+    def save(self, prefix):
+        np.save(prefix + ".npy", self.labels)
+        with open(prefix + ".idx", 'w') as idx_fd:
+            if self.pdfids is not None:
+                idx_fd.write("#pdfids %s\n" % " ".join(self.pdfids))
+            for utt_id, offset, length in zip(self.utt_ids, self.offsets, self.lengths):
+                idx_fd.write("%s %d %d\n" % (utt_id, offset, length))
+
+# Label array is memory-mapped, so loading is instant and pages are shared between loader workers
+def load_label_store(prefix):
+    labels = np.load(prefix + ".npy", mmap_mode='r')
+    pdfids = None
+    utt_ids = []
+    offsets = []
+    lengths = []
+    with open(prefix + ".idx", 'r') as idx_fd:
+        for line in idx_fd:
+            if line.startswith("#pdfids "):
+                pdfids = line.split()[1:]
+                continue
+            utt_id, offset, length = line.split()
+            utt_ids.append(utt_id)
+            offsets.append(int(offset))
+            lengths.append(int(length))
+    return HaoLabelStore(labels,
+                         utt_ids,
+                         np.asarray(offsets, dtype=np.int64),
+                         np.asarray(lengths, dtype=np.int32),
+                         pdfids=pdfids)
+
+# Build from a whole label file (e.g. ihm-dev-tri3.bali) or from a label SCP/view (e.g. ihm-train-tri3.bali.scp)
+# If pdfid_path is given, labels are stored as output indices into it; otherwise as integer pdf-ids
+def build_label_store(label_source, pdfid_path=None, is_scp=None):
+    pdfids = None
+    pdfid_2_idx = None
+    if pdfid_path is not None:
+        pdfids = read_pdfids(pdfid_path)
+        pdfid_2_idx = {pdfid: idx for idx, pdfid in enumerate(pdfids)}
+
+    def to_array(tokens):
+        if pdfid_2_idx is not None:
+            return np.asarray([pdfid_2_idx[token] for token in tokens], dtype=np.int32)
+        return np.asarray(tokens, dtype=np.int32)
+
+    if is_scp is None:
+        is_scp = hasattr(label_source, "scp_lines") or label_source.endswith(".scp")
+
+    utt_ids = []
+    label_arrays = []
+    if is_scp:
+        label_fd = None
+        for scp_line in read_scp_lines(label_source):
+            utt_id, path_pos = scp_line.rstrip('\n').split(' ')
+            path, pos = path_pos.split(':')
+            if label_fd is None or label_fd.name != path:
+                if label_fd is not None:
+                    label_fd.close()
+                label_fd = open(path, 'r')
+            label_fd.seek(int(pos), 0)
+
+            # SCP's utterance ID takes precedence (it may be remapped by a view)
+            ark_utt_id, tokens = read_next_labels(label_fd)
+            utt_ids.append(utt_id)
+            label_arrays.append(to_array(tokens))
+        if label_fd is not None:
+            label_fd.close()
+    else:
+        with open(label_source, 'r') as label_fd:
+            utt_id, tokens = read_next_labels(label_fd)
+            while utt_id is not None:
+                utt_ids.append(utt_id)
+                label_arrays.append(to_array(tokens))
+                utt_id, tokens = read_next_labels(label_fd)
+
+    lengths = np.asarray([len(arr) for arr in label_arrays], dtype=np.int32)
+    offsets = np.zeros(len(lengths), dtype=np.int64)
+    if len(lengths) > 1:
+        offsets[1:] = np.cumsum(lengths[:-1])
+    if len(label_arrays) > 0:
+        labels = np.concatenate(label_arrays)
+    else:
+        labels = np.empty(0, dtype=np.int32)
+    return HaoLabelStore(labels, utt_ids, offsets, lengths, pdfids=pdfids)
+
+
+
+# Frame-level (spliced features, label) pairs; loads features just like HaoDataset
+# Frame shuffling permutes which windows are visited, so every frame keeps its own context and label
+# Do not use Pytorch's built-in shuffle in DataLoader -- use the optional arguments here instead
+class HaoLabeledDataset(HaoDataset):
+    def __init__(self, scp_path, label_store, left_context=0, right_context=0, shuffle_utts=False, shuffle_feats=False,
+                 seed=None, cache=None):
+        super(HaoLabeledDataset, self).__init__(scp_path,
+                                                left_context=left_context,
+                                                right_context=right_context,
+                                                shuffle_utts=shuffle_utts,
+                                                shuffle_feats=shuffle_feats,
+                                                seed=seed,
+                                                cache=cache)
+        self.label_store = label_store
+
+        for scp_line in self.scp_lines:
+            utt_id = scp_line.split(' ')[0]
+            if utt_id not in self.label_store:
+                raise RuntimeError("No labels for utterance %s in label store" % utt_id)
+
+        self.current_labels = None
+        self.current_order = None
+
+    def __getitem__(self, idx):
+        if self.current_feat_mat is None:
+            scp_line = self.scp_lines[self.current_utt_idx]
+            self.current_utt_id, feat_mat, self.hao_ark_fd = self.read_utt(scp_line)
+
+            self.current_labels = self.label_store.labels_for_uttid(self.current_utt_id)
+            if len(self.current_labels) != feat_mat.shape[0]:
+                raise RuntimeError("Utterance %s has %d frames but %d labels" % (self.current_utt_id,
+                                                                                 feat_mat.shape[0],
+                                                                                 len(self.current_labels)))
+
+            # Duplicate frames at start and end of utterance (as in Kaldi)
+            self.current_feat_mat = np.concatenate([np.repeat(feat_mat[:1, :], self.left_context, axis=0),
+                                                    feat_mat,
+                                                    np.repeat(feat_mat[-1:, :], self.right_context, axis=0)])
+
+            # Shuffle order in which frames are visited, if enabled
+            if self.shuffle_feats:
+                self.current_order = self.rng.permutation(feat_mat.shape[0])
+            else:
+                self.current_order = np.arange(feat_mat.shape[0])
+
+            self.current_feat_idx = self.resume_feat_idx
+            self.resume_feat_idx = 0
+
+        frame_idx = self.current_order[self.current_feat_idx]
+        feats_tensor = torch.FloatTensor(self.current_feat_mat[frame_idx:frame_idx + self.left_context + self.right_context + 1, :])
+        label_tensor = torch.LongTensor([int(self.current_labels[frame_idx])])[0]
+
+        # Update where we are in the feature matrix
+        self.current_feat_idx += 1
+        if self.current_feat_idx == len(self.current_order):
+            self.current_utt_id = None
+            self.current_feat_mat = None
+            self.current_labels = None
+            self.current_feat_idx = 0
+            self.current_utt_idx += 1
+
+        if (idx + self.samples_skipped) % len(self) == len(self) - 1:
+            # We've seen all of the data (i.e. one epoch) -- shuffle SCP list in place
+            self.reshuffle_utts()
+            self.current_utt_idx = 0
+
+        return (feats_tensor, label_tensor)
+
+    def reshuffle_utts(self):
+        if self.shuffle_utts:
+            super(HaoLabeledDataset, self).reshuffle_utts()
+
+    def skip_utt_shuffle(self, num_feats):
+        if self.shuffle_feats:
+            self.rng.permutation(num_feats)
+
+
+
+# Usage: python utils/hao_labels.py <label file or SCP> <pdf-id file or "none"> <output prefix>
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("Usage: python utils/hao_labels.py <label file or SCP> <pdf-id file or \"none\"> <output prefix>", flush=True)
+        sys.exit(1)
+
+    label_store = build_label_store(sys.argv[1], pdfid_path=None if sys.argv[2] == "none" else sys.argv[2])
+    label_store.save(sys.argv[3])
+    print("Stored %d labels for %d utterances in %s.npy/.idx" % (label_store.num_frames(), len(label_store), sys.argv[3]),
+          flush=True)
@@ -0,0 +1,151 @@
+import json
+import os
+import resource
+import sys
+import time
+from collections import OrderedDict
+
+# JSON-lines metrics stream for train_md.py and augment_md.py: one object per line, e.g.
+#   {"time": 1508872043.1, "elapsed": 812.4, "source": "train_md", "event": "train_progress", "epoch": 1, ...,
+#    "classes": {"ihm": {"frames": 25600, "frames_per_sec": 3121.9, ...}, ...},
+#    "data_wait_fraction": 0.31, "memory": {"rss_mb": 2210.5, "max_rss_mb": 2301.0, "cuda_peak_mb": 901.2}}
+# Throughput, data wait and the CUDA peak cover the window since the previous throughput event, so every line
+# stands on its own. Written when METRICS_STREAM names a file (appended to, so restarts continue the same
+# stream); otherwise every call returns right away.
+# Load with e.g. pandas.read_json(path, lines=True), or `jq` on the command line.
+
+
+
+def rss_mb():
+    # Current resident set size; /proc only exists on Linux, elsewhere fall back to the peak
+    try:
+        with open("/proc/self/statm", 'r') as statm_fd:
+            return int(statm_fd.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (IOError, OSError, ValueError):
+        return max_rss_mb()
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024.0 * 1024.0) if sys.platform == "darwin" else max_rss / 1024.0
+
+def memory_stats(on_gpu=False):
+    stats = OrderedDict([("rss_mb", rss_mb()), ("max_rss_mb", max_rss_mb())])
+    if on_gpu:
+        import torch
+        stats["cuda_allocated_mb"] = torch.cuda.memory_allocated() / (1024.0 * 1024.0)
+        stats["cuda_peak_mb"] = torch.cuda.max_memory_allocated() / (1024.0 * 1024.0)
+    return stats
+
+class MetricsStream(object):
+    def __init__(self, path, source, on_gpu=False, rank=0):
+        self.enabled = path is not None and len(path) > 0
+        self.source = source
+        self.on_gpu = on_gpu
+        self.rank = rank
+        self.start_t = time.perf_counter()
+
+        self.metrics_fd = None
+        if self.enabled:
+            self.metrics_fd = open(path, 'a')
+        self.reset_window()
+
+    def reset_window(self):
+        self.window_start_t = time.perf_counter()
+        self.window_counts = OrderedDict()  # Decoder class -> {"frames": ..., "utterances": ..., "batches": ...}
+        self.wait_seconds = 0.0
+        self.wait_start_t = None
+        if self.enabled and self.on_gpu:
+            import torch
+            if hasattr(torch.cuda, "reset_peak_memory_stats"):
+                torch.cuda.reset_peak_memory_stats()
+            else:
+                torch.cuda.reset_max_memory_allocated()
+
+    def add(self, decoder_class, frames=0, utterances=0, batches=0):
+        if not self.enabled:
+            return
+        if decoder_class not in self.window_counts:
+            self.window_counts[decoder_class] = OrderedDict([("frames", 0), ("utterances", 0), ("batches", 0)])
+        counts = self.window_counts[decoder_class]
+        counts["frames"] += frames
+        counts["utterances"] += utterances
+        counts["batches"] += batches
+
+    # Bracket time spent blocked on the data loader
+    def start_wait(self):
+        if self.enabled:
+            self.wait_start_t = time.perf_counter()
+
+    def stop_wait(self):
+        if self.enabled and self.wait_start_t is not None:
+            self.wait_seconds += time.perf_counter() - self.wait_start_t
+            self.wait_start_t = None
+
+    # Like PhaseTimer.timed_iter: counts every next() on an iterator as data wait
+    def timed_iter(self, iterable):
+        iterator = iter(iterable)
+        while True:
+            self.start_wait()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.wait_start_t = None
+                return
+            self.stop_wait()
+            yield item
+
+    def emit(self, event, **fields):
+        if not self.enabled:
+            return
+        record = OrderedDict([("time", time.time()),
+                              ("elapsed", time.perf_counter() - self.start_t),
+                              ("source", self.source),
+                              ("rank", self.rank),
+                              ("event", event)])
+        record.update(fields)
+        self.metrics_fd.write(json.dumps(record) + "\n")
+        self.metrics_fd.flush()
+
+    # Emits per-class counts and rates, data-wait fraction and memory for the window since the last call, then
+    # starts a new window
+    def emit_throughput(self, event, **fields):
+        if not self.enabled:
+            return
+        window_seconds = time.perf_counter() - self.window_start_t
+        classes = OrderedDict()
+        for decoder_class, counts in self.window_counts.items():
+            classes[decoder_class] = OrderedDict()
+            for name, count in counts.items():
+                classes[decoder_class][name] = count
+                classes[decoder_class][name + "_per_sec"] = count / window_seconds if window_seconds > 0 else 0.0
+        total_frames = sum(counts["frames"] for counts in self.window_counts.values())
+        self.emit(event,
+                  window_seconds=window_seconds,
+                  classes=classes,
+                  frames_per_sec=total_frames / window_seconds if window_seconds > 0 else 0.0,
+                  data_wait_fraction=self.wait_seconds / window_seconds if window_seconds > 0 else 0.0,
+                  memory=memory_stats(self.on_gpu),
+                  **fields)
+        self.reset_window()
+
+    def close(self):
+        if self.metrics_fd is not None:
+            self.metrics_fd.close()
+            self.metrics_fd = None
+
+# Per-class losses normalized by elements processed, as printed by train_md.py's print_loss_dict
+def normalized_losses(loss_dict, class_elements_processed):
+    losses = OrderedDict()
+    for decoder_class in loss_dict:
+        losses[decoder_class] = OrderedDict()
+        for loss_key in loss_dict[decoder_class]:
+            losses[decoder_class][loss_key] = loss_dict[decoder_class][loss_key] / max(class_elements_processed[decoder_class], 1)
+    return losses
+
+# Rank k > 0 of a data-parallel run writes to <METRICS_STREAM>.rank<k>, like launch_md.py's rank logs
+def metrics_from_env(source, on_gpu=False, rank=0):
+    path = os.environ.get("METRICS_STREAM", "")
+    if len(path) > 0 and rank > 0:
+        path = "%s.rank%d" % (path, rank)
+    return MetricsStream(path, source, on_gpu=on_gpu, rank=rank)
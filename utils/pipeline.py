@@ -0,0 +1,418 @@
+import json
+import os
+import re
+import string
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.artifact_cache import ArtifactCache, CacheSpec, config_env
+
+# Runs the experiment's SLURM scripts as a dependency graph on one machine
+# Each stage is one of the existing bash scripts; its core count and array range come from its #SBATCH header
+# ("-c N", "--array=A-B"), and array tasks get SLURM_ARRAY_TASK_ID just as under sbatch.
+# Tasks start as soon as their stage's dependencies are done and enough of the core budget is free,
+# so e.g. the 30 decode splits run side by side. Each task is reaped with os.wait4 for its resource usage.
+# With an artifact cache (utils/artifact_cache.py), stages whose inputs and config are unchanged are skipped.
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+
+# STAGES
+
+
+
+# Returns (cores, array task IDs or None) from a script's #SBATCH lines
+def sbatch_resources(script_path):
+    cores = 1
+    array = None
+    with open(script_path, 'r') as script_fd:
+        for line in script_fd:
+            if not line.startswith("#SBATCH"):
+                continue
+            match = re.search(r"(?:-c|--cpus-per-task)[ =](\d+)", line)
+            if match:
+                cores = int(match.group(1))
+            match = re.search(r"--array[ =](\d+)-(\d+)", line)
+            if match:
+                array = list(range(int(match.group(1)), int(match.group(2)) + 1))
+    return cores, array
+
+class Stage(object):
+    def __init__(self, name, argv, deps=(), cores=1, array=None, cache=None):
+        self.name = name
+        self.argv = argv
+        self.deps = list(deps)
+        self.cores = cores
+        self.array = array
+        self.cache = cache      # CacheSpec, or None if the stage always runs
+        self.env = dict()       # Variables set for the stage's tasks (and its cache config) on top of the runner's
+
+    def tasks(self):
+        return [None] if self.array is None else list(self.array)
+
+def script_stage(name, script, args, deps=(), cache=None):
+    script_path = os.path.join(repo_root, script)
+    cores, array = sbatch_resources(script_path)
+    return Stage(name, ["bash", script_path] + list(args), deps=deps, cores=cores, array=array, cache=cache)
+
+# Config variables that change what the multidecoder (and so the augmented data) is
+md_env_keys = ["DATASET_NAME", "DATASET_FRACTION", "DATASET_FRACTION_SEED", "EXPT_NAME", "NOISE_RATIO", "FEAT_DIM",
+               "LEFT_CONTEXT", "RIGHT_CONTEXT", "OPTIMIZER", "LEARNING_RATE", "EPOCHS", "BATCH_SIZE", "VAL_BATCH_COUNT",
+               "DECODER_CLASSES_DELIM", "USE_BACKTRANSLATION", "DOMAIN_ADV_FC_DELIM", "DOMAIN_ADV_ACTIVATION",
+               "GAN_FC_DELIM", "GAN_ACTIVATION", "ACCUM_STEPS", "LR_SCALING", "LR_WARMUP_STEPS",
+               "VAL_MODE", "VAL_SAMPLE_FRACTION", "VAL_MIN_BATCHES", "VAL_CONFIDENCE_Z", "VAL_REL_TOLERANCE",
+               "EVAL_WORKER", "EVAL_MAX_PENDING", "TRAIN_SAMPLER", "TRAIN_BLOCK_UTTS", "TRAIN_SHUFFLE_BUFFER"]
+am_env_keys = ["DATASET_NAME", "CNN_NAME", "NOISE_RATIO", "ARCH_NAME", "NPRED", "START_EPOCH", "END_EPOCH", "AM_BACKEND"]
+
+# Name of the multidecoder run (as used for checkpoints and augmented data directories)
+def md_run_name(run_mode, adversarial):
+    if adversarial == "domain":
+        return "domain_adversarial_fc_${DOMAIN_ADV_FC_DELIM}_act_${DOMAIN_ADV_ACTIVATION}_%s_ratio${NOISE_RATIO}" % run_mode
+    elif adversarial == "gan":
+        return "gan_fc_${GAN_FC_DELIM}_act_${GAN_ACTIVATION}_%s_ratio${NOISE_RATIO}" % run_mode
+    return "%s_ratio${NOISE_RATIO}" % run_mode
+
+# Parameters an AM training stage resumes from (param-$((START_EPOCH-1)) in its model directory);
+# none when starting from epoch 1, where the script initializes them itself
+def am_resume_param(model_dir):
+    def resolve(env):
+        start_epoch = int(env["START_EPOCH"])
+        if start_epoch <= 1:
+            return None
+        return "%s/param-%d" % (string.Template(model_dir).substitute(env), start_epoch - 1)
+    return resolve
+
+# Multidecoder -> augmentation -> combined AM -> prediction/decoding -> scoring
+# adversarial is None, "domain" or "gan"
+def combined_stages(run_mode, predict_domain, adversarial=None):
+    extra = [adversarial] if adversarial is not None else []
+    run_name = md_run_name(run_mode, adversarial)
+    if adversarial == "domain":
+        best_ckpt = "${MODEL_DIR}/best_cnn_domain_adversarial_fc_${DOMAIN_ADV_FC_DELIM}_act_${DOMAIN_ADV_ACTIVATION}_%s_ratio${NOISE_RATIO}_md.pth.tar" % run_mode
+    elif adversarial == "gan":
+        best_ckpt = "${MODEL_DIR}/best_cnn_gan_fc_${GAN_FC_DELIM}_act_${GAN_ACTIVATION}_%s_ratio${NOISE_RATIO}_md.pth.tar" % run_mode
+    else:
+        best_ckpt = "${MODEL_DIR}/best_cnn_%s_ratio${NOISE_RATIO}_md.pth.tar" % run_mode
+    md_scps = ["${CURRENT_FEATS}/%s-%s-norm.blogmel.scp" % (decoder_class, split)
+               for decoder_class in ["ihm", "sdm1"] for split in ["train", "val", "dev"]]
+
+    return [
+        script_stage("train_md", "cnn/train.bash", [run_mode] + extra,
+                     cache=CacheSpec(["cnn/job_config.sh"], md_scps, [best_ckpt], env_keys=md_env_keys)),
+        script_stage("augment", "cnn/augment.bash", [run_mode] + extra, deps=["train_md"],
+                     cache=CacheSpec(["cnn/job_config.sh"],
+                                     [best_ckpt] + md_scps,
+                                     ["${AUGMENTED_DATA_DIR}/%s" % run_name],
+                                     env_keys=md_env_keys)),
+        script_stage("train_am", "am/train_combined.bash", [run_mode] + extra, deps=["augment"],
+                     cache=CacheSpec(["am/combined_config.sh"],
+                                     ["${AUGMENTED_DATA_BASE_DIR}/%s/train-src_ihm-tar_sdm1.scp" % run_name,
+                                      "${DATASET}/ihm-train-norm.blogmel.scp",
+                                      "${DATASET}/ihm-train-tri3.bali.scp",
+                                      "${DATASET}/ihm-pdfids.txt",
+                                      am_resume_param("${MODEL_DIR}/%s" % run_name)],
+                                     ["${MODEL_DIR}/%s" % run_name],
+                                     env_keys=am_env_keys)),
+        script_stage("predict", "am/predict_combined.bash", [run_mode, predict_domain] + extra, deps=["train_am"]),
+        script_stage("decode", "am/decode_combined.bash", [run_mode, predict_domain] + extra, deps=["train_am"]),
+        script_stage("score", "am/score_combined.bash", [run_mode, predict_domain] + extra, deps=["decode"]),
+    ]
+
+# Run-name variables the multidecoder and AM configs must agree on for train_am to find augment's output
+def handoff_env_keys(adversarial):
+    keys = ["DATASET_NAME", "NOISE_RATIO"]
+    if adversarial == "domain":
+        keys += ["DOMAIN_ADV_FC_DELIM", "DOMAIN_ADV_ACTIVATION"]
+    elif adversarial == "gan":
+        keys += ["GAN_FC_DELIM", "GAN_ACTIVATION"]
+    return keys
+
+# cnn/augment.bash writes under the multidecoder's AUGMENTED_DATA_DIR (named after cnn/job_config.sh's EXPT_NAME),
+# but the AM scripts read AUGMENTED_DATA_BASE_DIR from am/combined_config.sh, so point the AM stages at this run.
+# Fails if the two configs name the run differently (e.g. another NOISE_RATIO), since train_am would then read
+# some other run's augmented data.
+def link_md_to_am(stages, adversarial):
+    md_env = config_env(repo_root, ["cnn/job_config.sh"])
+    am_env = config_env(repo_root, ["am/combined_config.sh"])
+    mismatched = [key for key in handoff_env_keys(adversarial) if md_env.get(key) != am_env.get(key)]
+    if len(mismatched) > 0:
+        raise RuntimeError("cnn/job_config.sh and am/combined_config.sh disagree on %s" % ", ".join(
+            "%s (%s vs. %s)" % (key, md_env.get(key), am_env.get(key)) for key in mismatched))
+    for stage in stages:
+        if stage.name not in ["train_md", "augment"]:
+            stage.env["CNN_NAME"] = md_env["EXPT_NAME"]
+            stage.env["AUGMENTED_DATA_BASE_DIR"] = md_env["AUGMENTED_DATA_DIR"]
+
+def baseline_stages(train_domain, predict_domain):
+    return [
+        script_stage("train_am", "am/train_baseline.bash", [train_domain],
+                     cache=CacheSpec(["am/baseline_config.sh"],
+                                     ["${DATASET}/%s-train-norm.blogmel.scp" % train_domain,
+                                      "${DATASET}/ihm-train-tri3.bali.scp",
+                                      "${DATASET}/ihm-pdfids.txt",
+                                      am_resume_param("${MODEL_DIR}/train_%s/baseline/${ARCH_NAME}" % train_domain)],
+                                     ["${MODEL_DIR}/train_%s/baseline/${ARCH_NAME}" % train_domain],
+                                     env_keys=am_env_keys)),
+        script_stage("predict", "am/predict_baseline.bash", [train_domain, predict_domain], deps=["train_am"]),
+        script_stage("decode", "am/decode_baseline.bash", [train_domain, predict_domain], deps=["train_am"]),
+        script_stage("score", "am/score_baseline.bash", [train_domain, predict_domain], deps=["decode"]),
+    ]
+
+
+
+# RUNNER
+
+
+
+class StageStats(object):
+    def __init__(self):
+        self.tasks = 0
+        self.failed = 0
+        self.start_t = None
+        self.end_t = None
+        self.user_time = 0.0
+        self.sys_time = 0.0
+        self.max_rss_kb = 0
+
+    def record(self, start_t, end_t, rusage, failed):
+        self.tasks += 1
+        self.failed += int(failed)
+        self.start_t = start_t if self.start_t is None else min(self.start_t, start_t)
+        self.end_t = end_t if self.end_t is None else max(self.end_t, end_t)
+        self.user_time += rusage.ru_utime
+        self.sys_time += rusage.ru_stime
+        self.max_rss_kb = max(self.max_rss_kb, rusage.ru_maxrss)
+
+    def summary(self):
+        return {
+            "tasks": self.tasks,
+            "failed": self.failed,
+            "wall_time": (self.end_t - self.start_t) if self.start_t is not None else 0.0,
+            "user_time": self.user_time,
+            "sys_time": self.sys_time,
+            "max_rss_kb": self.max_rss_kb,
+        }
+
+class PipelineRunner(object):
+    def __init__(self, stages, cores=None, log_dir="pipeline_logs", cache=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.order = [stage.name for stage in stages]
+        self.cores = cores if cores is not None else os.cpu_count()
+        self.log_dir = log_dir
+        self.cache = cache
+        self.cache_keys = dict()    # Stage name -> (key, resolved outputs) for stages that ran
+
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise RuntimeError("Stage %s depends on unknown stage %s" % (stage.name, dep))
+
+        self.stats = {name: StageStats() for name in self.order}
+
+    # Returns True if the stage's outputs were restored from the cache (so it need not run)
+    def try_cache(self, stage):
+        if self.cache is None or stage.cache is None:
+            return False
+        try:
+            env = config_env(repo_root, stage.cache.config_scripts, extra_env=stage.env)
+            inputs, outputs = stage.cache.resolve(env)
+        except (subprocess.CalledProcessError, KeyError) as e:
+            print("Not caching stage %s; could not resolve its config (%s)" % (stage.name, e), flush=True)
+            return False
+        missing = [path for path in inputs if not os.path.exists(path)]
+        if len(missing) > 0:
+            print("Not caching stage %s; missing inputs %s" % (stage.name, ", ".join(missing)), flush=True)
+            return False
+
+        key = self.cache.key(stage.name, stage.argv, env, inputs, stage.cache.env_keys,
+                             config_scripts=[os.path.join(repo_root, path) for path in stage.cache.config_scripts])
+        if self.cache.has(key):
+            self.cache.restore(key, outputs)
+            print("Stage %s restored from cache (%s)" % (stage.name, key[:12]), flush=True)
+            return True
+        self.cache.detach(outputs)
+        self.cache_keys[stage.name] = (key, outputs)
+        return False
+
+    def task_name(self, stage, task):
+        return stage.name if task is None else "%s.%d" % (stage.name, task)
+
+    def launch(self, stage, task):
+        env = dict(os.environ, **stage.env)
+        if task is not None:
+            env["SLURM_ARRAY_TASK_ID"] = str(task)
+        log_path = os.path.join(self.log_dir, self.task_name(stage, task) + ".log")
+        log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+        # Plain fork/exec rather than subprocess.Popen: Popen reaps its own children behind our back,
+        # and the runner needs to collect each exit itself with os.wait4
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.chdir(repo_root)
+                os.dup2(log_fd, 1)
+                os.dup2(log_fd, 2)
+                os.execvpe(stage.argv[0], stage.argv, env)
+            finally:
+                os._exit(127)
+        os.close(log_fd)
+        return pid
+
+    # Returns True if every task of every stage succeeded
+    def run(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        remaining = {name: len(self.stages[name].tasks()) for name in self.order}
+        done = set()
+        started = set()
+        ready = []          # (stage, task) waiting for cores
+        running = dict()    # pid -> (stage, task, cores, start time)
+        free_cores = self.cores
+        failed = False
+        self.cached = set()
+
+        while True:
+            # Queue every task of each stage whose dependencies have all finished
+            # (a stage restored from the cache counts as finished straight away, which may unblock later ones)
+            while not failed:
+                num_started = len(started)
+                for name in self.order:
+                    stage = self.stages[name]
+                    if name not in started and all(dep in done for dep in stage.deps):
+                        started.add(name)
+                        if self.try_cache(stage):
+                            done.add(name)
+                            self.cached.add(name)
+                            continue
+                        ready.extend([(stage, task) for task in stage.tasks()])
+                        print("Starting stage %s (%d task(s), %d core(s) each)" % (name, len(stage.tasks()), stage.cores),
+                              flush=True)
+                if len(started) == num_started:
+                    break
+            if not failed:
+
+                # A task wider than the whole budget still runs, alone
+                while len(ready) > 0:
+                    stage, task = ready[0]
+                    task_cores = min(stage.cores, self.cores)
+                    if task_cores > free_cores:
+                        break
+                    ready.pop(0)
+                    pid = self.launch(stage, task)
+                    running[pid] = (stage, task, task_cores, time.perf_counter())
+                    free_cores -= task_cores
+
+            if len(running) == 0:
+                break
+
+            pid, status, rusage = os.wait4(-1, 0)
+            if pid not in running:
+                continue
+            stage, task, task_cores, start_t = running.pop(pid)
+            free_cores += task_cores
+            end_t = time.perf_counter()
+            task_failed = (os.WIFEXITED(status) and os.WEXITSTATUS(status) != 0) or os.WIFSIGNALED(status)
+            self.stats[stage.name].record(start_t, end_t, rusage, task_failed)
+            print("%s %s in %.1fs (user %.1fs, sys %.1fs, max RSS %d KB)" % (self.task_name(stage, task),
+                                                                           "FAILED" if task_failed else "done",
+                                                                           end_t - start_t,
+                                                                           rusage.ru_utime,
+                                                                           rusage.ru_stime,
+                                                                           rusage.ru_maxrss),
+                  flush=True)
+
+            if task_failed and not failed:
+                # Let running tasks finish, but start nothing new
+                failed = True
+                ready = []
+            remaining[stage.name] -= 1
+            if remaining[stage.name] == 0 and self.stats[stage.name].failed == 0:
+                done.add(stage.name)
+                if stage.name in self.cache_keys:
+                    key, outputs = self.cache_keys[stage.name]
+                    self.cache.store(key, outputs, metadata={"stage": stage.name, "argv": stage.argv})
+                print("Stage %s done in %.1fs" % (stage.name, self.stats[stage.name].summary()["wall_time"]), flush=True)
+
+        self.write_summary()
+        return not failed and len(done) == len(self.order)
+
+    def write_summary(self):
+        summary = {name: dict(self.stats[name].summary(), cached=(name in self.cached)) for name in self.order}
+        with open(os.path.join(self.log_dir, "pipeline_summary.json"), 'w') as summary_fd:
+            json.dump(summary, summary_fd, indent=2, sort_keys=True)
+
+        print("\n%-10s %6s %6s %10s %10s %10s %12s" % ("stage", "tasks", "failed", "wall (s)", "user (s)", "sys (s)", "max RSS (KB)"),
+              flush=True)
+        for name in self.order:
+            stage_summary = summary[name]
+            print("%-10s %6d %6d %10.1f %10.1f %10.1f %12d" % (name,
+                                                              stage_summary["tasks"],
+                                                              stage_summary["failed"],
+                                                              stage_summary["wall_time"],
+                                                              stage_summary["user_time"],
+                                                              stage_summary["sys_time"],
+                                                              stage_summary["max_rss_kb"]),
+                  flush=True)
+
+
+
+# Usage:
+#   python utils/pipeline.py combined <run mode> <predict domain> [domain|gan] [options]
+#   python utils/pipeline.py baseline <train domain> <predict domain> [options]
+# Options: --cores N (default: all), --log-dir <dir>, --stages a,b,... (run only these; dependencies outside
+# the list are assumed done), --cache-dir <dir> (default $ARTIFACT_CACHE; no caching if neither is set),
+# --dry-run (print the stages and exit)
+if __name__ == "__main__":
+    options = {"--cores": None, "--log-dir": None, "--stages": None, "--cache-dir": os.environ.get("ARTIFACT_CACHE")}
+    dry_run = False
+    args = []
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == "--dry-run":
+            dry_run = True
+            i += 1
+        elif sys.argv[i] in options:
+            options[sys.argv[i]] = sys.argv[i + 1]
+            i += 2
+        else:
+            args.append(sys.argv[i])
+            i += 1
+
+    if len(args) >= 3 and args[0] == "combined":
+        stages = combined_stages(args[1], args[2], adversarial=args[3] if len(args) > 3 else None)
+    elif len(args) == 3 and args[0] == "baseline":
+        stages = baseline_stages(args[1], args[2])
+    else:
+        print("Usage: python utils/pipeline.py combined <run mode> <predict domain> [domain|gan] [options]", flush=True)
+        print("       python utils/pipeline.py baseline <train domain> <predict domain> [options]", flush=True)
+        sys.exit(1)
+
+    if options["--stages"] is not None:
+        selected = options["--stages"].split(",")
+        stages = [stage for stage in stages if stage.name in selected]
+        for stage in stages:
+            stage.deps = [dep for dep in stage.deps if dep in selected]
+
+    if dry_run:
+        for stage in stages:
+            print("%s: %s (cores %d, tasks %s, after %s)" % (stage.name,
+                                                             " ".join(stage.argv),
+                                                             stage.cores,
+                                                             "1" if stage.array is None else "%d-%d" % (stage.array[0], stage.array[-1]),
+                                                             ",".join(stage.deps) if len(stage.deps) > 0 else "-"),
+                  flush=True)
+        sys.exit(0)
+
+    if args[0] == "combined":
+        link_md_to_am(stages, args[3] if len(args) > 3 else None)
+
+    log_dir = options["--log-dir"]
+    if log_dir is None:
+        log_dir = os.path.join(os.environ.get("LOGS", repo_root), "pipeline", time.strftime("%Y%m%d-%H%M%S"))
+    runner = PipelineRunner(stages,
+                            cores=int(options["--cores"]) if options["--cores"] is not None else None,
+                            log_dir=log_dir,
+                            cache=ArtifactCache(options["--cache-dir"]) if options["--cache-dir"] is not None else None)
+    sys.exit(0 if runner.run() else 1)
@@ -0,0 +1,119 @@
+import hashlib
+import math
+import os
+
+# Virtual SCP files: compose existing Hao (or alignment) SCPs without copying any ARK data
+# Each entry is (utt_id, "path:pos", base_utt_id), where base_utt_id is the ID before any prefix remapping;
+# subsampling and speaker filtering use the base ID, so parallel views (e.g. features and their
+# alignments, or IHM data and its IHM->SDM1 translation) always select the same utterances.
+# Views can be passed anywhere HaoDataset/HaoEvalDataset expect an SCP path.
+class ScpView(object):
+    def __init__(self, entries):
+        self.entries = list(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def utt_ids(self):
+        return [entry[0] for entry in self.entries]
+
+    def scp_lines(self):
+        return ["%s %s\n" % (utt_id, path_pos) for utt_id, path_pos, base_utt_id in self.entries]
+
+    # Concatenate with other views, in order
+    def union(self, *others):
+        entries = list(self.entries)
+        for other in others:
+            entries.extend(other.entries)
+        return ScpView(entries)
+
+    # Keep a fixed fraction of utterances; the same (fraction, seed) always keeps the same utterances
+    def subsample(self, fraction, seed=0):
+        threshold = int(fraction * 2 ** 32)
+        return ScpView([entry for entry in self.entries if utt_hash(entry[2], seed) < threshold])
+
+    # Keep a fixed fraction of utterances, ordered so that every prefix covers all speakers in proportion to
+    # their share of the view (systematic interleaving of each speaker's utterances in hash order).
+    # Reading the result front to back gives an ever-larger stratified sample, e.g. for early-exit validation.
+    def stratified_subset(self, fraction, seed=0, speaker_fn=None):
+        if speaker_fn is None:
+            speaker_fn = ami_speaker
+        by_speaker = dict()
+        for entry in self.entries:
+            by_speaker.setdefault(speaker_fn(entry[2]), []).append(entry)
+
+        keyed_entries = []
+        for speaker, speaker_entries in by_speaker.items():
+            speaker_entries.sort(key=lambda entry: utt_hash(entry[2], seed))
+            for i, entry in enumerate(speaker_entries):
+                keyed_entries.append(((i + 0.5) / len(speaker_entries), utt_hash(entry[2], seed), entry))
+        keyed_entries.sort(key=lambda keyed_entry: keyed_entry[:2])
+
+        num_entries = min(len(keyed_entries), max(1, int(math.ceil(fraction * len(keyed_entries)))))
+        return ScpView([keyed_entry[2] for keyed_entry in keyed_entries[:num_entries]])
+
+    # Keep only utterances from the given speakers
+    def filter_speakers(self, speakers, speaker_fn=None):
+        if speaker_fn is None:
+            speaker_fn = ami_speaker
+        speakers = set(speakers)
+        return ScpView([entry for entry in self.entries if speaker_fn(entry[2]) in speakers])
+
+    # Remap utterance IDs, as done for augmented data with `sed -e 's/^/src_ihm_tar_sdm1_/'`
+    def prefix(self, utt_prefix):
+        return ScpView([(utt_prefix + utt_id, path_pos, base_utt_id) for utt_id, path_pos, base_utt_id in self.entries])
+
+    def speakers(self, speaker_fn=None):
+        if speaker_fn is None:
+            speaker_fn = ami_speaker
+        return sorted(set(speaker_fn(entry[2]) for entry in self.entries))
+
+    # Only needed for external binaries that must be handed a real SCP file
+    def write(self, scp_path):
+        with open(scp_path, 'w') as scp_fd:
+            scp_fd.writelines(self.scp_lines())
+
+def scp_view(scp_path):
+    entries = []
+    with open(scp_path, 'r') as scp_file:
+        for scp_line in scp_file:
+            scp_line = scp_line.rstrip('\n')
+            if len(scp_line) == 0:
+                continue
+            utt_id, path_pos = scp_line.split(' ')
+            entries.append((utt_id, path_pos, utt_id))
+    return ScpView(entries)
+
+# Stable across runs and machines (unlike Python's built-in hash)
+def utt_hash(utt_id, seed=0):
+    digest = hashlib.md5(("%d:%s" % (seed, utt_id)).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big")
+
+# Kaldi AMI utterance IDs look like AMI_ES2011a_H00_FEE041_0003427_0003714
+# (augmented data adds a src_*_tar_*_ prefix in front)
+def ami_speaker(utt_id):
+    parts = utt_id.split("_")
+    if "AMI" in parts:
+        ami_idx = parts.index("AMI")
+        if len(parts) > ami_idx + 3:
+            return parts[ami_idx + 3]
+    # Kaldi convention: speaker ID is the prefix of the utterance ID
+    return parts[0]
+
+def ami_meeting(utt_id):
+    parts = utt_id.split("_")
+    if "AMI" in parts:
+        ami_idx = parts.index("AMI")
+        if len(parts) > ami_idx + 1:
+            return parts[ami_idx + 1]
+    return parts[0]
+
+# Optional quick-experiment subset of a full-corpus SCP, controlled by DATASET_FRACTION (default: everything)
+def scp_source_from_env(scp_path):
+    fraction = float(os.environ.get("DATASET_FRACTION", "1.0"))
+    if fraction >= 1.0:
+        return scp_path
+    return scp_view(scp_path).subsample(fraction, seed=int(os.environ.get("DATASET_FRACTION_SEED", "0")))
@@ -0,0 +1,161 @@
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+# Named wall-clock timers and counters for the hot loops of train_md.py and augment_md.py
+# Usage:
+#   timer = PhaseTimer(enabled=True, report_interval=300)
+#   timer.start("data_fetch"); ...; timer.stop("data_fetch")
+#   with timer.time("checkpoint"): ...
+#   timer.count("frames", n)
+# When disabled, every call returns right away, so instrumentation can stay in place for production runs.
+# GPU work is asynchronous; pass sync=torch.cuda.synchronize to charge kernels to the phase that launched them
+# (at the cost of some overlap between phases).
+
+
+
+class NullContext(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NULL_CONTEXT = NullContext()
+
+class PhaseContext(object):
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer.start(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.stop(self.name)
+        return False
+
+class PhaseTimer(object):
+    def __init__(self, enabled=True, report_interval=0.0, sync=None):
+        self.enabled = enabled
+        self.report_interval = report_interval
+        self.sync = sync
+
+        self.totals = OrderedDict()     # Name -> total seconds
+        self.calls = OrderedDict()      # Name -> number of start/stop pairs
+        self.counters = OrderedDict()   # Name -> running count (frames, batches...)
+        self.running = dict()           # Name -> start time of the open interval
+
+        self.start_t = time.perf_counter()
+        self.last_report_t = self.start_t
+
+    def start(self, name):
+        if not self.enabled:
+            return
+        if self.sync is not None:
+            self.sync()
+        self.running[name] = time.perf_counter()
+
+    def stop(self, name):
+        if not self.enabled:
+            return
+        if self.sync is not None:
+            self.sync()
+        self.add(name, time.perf_counter() - self.running.pop(name))
+
+    def time(self, name):
+        if not self.enabled:
+            return NULL_CONTEXT
+        return PhaseContext(self, name)
+
+    def add(self, name, seconds):
+        if not self.enabled:
+            return
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    # Times every next() on an iterator (e.g. a DataLoader) under the given name
+    def timed_iter(self, iterable, name):
+        iterator = iter(iterable)
+        while True:
+            self.start(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.running.pop(name, None)
+                return
+            self.stop(name)
+            yield item
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_t
+
+    def summary(self):
+        elapsed = self.elapsed()
+        phases = OrderedDict()
+        for name, total in sorted(self.totals.items(), key=lambda item: -item[1]):
+            phases[name] = {
+                "seconds": total,
+                "fraction": total / elapsed if elapsed > 0 else 0.0,
+                "calls": self.calls[name],
+                "ms_per_call": 1000.0 * total / self.calls[name],
+            }
+        return {
+            "elapsed_seconds": elapsed,
+            "timed_seconds": sum(self.totals.values()),
+            "phases": phases,
+            "counters": dict(self.counters),
+        }
+
+    def print_breakdown(self, title="TIMING", out=sys.stdout):
+        if not self.enabled:
+            return
+        summary = self.summary()
+        print("%s (%.1fs elapsed, %.1f%% timed)" % (title,
+                                                   summary["elapsed_seconds"],
+                                                   100.0 * summary["timed_seconds"] / max(summary["elapsed_seconds"], 1e-9)),
+              file=out, flush=True)
+        for name, phase in summary["phases"].items():
+            print("  %-28s %10.3fs %6.1f%% %10d calls %10.3f ms/call" % (name,
+                                                                          phase["seconds"],
+                                                                          100.0 * phase["fraction"],
+                                                                          phase["calls"],
+                                                                          phase["ms_per_call"]),
+                  file=out, flush=True)
+        for name, value in summary["counters"].items():
+            print("  %-28s %10d (%.1f/s)" % (name, value, value / max(summary["elapsed_seconds"], 1e-9)), file=out, flush=True)
+
+    # Print a breakdown if report_interval seconds have passed since the last one
+    def maybe_report(self, out=sys.stdout):
+        if not self.enabled or self.report_interval <= 0:
+            return
+        now = time.perf_counter()
+        if now - self.last_report_t >= self.report_interval:
+            self.last_report_t = now
+            self.print_breakdown(out=out)
+
+    def write_json(self, path):
+        if not self.enabled:
+            return
+        with open(path, 'w') as json_fd:
+            json.dump(self.summary(), json_fd, indent=2)
+
+# Configured from TIMING (true/false) and TIMING_INTERVAL (seconds between breakdowns; 0 = only at the end)
+def timer_from_env(sync=None):
+    return PhaseTimer(enabled=os.environ.get("TIMING", "false") == "true",
+                      report_interval=float(os.environ.get("TIMING_INTERVAL", "300")),
+                      sync=sync)
+
+# Final breakdown, plus the JSON summary if TIMING_JSON names a file
+def finish_timing(timer, title="TIMING SUMMARY"):
+    timer.print_breakdown(title=title)
+    if "TIMING_JSON" in os.environ:
+        timer.write_json(os.environ["TIMING_JSON"])
@@ -0,0 +1,368 @@
+import math
+import os
+import pickle
+import re
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+# Incremental metrics over every training log under a directory (e.g. $LOG_DIR)
+# Understands frame-tdnn-learn / am/train_tdnn.py epoch logs ("E: <loss>" lines) and cnn/scripts/train_md.py logs
+# (per-class "===> <loss>: <value>" blocks after train progress, validation and final TRAINING/DEV SET headers).
+# Each log is read from the byte offset where the previous update stopped, so re-running only parses new lines.
+# A log that was rewritten in the meantime (new inode, shrunk, or different first bytes -- e.g. an epoch re-run with
+# "> $epoch_log", or a rotated and restarted train.bash log) drops its run's stats, and every log of that run is
+# parsed again from the start.
+# State (offsets and running stats) is pickled to <store>.state; summaries go to <store>.npz, one array per column.
+
+
+
+# RUNNING STATISTICS
+
+
+
+# O(1) per value: windowed mean via a bounded deque and running window sum, EMA, totals
+# Infinite/NaN values are counted but otherwise ignored (as avg-e.py always skipped "inf" losses)
+class RollingStats(object):
+    def __init__(self, window=100, ema_alpha=0.01):
+        self.window = deque(maxlen=window)
+        self.window_sum = 0.0
+        self.ema_alpha = ema_alpha
+        self.ema = None
+        self.count = 0
+        self.total = 0.0
+        self.inf_count = 0
+        self.last = float('nan')
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, value):
+        if math.isinf(value) or math.isnan(value):
+            self.inf_count += 1
+            return
+
+        if len(self.window) == self.window.maxlen:
+            self.window_sum -= self.window[0]
+        self.window.append(value)
+        self.window_sum += value
+
+        self.ema = value if self.ema is None else self.ema + self.ema_alpha * (value - self.ema)
+        self.count += 1
+        self.total += value
+        self.last = value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else float('nan')
+
+    def window_mean(self):
+        return self.window_sum / len(self.window) if len(self.window) > 0 else float('nan')
+
+
+
+# LOG PARSING
+
+
+
+epoch_log_re = re.compile(r"-epoch(\d+)$")
+train_md_epoch_re = re.compile(r"^STARTING EPOCH (\d+)")
+train_md_progress_re = re.compile(r"^Train epoch (\d+), iteration (\d+):")
+train_md_val_re = re.compile(r"^EPOCH (\d+), ITER (\d+) VALIDATION")
+train_md_class_re = re.compile(r"^=> Class (\S+)")
+train_md_loss_re = re.compile(r"^===> (\S+): (\S+)$")
+train_md_total_re = re.compile(r"^TOTAL: (\S+)$")
+train_md_best_re = re.compile(r"^New best val set loss: (\S+)$")
+
+log_head_size = 4096
+
+def parse_float(value_str):
+    try:
+        return float(value_str)
+    except ValueError:
+        return float('nan')
+
+# Per-log parser state; a run is a log path relative to the log directory, without ".log" and "-epochN"
+class LogState(object):
+    def __init__(self, run, epoch):
+        self.offset = 0
+        self.run = run
+        self.epoch = epoch
+        self.phase = "train"
+        self.decoder_class = None
+
+        # Identity of the file parsed so far: inode and its first (up to log_head_size) bytes
+        self.inode = None
+        self.head = b""
+
+    # True if log_path is no longer the file parsed so far
+    def replaced(self, log_path, stat):
+        if self.inode is None:
+            return False
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            return True
+        with open(log_path, 'rb') as log_fd:
+            return log_fd.read(len(self.head)) != self.head
+
+    def record_identity(self, log_path, stat):
+        self.inode = stat.st_ino
+        if len(self.head) < log_head_size:
+            with open(log_path, 'rb') as log_fd:
+                self.head = log_fd.read(min(log_head_size, self.offset))
+
+    # Returns a list of (epoch, metric name, value)
+    def parse_line(self, line):
+        line = line.strip()
+        if line.startswith("E: "):
+            return [(self.epoch, "E", parse_float(line.split()[1]))]
+
+        match = train_md_epoch_re.match(line)
+        if match:
+            self.epoch = int(match.group(1))
+            self.phase = "train"
+            return []
+        match = train_md_progress_re.match(line)
+        if match:
+            self.epoch = int(match.group(1))
+            self.phase = "train"
+            return []
+        match = train_md_val_re.match(line)
+        if match:
+            self.phase = "val"
+            return []
+        if line == "TRAINING SET":
+            self.phase = "final_train"
+            return []
+        if line == "DEV SET":
+            self.phase = "final_dev"
+            return []
+
+        match = train_md_class_re.match(line)
+        if match:
+            self.decoder_class = match.group(1)
+            return []
+        match = train_md_loss_re.match(line)
+        if match and not match.group(1).startswith("Total"):
+            return [(self.epoch, "%s/%s/%s" % (self.phase, self.decoder_class, match.group(1).rstrip(":")),
+                     parse_float(match.group(2)))]
+        match = train_md_total_re.match(line)
+        if match:
+            return [(self.epoch, "%s/total" % self.phase, parse_float(match.group(1)))]
+        match = train_md_best_re.match(line)
+        if match:
+            return [(self.epoch, "best_val_loss", parse_float(match.group(1)))]
+        return []
+
+
+
+# AGGREGATION
+
+
+
+class MetricsAggregator(object):
+    def __init__(self, log_dir, window=100, ema_alpha=0.01):
+        self.log_dir = log_dir
+        self.window = window
+        self.ema_alpha = ema_alpha
+
+        self.logs = dict()          # Log path -> LogState
+        self.run_stats = dict()     # (run, metric) -> RollingStats
+        self.epoch_stats = dict()   # (run, epoch, metric) -> RollingStats
+
+    def new_stats(self):
+        return RollingStats(window=self.window, ema_alpha=self.ema_alpha)
+
+    def log_paths(self):
+        for root, dirs, files in os.walk(self.log_dir):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.endswith(".log"):
+                    yield os.path.join(root, filename)
+
+    def add(self, run, epoch, metric, value):
+        if (run, metric) not in self.run_stats:
+            self.run_stats[(run, metric)] = self.new_stats()
+        self.run_stats[(run, metric)].add(value)
+        if (run, epoch, metric) not in self.epoch_stats:
+            self.epoch_stats[(run, epoch, metric)] = self.new_stats()
+        self.epoch_stats[(run, epoch, metric)].add(value)
+
+    # Fresh parser state for a log, with the run and epoch taken from its path
+    def new_log_state(self, log_path):
+        run = os.path.relpath(log_path, self.log_dir)[:-len(".log")]
+        epoch = 0
+        match = epoch_log_re.search(run)
+        if match:
+            epoch = int(match.group(1))
+            run = run[:match.start()]
+        return LogState(run, epoch)
+
+    # Forget everything parsed for the run; its logs are read again from the start
+    def reset_run(self, run):
+        self.run_stats = {key: stats for key, stats in self.run_stats.items() if key[0] != run}
+        self.epoch_stats = {key: stats for key, stats in self.epoch_stats.items() if key[0] != run}
+        for log_path, state in self.logs.items():
+            if state.run == run:
+                self.logs[log_path] = self.new_log_state(log_path)
+
+    # Read whatever was appended to each log since the last update; returns number of bytes parsed
+    def update(self):
+        log_stats = dict()
+        for log_path in self.log_paths():
+            if log_path not in self.logs:
+                self.logs[log_path] = self.new_log_state(log_path)
+            log_stats[log_path] = os.stat(log_path)
+
+        # Runs with a rewritten log are parsed again from scratch, since their stats include the old contents
+        replaced_runs = set(self.logs[log_path].run for log_path, stat in log_stats.items()
+                            if self.logs[log_path].replaced(log_path, stat))
+        for run in sorted(replaced_runs):
+            print("Log of run %s was rewritten; parsing its logs again" % run, flush=True)
+            self.reset_run(run)
+
+        bytes_read = 0
+        for log_path, stat in log_stats.items():
+            state = self.logs[log_path]
+            size = stat.st_size
+            if size == state.offset:
+                state.record_identity(log_path, stat)
+                continue
+
+            with open(log_path, 'rb') as log_fd:
+                log_fd.seek(state.offset)
+                data = log_fd.read(size - state.offset)
+
+            # Only consume complete lines; a partly written last line is picked up next time
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].decode("utf-8", errors="replace").split("\n"):
+                for epoch, metric, value in state.parse_line(line):
+                    self.add(state.run, epoch, metric, value)
+            state.offset += end
+            state.record_identity(log_path, stat)
+            bytes_read += end
+        return bytes_read
+
+    def save(self, store_prefix):
+        # Plain dicts only, so the state loads no matter how this module was imported
+        state = {
+            "log_dir": self.log_dir,
+            "window": self.window,
+            "ema_alpha": self.ema_alpha,
+            "logs": {log_path: vars(log_state) for log_path, log_state in self.logs.items()},
+            "run_stats": {key: vars(stats) for key, stats in self.run_stats.items()},
+            "epoch_stats": {key: vars(stats) for key, stats in self.epoch_stats.items()},
+        }
+        with open(store_prefix + ".state.tmp", 'wb') as state_fd:
+            pickle.dump(state, state_fd)
+        os.replace(store_prefix + ".state.tmp", store_prefix + ".state")
+
+        rows = [(run, -1, metric, stats) for (run, metric), stats in self.run_stats.items()]
+        rows.extend([(run, epoch, metric, stats) for (run, epoch, metric), stats in self.epoch_stats.items()])
+        rows.sort(key=lambda row: (row[0], row[1], row[2]))
+        columns = {
+            "run": np.asarray([row[0] for row in rows], dtype=str),
+            "epoch": np.asarray([row[1] for row in rows], dtype=np.int32),     # -1 for whole-run rows
+            "metric": np.asarray([row[2] for row in rows], dtype=str),
+            "count": np.asarray([row[3].count for row in rows], dtype=np.int64),
+            "inf_count": np.asarray([row[3].inf_count for row in rows], dtype=np.int64),
+            "mean": np.asarray([row[3].mean() for row in rows], dtype=np.float64),
+            "window_mean": np.asarray([row[3].window_mean() for row in rows], dtype=np.float64),
+            "ema": np.asarray([row[3].ema if row[3].ema is not None else float('nan') for row in rows], dtype=np.float64),
+            "last": np.asarray([row[3].last for row in rows], dtype=np.float64),
+            "min": np.asarray([row[3].min for row in rows], dtype=np.float64),
+            "max": np.asarray([row[3].max for row in rows], dtype=np.float64),
+        }
+        with open(store_prefix + ".npz.tmp", 'wb') as store_fd:
+            np.savez_compressed(store_fd, **columns)
+        os.replace(store_prefix + ".npz.tmp", store_prefix + ".npz")
+
+def load_aggregator(store_prefix, log_dir, window=100, ema_alpha=0.01):
+    if os.path.exists(store_prefix + ".state"):
+        with open(store_prefix + ".state", 'rb') as state_fd:
+            state = pickle.load(state_fd)
+        if state["log_dir"] == log_dir and state["window"] == window and state["ema_alpha"] == ema_alpha:
+            aggregator = MetricsAggregator(log_dir, window=window, ema_alpha=ema_alpha)
+            # (states saved before file identities were tracked get inode=None, and adopt the current file)
+            aggregator.logs = {log_path: restore(LogState, dict({"inode": None, "head": b""}, **fields))
+                               for log_path, fields in state["logs"].items()}
+            aggregator.run_stats = {key: restore(RollingStats, fields) for key, fields in state["run_stats"].items()}
+            aggregator.epoch_stats = {key: restore(RollingStats, fields) for key, fields in state["epoch_stats"].items()}
+            return aggregator
+    return MetricsAggregator(log_dir, window=window, ema_alpha=ema_alpha)
+
+def restore(cls, fields):
+    obj = cls.__new__(cls)
+    obj.__dict__.update(fields)
+    return obj
+
+# Columns as a dict of arrays, without touching any log
+def load_store(store_prefix):
+    with np.load(store_prefix + ".npz") as store:
+        return {column: store[column] for column in store.files}
+
+def print_store(columns, run_pattern=None, metric_pattern=None, whole_run_only=True):
+    run_re = re.compile(run_pattern) if run_pattern is not None else None
+    metric_re = re.compile(metric_pattern) if metric_pattern is not None else None
+    for i in range(len(columns["run"])):
+        if whole_run_only and columns["epoch"][i] != -1:
+            continue
+        if run_re is not None and not run_re.search(columns["run"][i]):
+            continue
+        if metric_re is not None and not metric_re.search(columns["metric"][i]):
+            continue
+        epoch_str = "all" if columns["epoch"][i] == -1 else str(columns["epoch"][i])
+        print("%s\tepoch %s\t%s\tn=%d inf=%d mean=%.4f window=%.4f ema=%.4f last=%.4f" % (columns["run"][i],
+                                                                                         epoch_str,
+                                                                                         columns["metric"][i],
+                                                                                         columns["count"][i],
+                                                                                         columns["inf_count"][i],
+                                                                                         columns["mean"][i],
+                                                                                         columns["window_mean"][i],
+                                                                                         columns["ema"][i],
+                                                                                         columns["last"][i]),
+              flush=True)
+
+
+
+# Usage:
+#   python utils/train_metrics.py update <log dir> <store prefix> [--window K] [--ema ALPHA] [--follow SECONDS]
+#   python utils/train_metrics.py show <store prefix> [<run regex> [<metric regex>]] [--epochs]
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ["update", "show"]:
+        print("Usage: python utils/train_metrics.py update <log dir> <store prefix> [--window K] [--ema ALPHA] [--follow SECONDS]",
+              flush=True)
+        print("       python utils/train_metrics.py show <store prefix> [<run regex> [<metric regex>]] [--epochs]", flush=True)
+        sys.exit(1)
+
+    if sys.argv[1] == "update":
+        log_dir = sys.argv[2]
+        store_prefix = sys.argv[3]
+        window = 100
+        ema_alpha = 0.01
+        follow = None
+        i = 4
+        while i < len(sys.argv):
+            if sys.argv[i] == "--window":
+                window = int(sys.argv[i + 1])
+            elif sys.argv[i] == "--ema":
+                ema_alpha = float(sys.argv[i + 1])
+            elif sys.argv[i] == "--follow":
+                follow = float(sys.argv[i + 1])
+            i += 2
+
+        aggregator = load_aggregator(store_prefix, log_dir, window=window, ema_alpha=ema_alpha)
+        while True:
+            bytes_read = aggregator.update()
+            aggregator.save(store_prefix)
+            print("Read %d new bytes from %d logs" % (bytes_read, len(aggregator.logs)), flush=True)
+            if follow is None:
+                break
+            time.sleep(follow)
+    else:
+        args = [arg for arg in sys.argv[3:] if arg != "--epochs"]
+        print_store(load_store(sys.argv[2]),
+                    run_pattern=args[0] if len(args) > 0 else None,
+                    metric_pattern=args[1] if len(args) > 1 else None,
+                    whole_run_only="--epochs" not in sys.argv)
@@ -0,0 +1,319 @@
+import fcntl
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+# In-RAM caches of decoded float32 utterance matrices, so multi-epoch training parses each text ARK entry once
+# Keys are ARK locations including the ARK file's identity (see utt_cache_key() in utils/hao_data.py), so views
+# with remapped utterance IDs share entries, but a rewritten ARK doesn't. Cached matrices are read-only (callers
+# copy before modifying them, as for mapped Kaldi binary ARKs).
+#   UttCache: per-process, LRU eviction by bytes under a memory budget
+#   SharedUttCache: one multiprocessing.shared_memory arena per box, shared by loader workers and concurrent
+#                   training runs that use the same name; fills up to its budget and then stops inserting
+# DataLoader workers are recreated for every epoch, so with num_workers > 0 only the shared cache lasts
+# from one epoch to the next.
+
+
+
+# PER-PROCESS CACHE
+
+
+
+class UttCache(object):
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # Key -> matrix, least recently used first
+        self.current_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self.evictions = 0
+        self.rejects = 0                # Matrices larger than the whole budget
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        mat = self.entries.get(key)
+        if mat is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return mat
+
+    # Returns the cached (read-only) copy, or mat itself if it doesn't fit
+    def put(self, key, mat):
+        if key in self.entries:
+            return self.entries[key]
+
+        mat = np.array(mat, dtype=np.float32, order='C')
+        if mat.nbytes > self.max_bytes:
+            self.rejects += 1
+            return mat
+        while self.current_bytes + mat.nbytes > self.max_bytes:
+            evicted_key, evicted_mat = self.entries.popitem(last=False)
+            self.current_bytes -= evicted_mat.nbytes
+            self.evictions += 1
+
+        mat.setflags(write=False)
+        self.entries[key] = mat
+        self.current_bytes += mat.nbytes
+        self.inserts += 1
+        return mat
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return OrderedDict([("entries", len(self.entries)),
+                            ("bytes", self.current_bytes),
+                            ("max_bytes", self.max_bytes),
+                            ("hits", self.hits),
+                            ("misses", self.misses),
+                            ("hit_rate", self.hits / lookups if lookups > 0 else 0.0),
+                            ("inserts", self.inserts),
+                            ("evictions", self.evictions),
+                            ("rejects", self.rejects)])
+
+
+
+# SHARED-MEMORY CACHE
+
+
+
+# Arena layout: header, fixed-size index, then 64-byte-aligned float32 matrices
+# Header: magic, data capacity, max entries, entries published, data bytes used (uint64 each)
+# Index entry: 16-byte MD5 of the key, data offset (uint64), rows, cols (uint32)
+# Entries are append-only: data and index entry are written first, then the entry count is bumped under the
+# lock file, so readers never see a partial matrix and need no lock themselves.
+SHM_MAGIC = 0x48414f4341434845   # "HAOCACHE"
+SHM_HEADER = struct.Struct("<QQQQQ")
+SHM_INDEX_ENTRY = struct.Struct("<16sQII")
+SHM_HEADER_SIZE = 64
+SHM_ALIGN = 64
+
+def key_digest(key):
+    return hashlib.md5(key.encode("utf-8")).digest()
+
+def align(size):
+    return (size + SHM_ALIGN - 1) // SHM_ALIGN * SHM_ALIGN
+
+class SharedUttCache(object):
+    # max_entries defaults to one per 16KB of budget (AMI utterances average ~100KB of log-Mel features)
+    def __init__(self, name, max_bytes, max_entries=None):
+        from multiprocessing import shared_memory
+
+        self.name = name
+        self.lock_path = os.path.join(tempfile.gettempdir(), "%s.lock" % name)
+        self.lock_fd = None
+        self.lock_pid = None
+        if max_entries is None:
+            max_entries = max(1024, max_bytes // 16384)
+
+        with self.locked():
+            try:
+                self.shm = shared_memory.SharedMemory(name=name)
+                created = False
+            except FileNotFoundError:
+                index_size = align(max_entries * SHM_INDEX_ENTRY.size)
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=SHM_HEADER_SIZE + index_size + max_bytes)
+                SHM_HEADER.pack_into(self.shm.buf, 0, SHM_MAGIC, max_bytes, max_entries, 0, 0)
+                created = True
+        # The arena is meant to outlive this process (later epochs' loader workers, other runs); without this,
+        # Python's resource tracker would unlink it at exit. Remove it explicitly with unlink() or "clear" below.
+        unregister_shared_memory(self.shm)
+
+        magic, self.capacity, self.max_entries, num_entries, used_bytes = SHM_HEADER.unpack_from(self.shm.buf, 0)
+        if magic != SHM_MAGIC:
+            raise RuntimeError("Shared memory segment %s is not an utterance cache" % name)
+        self.index_start = SHM_HEADER_SIZE
+        self.data_start = SHM_HEADER_SIZE + align(self.max_entries * SHM_INDEX_ENTRY.size)
+        if created:
+            print("Created shared utterance cache %s (%.1f MB)" % (name, self.capacity / (1024.0 * 1024.0)), flush=True)
+
+        self.index = dict()     # Digest -> (offset, rows, cols), for entries seen so far by this process
+        self.indexed = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self.rejects = 0        # Arena full (or entry table full)
+
+    # The lock file descriptor is per process: flock() doesn't exclude a forked child sharing its parent's descriptor
+    def locked(self):
+        if self.lock_pid != os.getpid():
+            self.lock_fd = open(self.lock_path, 'a')
+            self.lock_pid = os.getpid()
+        return FileLock(self.lock_fd)
+
+    def header(self):
+        return SHM_HEADER.unpack_from(self.shm.buf, 0)
+
+    # Pick up entries other processes published since the last refresh
+    def refresh(self):
+        num_entries = self.header()[3]
+        for entry_idx in range(self.indexed, num_entries):
+            digest, offset, rows, cols = SHM_INDEX_ENTRY.unpack_from(self.shm.buf, self.index_start + entry_idx * SHM_INDEX_ENTRY.size)
+            self.index[digest] = (offset, rows, cols)
+        self.indexed = num_entries
+
+    def matrix(self, offset, rows, cols):
+        mat = np.ndarray((rows, cols), dtype=np.float32, buffer=self.shm.buf, offset=self.data_start + offset)
+        mat.setflags(write=False)
+        return mat
+
+    def lookup(self, digest):
+        entry = self.index.get(digest)
+        if entry is None:
+            self.refresh()
+            entry = self.index.get(digest)
+        return entry
+
+    def get(self, key):
+        entry = self.lookup(key_digest(key))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.matrix(*entry)
+
+    # Returns the shared (read-only) copy, or mat itself once the arena is full
+    def put(self, key, mat):
+        digest = key_digest(key)
+        mat = np.asarray(mat, dtype=np.float32)
+        with self.locked():
+            entry = self.lookup(digest)
+            if entry is not None:
+                # Another process inserted it in the meantime
+                return self.matrix(*entry)
+
+            magic, capacity, max_entries, num_entries, used_bytes = self.header()
+            size = align(mat.nbytes)
+            if num_entries >= max_entries or used_bytes + size > capacity:
+                self.rejects += 1
+                return mat
+
+            shared_mat = np.ndarray(mat.shape, dtype=np.float32, buffer=self.shm.buf, offset=self.data_start + used_bytes)
+            shared_mat[...] = mat
+            SHM_INDEX_ENTRY.pack_into(self.shm.buf,
+                                      self.index_start + num_entries * SHM_INDEX_ENTRY.size,
+                                      digest, used_bytes, mat.shape[0], mat.shape[1])
+            SHM_HEADER.pack_into(self.shm.buf, 0, magic, capacity, max_entries, num_entries + 1, used_bytes + size)
+            self.index[digest] = (used_bytes, mat.shape[0], mat.shape[1])
+            self.indexed = num_entries + 1
+        self.inserts += 1
+        return self.matrix(used_bytes, mat.shape[0], mat.shape[1])
+
+    def stats(self):
+        magic, capacity, max_entries, num_entries, used_bytes = self.header()
+        lookups = self.hits + self.misses
+        return OrderedDict([("entries", num_entries),
+                            ("bytes", used_bytes),
+                            ("max_bytes", capacity),
+                            ("hits", self.hits),
+                            ("misses", self.misses),
+                            ("hit_rate", self.hits / lookups if lookups > 0 else 0.0),
+                            ("inserts", self.inserts),
+                            ("evictions", 0),
+                            ("rejects", self.rejects)])
+
+    def close(self):
+        self.index = dict()
+        self.indexed = 0
+        self.shm.close()
+
+    # Free the arena for every process on the box (ones still attached keep their mapping until they close it)
+    def unlink(self):
+        # SharedMemory.unlink() also unregisters the segment from the resource tracker, so register it back first
+        register_shared_memory(self.shm)
+        self.shm.unlink()
+        if os.path.exists(self.lock_path):
+            os.remove(self.lock_path)
+
+class FileLock(object):
+    def __init__(self, lock_fd):
+        self.lock_fd = lock_fd
+
+    def __enter__(self):
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+        return False
+
+def register_shared_memory(shm):
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.register(shm._name, "shared_memory")
+    except (ImportError, AttributeError):
+        pass
+
+def unregister_shared_memory(shm):
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except (ImportError, AttributeError, KeyError):
+        pass
+
+# UTT_CACHE_MB: budget in megabytes (0 = no cache)
+# UTT_CACHE_SHARED: name of a shared-memory arena to use instead of a per-process cache (e.g. "hao_ami_full")
+def cache_from_env():
+    max_mb = float(os.environ.get("UTT_CACHE_MB", "0"))
+    if max_mb <= 0:
+        return None
+    max_bytes = int(max_mb * 1024 * 1024)
+    shared_name = os.environ.get("UTT_CACHE_SHARED", "")
+    if len(shared_name) > 0:
+        return SharedUttCache(shared_name, max_bytes)
+    return UttCache(max_bytes)
+
+def print_cache_stats(cache, title="Utterance cache"):
+    if cache is None:
+        return
+    stats = cache.stats()
+    print("%s: %d entries, %.1f/%.1f MB, %d hits, %d misses (%.1f%% hit rate), %d inserts, %d evictions, %d rejects" % (
+              title,
+              stats["entries"],
+              stats["bytes"] / (1024.0 * 1024.0),
+              stats["max_bytes"] / (1024.0 * 1024.0),
+              stats["hits"],
+              stats["misses"],
+              100.0 * stats["hit_rate"],
+              stats["inserts"],
+              stats["evictions"],
+              stats["rejects"]),
+          flush=True)
+
+
+
+# Usage:
+#   python utils/utt_cache.py stats <shared cache name>
+#   python utils/utt_cache.py clear <shared cache name>
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ["stats", "clear"]:
+        print("Usage: python utils/utt_cache.py <stats|clear> <shared cache name>", flush=True)
+        sys.exit(1)
+
+    from multiprocessing import shared_memory
+    try:
+        shm = shared_memory.SharedMemory(name=sys.argv[2])
+    except FileNotFoundError:
+        print("No shared utterance cache named %s" % sys.argv[2], flush=True)
+        sys.exit(1)
+    unregister_shared_memory(shm)
+    shm.close()
+
+    cache = SharedUttCache(sys.argv[2], 0)
+    if sys.argv[1] == "stats":
+        print_cache_stats(cache, title="Shared utterance cache %s" % sys.argv[2])
+        cache.close()
+    else:
+        cache.close()
+        cache.unlink()
+        print("Removed shared utterance cache %s" % sys.argv[2], flush=True)